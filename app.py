@@ -30,5 +30,15 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 logger.info("Flask app initialized.")
 
+# Fork the PDF parser processes while this process still has a single thread
+from upload_jobs import start_parser_pool
+start_parser_pool()
+
 # Import routes (after app initialization to avoid circular imports)
-import routes
+from components import timed_phase, start_background_warm_up
+with timed_phase("import:routes"):
+    import routes
+
+# Components are built lazily; warm-up loads models, index and incident embeddings
+# and logs the model registry report once it completes (see /readyz).
+start_background_warm_up()
@@ -0,0 +1,235 @@
+"""
+Recall/latency benchmark for the document index.
+
+Builds an exact (flat) ground truth over the indexed chunk vectors, then builds an HNSW
+index for every M / efConstruction pair and measures recall@k, per-query latency
+percentiles and index memory for every efSearch value. With --factory it also builds
+FAISS index_factory configurations (IVF/PQ/SQ/OPQ), trained on a sample of the vectors,
+and measures them for every --nprobe value, with and without exact re-ranking.
+
+Usage:
+    python benchmark_retrieval.py --m 16,32,48 --ef-construction 40,64,128 --ef-search 16,32,64,128
+    python benchmark_retrieval.py --queries compliance_questions.txt --k 5 --output bench.md
+    python benchmark_retrieval.py --m 32 --ef-construction 64 --ef-search 64 \
+        --factory "HNSW32,SQ8;IVF256,PQ64;OPQ64,IVF256,PQ64" --nprobe 8,32 --rerank 50 --output tradeoffs.md
+
+Reading the trade-off table: "memory MB" is the serialized index plus, for "+rerank" rows,
+the float32 vectors that EmbedDocuments saves next to compressed indexes (doc_vectors.npy,
+memory-mapped and shared between workers rather than resident per worker). SQ8 stores
+vectors at a quarter of their float32 size with little recall loss; PQ64 shrinks 768-d vectors to 64 bytes
+but needs re-ranking to recover recall; IVF trades recall for latency through nprobe and
+needs roughly 39 * nlist training vectors, so pick nlist near 4 * sqrt(N) for the corpus
+at hand. Configure the serving index with FAISS_INDEX_FACTORY, FAISS_NPROBE and
+FAISS_RERANK_K.
+
+Vectors are reconstructed from faiss_index.bin when it exists (the exact vectors being
+served); otherwise the chunk texts are embedded. Without --queries, a seeded sample of chunk
+texts is used as queries.
+"""
+import os
+import time
+import argparse
+import logging
+import numpy as np
+import faiss
+from chunk_store import load_chunk_store, DEFAULT_CHUNK_STORE_PATH
+from model_registry import get_embedding_model
+from index_store import build_index, train_index
+
+logger = logging.getLogger(__name__)
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def _factory_list(value):
+    # Factory strings contain commas, so configurations are separated by semicolons
+    return [v.strip() for v in value.split(";") if v.strip()]
+
+
+def load_vectors(index_path, chunk_store, model_name, reembed=False):
+    """Returns the float32 chunk vectors, from the served index if possible."""
+    if not reembed and os.path.exists(index_path):
+        index = faiss.read_index(index_path)
+        if index.ntotal == len(chunk_store):
+            return index.reconstruct_n(0, index.ntotal)
+        logger.warning("Index size does not match the chunk store; re-embedding chunk texts.")
+    model = get_embedding_model(model_name)
+    texts = [chunk_store.text(i) for i in range(len(chunk_store))]
+    return model.encode(texts, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+
+def load_queries(queries_path, chunk_store, model_name, sample_size, seed):
+    """Returns (query texts, query vectors)."""
+    if queries_path:
+        with open(queries_path, "r", encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        rng = np.random.default_rng(seed)
+        rows = rng.choice(len(chunk_store), size=min(sample_size, len(chunk_store)), replace=False)
+        queries = [chunk_store.text(int(i))[:200] for i in rows]
+    model = get_embedding_model(model_name)
+    return queries, model.encode_queries(queries)
+
+
+def measure(index, queries, ground_truth, k, search_params=None, vectors=None, rerank_k=0):
+    """
+    Runs queries one at a time (as the web app does) and returns recall@k and latency percentiles.
+
+    With rerank_k, rerank_k candidates are fetched and re-scored exactly from vectors (as SearchEngine does).
+    """
+    latencies = []
+    hits = 0
+    for row in range(len(queries)):
+        start = time.perf_counter()
+        if rerank_k:
+            _, candidates = index.search(queries[row:row + 1], max(k, rerank_k), params=search_params)
+            ids = candidates[0][candidates[0] >= 0]
+            diffs = vectors[ids] - queries[row]
+            indices = ids[np.argsort(np.einsum("ij,ij->i", diffs, diffs))[:k]][None, :]
+        else:
+            _, indices = index.search(queries[row:row + 1], k, params=search_params)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(set(indices[0].tolist()) & set(ground_truth[row].tolist()))
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "recall": hits / (len(queries) * k),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+    }
+
+
+def index_bytes(index):
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def run_hnsw_grid(vectors, queries, ground_truth, k, m_values, ef_construction_values, ef_search_values):
+    rows = []
+    for m in m_values:
+        for ef_construction in ef_construction_values:
+            index = faiss.IndexHNSWFlat(vectors.shape[1], m)
+            index.hnsw.efConstruction = ef_construction
+            start = time.perf_counter()
+            index.add(vectors)
+            build_seconds = time.perf_counter() - start
+            memory = index_bytes(index)
+            for ef_search in ef_search_values:
+                params = faiss.SearchParametersHNSW()
+                params.efSearch = max(ef_search, k)
+                result = measure(index, queries, ground_truth, k, params)
+                result.update({
+                    "config": f"HNSW{m},Flat efC={ef_construction} efS={ef_search}",
+                    "build_s": build_seconds,
+                    "memory_mb": memory / (1024 * 1024),
+                })
+                rows.append(result)
+                logger.info(f"{result['config']}: recall@{k}={result['recall']:.3f} p95={result['p95_ms']:.2f}ms")
+    return rows
+
+
+def _factory_params(index, nprobe):
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexPreTransform) else index
+    if not hasattr(inner, "nprobe"):
+        return None
+    params = faiss.SearchParametersIVF()
+    params.nprobe = nprobe
+    if inner is index:
+        return params
+    outer = faiss.SearchParametersPreTransform()
+    outer.index_params = params
+    outer.inner_params = params
+    return outer
+
+
+def run_factory_grid(vectors, queries, ground_truth, k, factories, nprobe_values, rerank_k):
+    rows = []
+    vector_mb = vectors.nbytes / (1024 * 1024)
+    for spec in factories:
+        index = build_index(spec, vectors.shape[1])
+        start = time.perf_counter()
+        train_index(index, vectors)
+        index.add(vectors)
+        build_seconds = time.perf_counter() - start
+        memory_mb = index_bytes(index) / (1024 * 1024)
+
+        is_ivf = _factory_params(index, 1) is not None
+        for nprobe in (nprobe_values if is_ivf else [None]):
+            params = _factory_params(index, nprobe) if is_ivf else None
+            for rerank in sorted({0, rerank_k}):
+                result = measure(index, queries, ground_truth, k, params, vectors, rerank)
+                label = spec + (f" nprobe={nprobe}" if nprobe else "") + (f" +rerank{rerank}" if rerank else "")
+                result.update({
+                    "config": label,
+                    "build_s": build_seconds,
+                    "memory_mb": memory_mb + (vector_mb if rerank else 0.0),
+                })
+                rows.append(result)
+                logger.info(f"{label}: recall@{k}={result['recall']:.3f} p95={result['p95_ms']:.2f}ms")
+    return rows
+
+
+def format_table(rows, k):
+    lines = [
+        f"| config | recall@{k} | p50 ms | p95 ms | p99 ms | memory MB | build s |",
+        "|---|---|---|---|---|---|---|",
+    ]
+    for r in rows:
+        lines.append(
+            f"| {r['config']} | {r['recall']:.3f} | {r['p50_ms']:.3f} | {r['p95_ms']:.3f} | "
+            f"{r['p99_ms']:.3f} | {r['memory_mb']:.1f} | {r['build_s']:.1f} |"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HNSW recall/latency benchmark over the document chunks.")
+    parser.add_argument("--index-path", default="faiss_index.bin")
+    parser.add_argument("--chunk-store", default=DEFAULT_CHUNK_STORE_PATH)
+    parser.add_argument("--mapping-path", default="doc_mapping.npy", help="Legacy mapping if no chunk store")
+    parser.add_argument("--model", default="all-mpnet-base-v2")
+    parser.add_argument("--reembed", action="store_true", help="Embed chunk texts instead of reading the index")
+    parser.add_argument("--queries", help="Text file with one query per line")
+    parser.add_argument("--sample-queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--m", type=_int_list, default=[16, 32, 48])
+    parser.add_argument("--ef-construction", type=_int_list, default=[40, 64, 128])
+    parser.add_argument("--ef-search", type=_int_list, default=[16, 32, 64, 128])
+    parser.add_argument("--factory", type=_factory_list, default=[],
+                        help='Semicolon-separated index_factory strings, e.g. "HNSW32,SQ8;IVF256,PQ64"')
+    parser.add_argument("--nprobe", type=_int_list, default=[8, 32])
+    parser.add_argument("--rerank", type=int, default=50, help="Exact re-ranking depth for factory rows (0 = off)")
+    parser.add_argument("--output", help="Write the markdown table to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    chunk_store = load_chunk_store(args.chunk_store, legacy_mapping_path=args.mapping_path)
+    if chunk_store is None:
+        raise SystemExit("No chunk store or doc mapping found.")
+
+    vectors = load_vectors(args.index_path, chunk_store, args.model, args.reembed)
+    queries, query_vectors = load_queries(args.queries, chunk_store, args.model, args.sample_queries, args.seed)
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, ground_truth = exact.search(query_vectors, args.k)
+    baseline = measure(exact, query_vectors, ground_truth, args.k)
+    baseline.update({"config": "Flat (exact)", "build_s": 0.0, "memory_mb": index_bytes(exact) / (1024 * 1024)})
+
+    rows = [baseline] + run_hnsw_grid(
+        vectors, query_vectors, ground_truth, args.k, args.m, args.ef_construction, args.ef_search
+    )
+    if args.factory:
+        rows += run_factory_grid(vectors, query_vectors, ground_truth, args.k, args.factory, args.nprobe, args.rerank)
+    table = format_table(rows, args.k)
+    print(f"{len(queries)} queries over {len(vectors)} vectors (dim {vectors.shape[1]})\n")
+    print(table)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(table + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,98 +1,134 @@
 import logging
 import time
 import os
-from openai import OpenAI
 from search_engine import SearchEngine
 from embed_documents import EmbedDocuments
-from doc_processor import DocProcessor
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from incident_matcher import find_similar_incidents  # ✅ new module for incident suggestions
+from stage_executor import StagedExecution
+from llm_handler import LLMHandler
+from semantic_cache import get_semantic_cache
+from context_packer import pack_context, format_context, context_budget
+from session_store import get_session_store, SessionQuotaExceeded
+from upload_jobs import UPLOAD_EXTENSIONS
+from history_summarizer import HistorySummarizer, build_history, CHAT_HISTORY_TOKEN_BUDGET
 
 logger = logging.getLogger(__name__)
 
-UPLOADS_FOLDER = "data/uploads"
+UPLOAD_TOP_K = 3  # uploaded chunks added to the context of each turn
+UPLOAD_EMBED_BATCH = 64
+NO_CONTEXT_ANSWER = "I'm sorry, I couldn't find relevant information for your question in the selected documents."
+CHAT_ERROR_ANSWER = "Sorry, I encountered an error while processing your request."
 
 class Chatbot:
-    def __init__(self):
-        self.token = os.getenv("LLMFOUNDRY_TOKEN", "").strip()
-        self.model = "gpt-4o-mini"
-        self.base_url = "https://llmfoundry.straive.com/openai/v1/"
-        self.client = self._initialize_llm_client()
-
-        self.chat_memory = {}  # session_id → {timestamp, messages: []}
-        self.memory_ttl = 3600
-        self.max_memory_messages = 5  # ✅ keep only last 5 messages per session
-
-        self.search_engine = SearchEngine()
-        self.embedder = EmbedDocuments()
+    def __init__(self, search_engine=None, llm_handler=None, session_store=None):
+        # All completions go through the shared LLMHandler (and its response cache)
+        self.llm_handler = llm_handler or LLMHandler()
+
+        # Chat memory and uploads per session, under a byte budget with LRU/TTL eviction
+        self.sessions = session_store or get_session_store()
+        # History sent per turn: running summary + newest messages within a fixed token budget
+        self.history_budget = CHAT_HISTORY_TOKEN_BUDGET
+        self.summarizer = HistorySummarizer(self.llm_handler, self.sessions)
+
+        self.search_engine = search_engine or SearchEngine()
+        self._embedder = None  # chunking helpers, built on the first upload
         self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
 
-        self.uploaded_embeddings = {}  # session_id → list of (chunk_id, chunk_text)
-
-    def _initialize_llm_client(self):
-        if not self.token:
-            logger.warning("LLMFOUNDRY_TOKEN is missing. LLM calls will not work.")
-            return None
-        try:
-            client = OpenAI(api_key=f"{self.token}:my-test-project", base_url=self.base_url)
-            logger.info("LLM Foundry client initialized.")
-            return client
-        except Exception as e:
-            logger.error(f"Error initializing LLM Foundry client: {e}")
-            return None
-
-    def _clean_memory(self):
-        current_time = time.time()
-        expired_sessions = [s for s, d in self.chat_memory.items() if current_time - d["timestamp"] > self.memory_ttl]
-        for s in expired_sessions:
-            self.chat_memory.pop(s, None)
-            self.uploaded_embeddings.pop(s, None)
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            self._embedder = EmbedDocuments()
+        return self._embedder
 
     def clear_memory(self, session_id):
-        self.chat_memory.pop(session_id, None)
-        self.uploaded_embeddings.pop(session_id, None)
+        self.sessions.clear(session_id)
         return True
 
-    def process_uploaded_file(self, session_id, file_path):
+    def extract_upload_chunks(self, file_path):
+        """
+        Extracts and chunks a whole .pdf, .docx or .txt file.
+
+        :return: List of chunk dictionaries with "chunk_id", "text" and "page" (may be empty).
+        """
+        if file_path.lower().endswith(".txt"):
+            with open(file_path, "r", encoding="utf-8") as f:
+                text = f.read().strip()
+            chunks = self.embedder.split_page_into_chunks(1, text) if text else []
+            for chunk in chunks:
+                chunk["page"] = None
+            return chunks
+        return self.embedder.process_file(file_path)
+
+    def index_upload_chunks(self, session_id, doc_name, chunks, job_id=None):
+        """
+        Embeds uploaded chunks once and adds them to the session's uploads, where the next
+        chat turn finds them.
+
+        :param doc_name: Document label used in citations (the uploaded file's name).
+        :param job_id: Background upload job the chunks belong to (see upload_jobs.py).
+        :return: Number of chunks indexed.
+        :raises SessionQuotaExceeded: if the session's upload quota would be exceeded.
+        :raises UploadCancelled: if the job was removed together with its session.
+        """
+        chunks = [c for c in chunks if c.get("text", "").strip()]
+        if not chunks:
+            return 0
+        for chunk in chunks:
+            # Ids are only unique within a file; the label keeps citations pointing at the upload
+            chunk["chunk_id"] = f"upload:{doc_name}:{chunk['chunk_id']}"
+            chunk["doc"] = doc_name
+
+        vectors = self.search_engine.embedder.encode(
+            [c["text"] for c in chunks],
+            batch_size=UPLOAD_EMBED_BATCH,
+            normalize_embeddings=True,
+            convert_to_numpy=True
+        )
+        self.sessions.add_upload(session_id, chunks, vectors, job_id=job_id)
+        return len(chunks)
+
+    def process_uploaded_file(self, session_id, file_path, doc_name=None):
+        """
+        Extracts, chunks and embeds an uploaded file in the calling thread
+        (see upload_jobs.py for background ingestion).
+
+        :return: True if at least one chunk was indexed.
+        """
         logger.info(f"Processing uploaded file for session: {session_id} → {file_path}")
         ext = file_path.lower().split(".")[-1]
-        if ext not in ["pdf", "docx", "txt"]:
+        if ext not in UPLOAD_EXTENSIONS:
             logger.warning(f"Unsupported file type: {file_path}")
             return False
 
-        chunks = []
+        doc_name = doc_name or os.path.basename(file_path)
         try:
-            processor = DocProcessor(UPLOADS_FOLDER)
-            if ext == "pdf":
-                chunks = processor._extract_pdf_chunks(file_path, os.path.basename(file_path))
-            elif ext == "docx":
-                chunks = processor._extract_docx_chunks(file_path, os.path.basename(file_path))
-            elif ext == "txt":
-                with open(file_path, "r", encoding="utf-8") as f:
-                    text = f.read().strip().lower()
-                    if text:
-                        base_name = os.path.splitext(os.path.basename(file_path))[0]
-                        chunks = [(f"{base_name}_chunk_0", text, base_name, None)]
+            chunks = self.extract_upload_chunks(file_path)
         except Exception as e:
             logger.error(f"Error reading uploaded file: {e}")
             return False
 
-        if not chunks:
+        try:
+            indexed = self.index_upload_chunks(session_id, doc_name, chunks)
+        except SessionQuotaExceeded as e:
+            logger.warning(f"Upload {doc_name} rejected for session {session_id}: {e}")
             return False
-
-        simplified_chunks = [(chunk_id, chunk, doc_name, page_num) for chunk_id, chunk, doc_name, page_num in chunks]
-
-        if session_id not in self.uploaded_embeddings:
-            self.uploaded_embeddings[session_id] = []
-
-        self.uploaded_embeddings[session_id].extend(simplified_chunks)
-        logger.info(f"Stored {len(simplified_chunks)} chunks in session memory for uploaded file.")
-        return True
-
-    def chat(self, session_id, user_message, filter_files=None):
-        self._clean_memory()
-
-        retrieved_docs = self.search_engine.search_documents(user_message, top_n=5, filter_files=filter_files)
+        except Exception as e:
+            logger.error(f"Error embedding uploaded file: {e}")
+            return False
+        logger.info(f"Indexed {indexed} chunks from {doc_name} for session {session_id}.")
+        return indexed > 0
+
+    def _prepare_turn(self, session_id, user_message, filter_files, stages):
+        """
+        Retrieves context for a chat turn and builds the LLM messages.
+
+        :return: Dictionary with "messages", "user_msg", "source_refs" and "referenced_chunks",
+                 or None if no context was found.
+        """
+        retrieved_docs = stages.run(
+            "retrieval", self.search_engine.search_documents, user_message, top_n=5, filter_files=filter_files
+        )
         context_chunks = []
         source_refs = []
         referenced_chunks = []
@@ -112,79 +148,177 @@ class Chatbot:
                 "page": page
             })
 
-        if session_id in self.uploaded_embeddings:
-            uploaded_chunks = self.uploaded_embeddings[session_id]
-            self.embedder.embed_texts([(c[0], c[1]) for c in uploaded_chunks])
-
-            if self.embedder.index is not None:
-                query_embedding = self.embedder.model.encode(
-                    [user_message], normalize_embeddings=True, convert_to_numpy=True
-                ).astype("float32")
-                D, I = self.embedder.index.search(query_embedding, 3)
-
-                for idx in I[0]:
-                    match = self.embedder.doc_mapping.get(idx)
-                    if match:
-                        context_chunks.append(match["text"])
-                        source_refs.append(f"- from uploaded file, chunk {idx}")
-                        referenced_chunks.append({"chunk_id": match["chunk_id"], "text": match["text"]})
+        upload_index = self.sessions.get_uploads(session_id)
+        if upload_index is not None:
+            # One query encode (already cached by retrieval) and a search; uploads were embedded once
+            query_vector = self.search_engine.embedder.encode_queries([user_message])
+            for match in stages.run("upload_search", upload_index.search, query_vector, UPLOAD_TOP_K):
+                context_chunks.append(match["text"])
+                source_refs.append(f"- from uploaded file {match['doc']}, page {match['page']}")
+                referenced_chunks.append({
+                    "chunk_id": match["chunk_id"],
+                    "text": match["text"],
+                    "doc": match["doc"],
+                    "page": match["page"]
+                })
 
         context = "\n".join(context_chunks).strip()
         if not context:
-            return "I'm sorry, I couldn't find relevant information for your question in the selected documents."
-
-        if session_id not in self.chat_memory:
-            self.chat_memory[session_id] = {"timestamp": time.time(), "messages": []}
+            return None
 
-        # ✅ In-memory message persistence
-        memory = self.chat_memory[session_id]["messages"]
         system_prompt = {
             "role": "system",
             "content": (
                 "You are a chemical safety assistant. Use the provided context to answer questions in a numbered format.\n"
-                "For each point you mention, also include the reference to its document source like: '... (Document: doc_name, Chunk: X, Page: Y)'.\n"
+                "For each point you mention, also include the reference to its document source like: '... (Document: doc_name, Page: Y)'.\n"
                 "If relevant incidents are identified, mention they are shown in the left sidebar.\n"
                 "Do not fabricate information."
             )
         }
 
+        # Cited passages within the chat token budget, instead of the repr of referenced_chunks
+        packed, _ = pack_context(referenced_chunks, context_budget("chat"))
         context_message = {
             "role": "system",
-            "content": f"Context extracted from documents:\n\n{referenced_chunks}"
+            "content": f"Context extracted from documents:\n\n{format_context(packed)}"
         }
 
         user_msg = {"role": "user", "content": user_message}
 
         # Combine last memory + current context
-        messages = [system_prompt, context_message] + memory[-self.max_memory_messages:] + [user_msg]
+        stored = self.sessions.get_messages(session_id)
+        history = build_history(self.sessions.get_summary(session_id), stored, self.history_budget)
+        messages = [system_prompt, context_message] + history + [user_msg]
+        return {
+            "messages": messages,
+            "history": history,
+            "stored_messages": stored,
+            "user_msg": user_msg,
+            "source_refs": source_refs,
+            "referenced_chunks": referenced_chunks,
+            "has_uploads": upload_index is not None
+        }
 
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=600,
-                temperature=0.5
-            )
-            final_response = response.choices[0].message.content.strip()
+    def _semantic_lookup(self, session_id, user_message, turn):
+        """
+        Looks for a cached answer to a near-duplicate first question with the same retrieved chunks.
+
+        Only turns without history or uploads are eligible: their answer depends on nothing else.
 
-            # ✅ Store user + assistant messages in memory
-            memory.append(user_msg)
-            memory.append({"role": "assistant", "content": final_response})
-            self.chat_memory[session_id]["timestamp"] = time.time()
+        :return: (cache, query vector, chunk ids, cached answer or None); cache is None if not eligible.
+        """
+        cache = get_semantic_cache("chat")
+        if cache is None or turn["history"] or turn["has_uploads"]:
+            return None, None, None, None
+        query_vector = self.search_engine.embedder.encode_queries([user_message])[0]
+        chunk_ids = [c.get("chunk_id") for c in turn["referenced_chunks"]]
+        return cache, query_vector, chunk_ids, cache.lookup(query_vector, chunk_ids)
 
-            incidents = find_similar_incidents(user_message)
+    def _remember(self, session_id, turn, answer):
+        # ✅ Store user + assistant messages in the session store
+        answer_msg = {"role": "assistant", "content": answer}
+        self.sessions.append_messages(session_id, turn["user_msg"], answer_msg)
+        # Older turns are folded into the running summary in the background, off the response path
+        self.summarizer.maybe_schedule(session_id, turn["stored_messages"] + [turn["user_msg"], answer_msg])
+
+    def chat(self, session_id, user_message, filter_files=None):
+        stages = StagedExecution()
+        stages.submit("incidents", find_similar_incidents, user_message)
+        turn = self._prepare_turn(session_id, user_message, filter_files, stages)
+        if turn is None:
+            return {
+                "answer": NO_CONTEXT_ANSWER,
+                "sources": [],
+                "incidents": stages.result("incidents", default=[]),
+                "referenced_chunks": [],
+                "timings": stages.timings
+            }
+
+        cache, query_vector, chunk_ids, final_response = stages.run(
+            "semantic_cache", self._semantic_lookup, session_id, user_message, turn
+        )
+        cached = final_response is not None
+        try:
+            if not cached:
+                final_response = stages.run(
+                    "llm", self.llm_handler.complete, turn["messages"], max_tokens=600, temperature=0.5
+                ).strip()
+                if cache is not None:
+                    cache.store(user_message, query_vector, chunk_ids, final_response, llm_ms=stages.timings["llm"])
+            self._remember(session_id, turn, final_response)
+
+            incidents = stages.result("incidents", default=[])
 
             return {
                 "answer": final_response,
-                "sources": source_refs,
+                "sources": turn["source_refs"],
                 "incidents": incidents,
-                "referenced_chunks": referenced_chunks
+                "referenced_chunks": turn["referenced_chunks"],
+                "cached": cached,
+                "timings": stages.timings
             }
         except Exception as e:
             logger.error(f"Chatbot LLM error: {e}")
             return {
-                "answer": "Sorry, I encountered an error while processing your request.",
+                "answer": CHAT_ERROR_ANSWER,
                 "sources": [],
                 "incidents": [],
-                "referenced_chunks": []
+                "referenced_chunks": [],
+                "timings": stages.timings
             }
+
+    def chat_stream(self, session_id, user_message, filter_files=None):
+        """
+        Streaming variant of chat.
+
+        :return: Generator of (event, data) pairs:
+            - ("sources", {"sources": [...], "referenced_chunks": [...]})
+            - ("incidents", list of matched incidents)
+            - ("token", text fragment), repeated
+            - ("done", {"answer": full answer, "cached": bool, "timings": per-stage milliseconds})
+        """
+        stages = StagedExecution()
+        stages.submit("incidents", find_similar_incidents, user_message)
+        turn = self._prepare_turn(session_id, user_message, filter_files, stages)
+        if turn is None:
+            yield "sources", {"sources": [], "referenced_chunks": []}
+            yield "incidents", stages.result("incidents", default=[])
+            yield "done", {"answer": NO_CONTEXT_ANSWER, "timings": stages.timings}
+            return
+
+        yield "sources", {"sources": turn["source_refs"], "referenced_chunks": turn["referenced_chunks"]}
+
+        cache, query_vector, chunk_ids, cached_answer = stages.run(
+            "semantic_cache", self._semantic_lookup, session_id, user_message, turn
+        )
+
+        incidents_sent = False
+        parts = []
+        llm_start = time.perf_counter()
+        try:
+            if cached_answer is not None:
+                tokens = [cached_answer]
+            else:
+                tokens = self.llm_handler.stream_complete(turn["messages"], max_tokens=600, temperature=0.5)
+            for event, payload in stages.interleave(tokens, "incidents", default=[]):
+                if event == "incidents":
+                    incidents_sent = True
+                    yield event, payload
+                    continue
+                if not parts:
+                    stages.timings["llm_first_token"] = round((time.perf_counter() - llm_start) * 1000, 2)
+                parts.append(payload)
+                yield "token", payload
+            answer = "".join(parts).strip()
+            if cached_answer is None:
+                stages.timings["llm"] = round((time.perf_counter() - llm_start) * 1000, 2)
+                if cache is not None:
+                    cache.store(user_message, query_vector, chunk_ids, answer, llm_ms=stages.timings["llm"])
+            self._remember(session_id, turn, answer)
+        except Exception as e:
+            logger.error(f"Chatbot LLM streaming error: {e}")
+            answer = CHAT_ERROR_ANSWER
+
+        if not incidents_sent:
+            yield "incidents", stages.result("incidents", default=[])
+        yield "done", {"answer": answer, "cached": cached_answer is not None, "timings": stages.timings}
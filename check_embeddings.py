@@ -4,7 +4,7 @@ from embed_documents import EmbedDocuments  # Ensure your updated embed_document
 
 # Load your FAISS index and document mapping
 embedder = EmbedDocuments()  # Instantiate your embed_documents class
-embedder.load_index(index_path="faiss_index.bin", mapping_path="doc_mapping.npy")
+embedder.load_index(index_path="faiss_index.bin", chunk_store_path="doc_chunks")
 
 # Print the number of vectors in the FAISS index
 print("Total embeddings in FAISS index:", embedder.index.ntotal)
@@ -0,0 +1,227 @@
+import os
+import sys
+import json
+import shutil
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_STORE_PATH = "doc_chunks"
+FORMAT_VERSION = 1
+
+# Column files inside a chunk store directory
+_TEXT_BLOB = "text_blob.npy"
+_TEXT_OFFSETS = "text_offsets.npy"
+_ID_BLOB = "chunk_id_blob.npy"
+_ID_OFFSETS = "chunk_id_offsets.npy"
+_PAGES = "pages.npy"
+_DOC_IDS = "doc_ids.npy"
+_MANIFEST = "manifest.json"
+
+NO_PAGE = -1
+
+
+def manifest_path(path=DEFAULT_CHUNK_STORE_PATH):
+    """Path of the manifest.json a chunk store directory is saved with."""
+    return os.path.join(path, _MANIFEST)
+
+
+def _pack_strings(strings):
+    """Encodes strings into one UTF-8 byte blob plus an (n + 1) offsets array."""
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    if encoded:
+        offsets[1:] = np.cumsum([len(b) for b in encoded])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return blob, offsets
+
+
+class ChunkStore:
+    """
+    Columnar, pickle-free storage for chunk metadata keyed by FAISS vector id.
+
+    Chunk texts and chunk ids live in contiguous UTF-8 blobs with offset arrays; pages and
+    document ids are int32 columns and document names are a small JSON list. Everything is
+    memory-mappable, lookups are O(1) by vector id, and strings are only decoded for the
+    rows that are actually read (e.g. the top-k hits of a search).
+    """
+
+    def __init__(self, text_blob, text_offsets, id_blob, id_offsets, pages, doc_ids, doc_names):
+        self.text_blob = text_blob
+        self.text_offsets = text_offsets
+        self.id_blob = id_blob
+        self.id_offsets = id_offsets
+        self.pages = pages
+        self.doc_ids = doc_ids
+        self.doc_names = list(doc_names)
+
+    #############################
+    # Construction / persistence
+    #############################
+    @classmethod
+    def from_chunks(cls, chunks):
+        """
+        Builds a store from chunk dictionaries in vector-id order.
+
+        :param chunks: Iterable of dictionaries with keys "chunk_id", "text", "page" and "doc".
+        """
+        chunks = list(chunks)
+        doc_index = {}
+        doc_names = []
+        doc_ids = np.empty(len(chunks), dtype=np.int32)
+        pages = np.empty(len(chunks), dtype=np.int32)
+        for i, chunk in enumerate(chunks):
+            doc = chunk.get("doc") or "Unknown Document"
+            if doc not in doc_index:
+                doc_index[doc] = len(doc_names)
+                doc_names.append(doc)
+            doc_ids[i] = doc_index[doc]
+            page = chunk.get("page")
+            pages[i] = int(page) if page is not None else NO_PAGE
+
+        text_blob, text_offsets = _pack_strings([c.get("text", "") or "" for c in chunks])
+        id_blob, id_offsets = _pack_strings([c.get("chunk_id") or f"chunk_{i}" for i, c in enumerate(chunks)])
+        return cls(text_blob, text_offsets, id_blob, id_offsets, pages, doc_ids, doc_names)
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        """
+        Builds a store from the legacy doc_mapping dict (vector id → chunk dictionary).
+
+        :raises ValueError: If the vector ids are not exactly 0..n-1.
+        """
+        keys = sorted(int(k) for k in mapping)
+        if keys != list(range(len(keys))):
+            raise ValueError("doc_mapping keys must be contiguous vector ids starting at 0.")
+        return cls.from_chunks(mapping[k] for k in keys)
+
+    @classmethod
+    def load(cls, path=DEFAULT_CHUNK_STORE_PATH, mmap=True):
+        """
+        Opens a store written by save().
+
+        :param path: Store directory.
+        :param mmap: Memory-map the column files instead of reading them into memory.
+        """
+        with open(os.path.join(path, _MANIFEST), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported chunk store format: {manifest.get('format_version')}")
+
+        mmap_mode = "r" if mmap else None
+
+        def column(name):
+            return np.load(os.path.join(path, name), mmap_mode=mmap_mode, allow_pickle=False)
+
+        store = cls(
+            column(_TEXT_BLOB), column(_TEXT_OFFSETS),
+            column(_ID_BLOB), column(_ID_OFFSETS),
+            column(_PAGES), column(_DOC_IDS),
+            manifest["doc_names"]
+        )
+        if len(store) != manifest.get("count"):
+            raise ValueError(f"Chunk store {path} is inconsistent with its manifest.")
+        return store
+
+    def save(self, path=DEFAULT_CHUNK_STORE_PATH):
+        """Writes the store into a temporary directory and swaps it into place."""
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name, array in (
+            (_TEXT_BLOB, self.text_blob), (_TEXT_OFFSETS, self.text_offsets),
+            (_ID_BLOB, self.id_blob), (_ID_OFFSETS, self.id_offsets),
+            (_PAGES, self.pages), (_DOC_IDS, self.doc_ids),
+        ):
+            np.save(os.path.join(tmp_path, name), np.ascontiguousarray(array), allow_pickle=False)
+        with open(os.path.join(tmp_path, _MANIFEST), "w", encoding="utf-8") as f:
+            json.dump({"format_version": FORMAT_VERSION, "count": len(self), "doc_names": self.doc_names}, f)
+
+        old_path = f"{path}.old-{os.getpid()}"
+        if os.path.exists(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        logger.info(f"Chunk store with {len(self)} chunks saved to {path}.")
+
+    #############################
+    # Lookup
+    #############################
+    def __len__(self):
+        return len(self.pages)
+
+    def __contains__(self, idx):
+        return 0 <= int(idx) < len(self)
+
+    def __getitem__(self, idx):
+        idx = int(idx)
+        if not 0 <= idx < len(self):
+            raise KeyError(idx)
+        return {
+            "chunk_id": self.chunk_id(idx),
+            "text": self.text(idx),
+            "page": self.page(idx),
+            "doc": self.doc(idx),
+        }
+
+    def get(self, idx, default=None):
+        try:
+            return self[idx]
+        except (KeyError, ValueError, TypeError):
+            return default
+
+    def items(self):
+        for idx in range(len(self)):
+            yield idx, self[idx]
+
+    def text(self, idx):
+        start, end = self.text_offsets[idx], self.text_offsets[idx + 1]
+        return bytes(self.text_blob[start:end]).decode("utf-8")
+
+    def chunk_id(self, idx):
+        start, end = self.id_offsets[idx], self.id_offsets[idx + 1]
+        return bytes(self.id_blob[start:end]).decode("utf-8")
+
+    def page(self, idx):
+        page = int(self.pages[idx])
+        return None if page == NO_PAGE else page
+
+    def doc(self, idx):
+        return self.doc_names[int(self.doc_ids[idx])]
+
+
+def convert_legacy_mapping(mapping_path, store_path=DEFAULT_CHUNK_STORE_PATH):
+    """
+    Converts a pickled doc_mapping.npy into a chunk store directory.
+
+    :return: The converted ChunkStore.
+    """
+    mapping = np.load(mapping_path, allow_pickle=True).item()
+    store = ChunkStore.from_mapping(mapping)
+    store.save(store_path)
+    return store
+
+
+def load_chunk_store(store_path=DEFAULT_CHUNK_STORE_PATH, legacy_mapping_path=None):
+    """
+    Opens the chunk store, falling back to an in-memory conversion of a legacy doc_mapping.npy.
+
+    :return: ChunkStore, or None if neither exists.
+    """
+    if os.path.exists(os.path.join(store_path, _MANIFEST)):
+        return ChunkStore.load(store_path)
+    if legacy_mapping_path and os.path.exists(legacy_mapping_path):
+        logger.warning(
+            f"Chunk store {store_path} not found; converting legacy {legacy_mapping_path} in memory. "
+            f"Run 'python chunk_store.py {legacy_mapping_path} {store_path}' to convert it once."
+        )
+        return ChunkStore.from_mapping(np.load(legacy_mapping_path, allow_pickle=True).item())
+    return None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    source = sys.argv[1] if len(sys.argv) > 1 else "doc_mapping.npy"
+    target = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_CHUNK_STORE_PATH
+    convert_legacy_mapping(source, target)
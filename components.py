@@ -0,0 +1,158 @@
+import os
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Phase name → seconds spent; covers lazy component builds and the warm-up sequence.
+startup_timings = {}
+
+_instances = {}
+_lock = threading.RLock()
+
+_warmup_thread = None
+_warmup_pid = None  # process that started warm-up
+_warmup_state = {"status": "pending", "error": None, "started_at": None, "finished_at": None}
+
+
+def _after_fork_in_child():
+    # gunicorn --preload can fork while the master is still warming up. Only the forking
+    # thread survives: the lock may be held by the warm-up thread that did not, and the
+    # inherited "running" status would never change (so /readyz would stay 503).
+    global _lock, _warmup_thread
+    _lock = threading.RLock()
+    _warmup_thread = None
+    if _warmup_state["status"] == "running":
+        _warmup_state["status"] = "pending"
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+@contextmanager
+def timed_phase(name):
+    """Records how long the wrapped block took under startup_timings[name] and logs it."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        startup_timings[name] = round(elapsed, 3)
+        logger.info(f"Startup phase '{name}' took {elapsed:.2f}s.")
+
+
+def _get(name, factory):
+    instance = _instances.get(name)
+    if instance is not None:
+        return instance
+    with _lock:
+        instance = _instances.get(name)
+        if instance is None:
+            with timed_phase(f"build:{name}"):
+                instance = factory()
+            _instances[name] = instance
+    return instance
+
+
+def get_llm_handler():
+    from llm_handler import LLMHandler
+    return _get("llm_handler", LLMHandler)
+
+
+def get_search_engine():
+    from search_engine import SearchEngine
+    return _get("search_engine", lambda: SearchEngine(llm_handler=get_llm_handler()))
+
+
+def get_chatbot():
+    from chatbot import Chatbot
+    return _get("chatbot", lambda: Chatbot(search_engine=get_search_engine(), llm_handler=get_llm_handler()))
+
+
+def get_risk_assessor():
+    from risk_assessor import RiskAssessor
+    return _get("risk_assessor", lambda: RiskAssessor(search_engine=get_search_engine(), llm_handler=get_llm_handler()))
+
+
+def warm_up():
+    """
+    Builds the shared components and primes the model so the first request does not pay for it.
+
+    Phases: embedding model load, FAISS index load, BM25 index build, incident embeddings,
+    one dummy encode.
+    The process is reported ready only when every phase succeeds.
+    """
+    from model_registry import get_embedding_model, log_model_report
+    from incident_matcher import ensure_incidents_loaded, MODEL_NAME
+
+    _warmup_state.update(status="running", started_at=time.time(), error=None)
+    try:
+        with timed_phase("warmup:embedding_model"):
+            model = get_embedding_model(MODEL_NAME)
+        with timed_phase("warmup:search_index"):
+            search_engine = get_search_engine()
+            if search_engine.index is None:
+                raise RuntimeError("FAISS index is not loaded.")
+        with timed_phase("warmup:lexical_index"):
+            search_engine.lexical_index
+        with timed_phase("warmup:incident_embeddings"):
+            ensure_incidents_loaded()
+        with timed_phase("warmup:dummy_encode"):
+            model.encode(["warm-up query"], normalize_embeddings=True, convert_to_numpy=True)
+        _warmup_state["status"] = "ready"
+        log_model_report()
+    except Exception as e:
+        logger.error(f"Warm-up failed: {e}")
+        _warmup_state.update(status="failed", error=str(e))
+    finally:
+        _warmup_state["finished_at"] = time.time()
+        logger.info(f"Startup timings: {startup_timings}")
+
+
+def start_background_warm_up():
+    """
+    Starts warm_up() once per process according to SAFETY_WARMUP:
+    "background" (default) runs it in a daemon thread, "sync" runs it inline
+    (e.g. before gunicorn forks with --preload), "off" leaves everything to first use.
+    """
+    global _warmup_thread, _warmup_pid
+    mode = os.getenv("SAFETY_WARMUP", "background").lower()
+    if mode == "off":
+        logger.info("Warm-up disabled; components will be built on first use.")
+        return None
+    if mode == "sync":
+        if _warmup_state["status"] == "pending":
+            _warmup_pid = os.getpid()
+            warm_up()
+        return None
+    with _lock:
+        if _warmup_thread is None and _warmup_state["status"] == "pending":
+            _warmup_pid = os.getpid()
+            _warmup_thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+            _warmup_thread.start()
+    return _warmup_thread
+
+
+def _resume_interrupted_warm_up():
+    """Restarts warm-up in a worker forked while its parent was still warming up."""
+    if _warmup_pid not in (None, os.getpid()) and _warmup_state["status"] == "pending":
+        logger.info(f"Warm-up was interrupted by fork; restarting it in pid {os.getpid()}.")
+        start_background_warm_up()
+
+
+def is_ready():
+    _resume_interrupted_warm_up()
+    return _warmup_state["status"] == "ready"
+
+
+def readiness():
+    """Returns the warm-up status, error (if any) and per-phase timings."""
+    _resume_interrupted_warm_up()
+    return {
+        "ready": is_ready(),
+        "status": _warmup_state["status"],
+        "error": _warmup_state["error"],
+        "timings": dict(startup_timings),
+    }
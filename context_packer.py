@@ -0,0 +1,172 @@
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:  # optional: fall back to the ~4 characters per token estimate
+    tiktoken = None
+
+# Prompt token budget for the retrieved context of each endpoint
+CONTEXT_BUDGETS = {
+    "search": int(os.getenv("CONTEXT_BUDGET_SEARCH", "1500")),
+    "chat": int(os.getenv("CONTEXT_BUDGET_CHAT", "2000")),
+    "incident_filter": int(os.getenv("CONTEXT_BUDGET_INCIDENT_FILTER", "2500")),
+}
+DEFAULT_CONTEXT_BUDGET = int(os.getenv("CONTEXT_BUDGET_DEFAULT", "1500"))
+# Shortest shared edge treated as sliding-window overlap (EmbedDocuments overlaps windows by 100 chars)
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 400
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding("o200k_base")  # gpt-4o family
+        except Exception:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+    return _encoding
+
+
+def count_tokens(text):
+    """Counts prompt tokens with tiktoken if installed, else estimates len(text) / 4."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def context_budget(endpoint):
+    """Token budget for an endpoint's context ("search", "chat", "incident_filter")."""
+    return CONTEXT_BUDGETS.get(endpoint, DEFAULT_CONTEXT_BUDGET)
+
+
+def citation(chunk):
+    """Source label kept with each packed passage, e.g. "(Document: guide.pdf, Page: 4)"."""
+    parts = []
+    if chunk.get("doc"):
+        parts.append(f"Document: {chunk['doc']}")
+    if chunk.get("page") is not None:
+        parts.append(f"Page: {chunk['page']}")
+    return f"({', '.join(parts)})" if parts else ""
+
+
+def format_context(chunks):
+    """Joins packed chunks into the prompt context, each passage under its citation."""
+    entries = []
+    for chunk in chunks:
+        label = citation(chunk)
+        entries.append(f"{label}\n{chunk['text']}" if label else chunk["text"])
+    return "\n\n".join(entries)
+
+
+def _edge_overlap(left, right):
+    """Length of the longest suffix of left that is a prefix of right (0 if below MIN_OVERLAP_CHARS)."""
+    for size in range(min(len(left), len(right), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _merge_overlapping(chunks):
+    """
+    Merges sliding-window neighbours from the same document page and drops contained duplicates.
+
+    Keeps the position of the best-ranked piece, so rank order is preserved.
+
+    :return: (merged chunks, number of chunks folded into another)
+    """
+    merged = []
+    removed = 0
+    for chunk in chunks:
+        text = (chunk.get("text") or "").strip()
+        if not text:
+            removed += 1
+            continue
+        absorbed = False
+        for kept in merged:
+            if kept.get("doc") != chunk.get("doc") or kept.get("page") != chunk.get("page"):
+                continue
+            if text in kept["text"]:
+                absorbed = True
+            elif kept["text"] in text:
+                kept["text"] = text
+                absorbed = True
+            else:
+                overlap = _edge_overlap(kept["text"], text)
+                if overlap:
+                    kept["text"] = kept["text"] + text[overlap:]
+                    absorbed = True
+                else:
+                    overlap = _edge_overlap(text, kept["text"])
+                    if overlap:
+                        kept["text"] = text + kept["text"][overlap:]
+                        absorbed = True
+            if absorbed:
+                kept["chunk_ids"].append(chunk.get("chunk_id"))
+                break
+        if absorbed:
+            removed += 1
+        else:
+            merged.append({**chunk, "text": text, "chunk_ids": [chunk.get("chunk_id")]})
+    return merged, removed
+
+
+def _truncate_to_tokens(text, max_tokens):
+    encoding = _get_encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text)[:max_tokens])
+    return text[:max_tokens * 4]
+
+
+def pack_context(chunks, budget_tokens):
+    """
+    Fits ranked chunks into a token budget.
+
+    Chunks are taken best first (retrieval order), overlapping sliding-window duplicates
+    are merged, and whole passages are added while they fit. If even the best passage
+    is larger than the budget it is truncated rather than dropped.
+
+    :param chunks: Dictionaries with "text" and optional "doc", "page", "chunk_id", best first.
+    :param budget_tokens: Maximum tokens of the formatted context.
+    :return: (packed chunks, stats dict with input/packed counts, duplicates merged, tokens used)
+    """
+    merged, duplicates = _merge_overlapping(chunks)
+    packed = []
+    used = 0
+    truncated = False
+    for chunk in merged:
+        label = citation(chunk)
+        cost = count_tokens(f"{label}\n{chunk['text']}" if label else chunk["text"]) + 1
+        if used + cost <= budget_tokens:
+            packed.append(chunk)
+            used += cost
+        elif not packed:
+            room = budget_tokens - count_tokens(label) - 2
+            if room > 0:
+                packed.append({**chunk, "text": _truncate_to_tokens(chunk["text"], room)})
+                used = budget_tokens
+                truncated = True
+            break
+
+    stats = {
+        "input_chunks": len(chunks),
+        "packed_chunks": len(packed),
+        "duplicates_merged": duplicates,
+        "dropped_chunks": len(merged) - len(packed),
+        "tokens": used,
+        "budget_tokens": budget_tokens,
+        "truncated": truncated,
+    }
+    if stats["dropped_chunks"] or duplicates:
+        logger.info(
+            f"Packed {len(packed)}/{len(chunks)} chunks into {used}/{budget_tokens} tokens "
+            f"({duplicates} overlapping merged, {stats['dropped_chunks']} over budget)."
+        )
+    return packed, stats
@@ -4,24 +4,38 @@ import logging
 import faiss
 import numpy as np
 import fitz  # PyMuPDF for PDF extraction
-from sentence_transformers import SentenceTransformer
+from model_registry import get_embedding_model
+from chunk_store import ChunkStore, load_chunk_store, DEFAULT_CHUNK_STORE_PATH
+from index_store import INDEX_FACTORY, DEFAULT_VECTORS_PATH, build_index, train_index, is_lossy_factory
 
 logger = logging.getLogger(__name__)
 
 class EmbedDocuments:
-    def __init__(self, model_name="all-mpnet-base-v2"):
+    def __init__(self, model_name="all-mpnet-base-v2", hnsw_m=32, ef_construction=64,
+                 index_factory=INDEX_FACTORY, keep_vectors=None):
         """
         Initializes the embedding model and FAISS index.
         
         :param model_name: SentenceTransformer model to use for embeddings.
+        :param hnsw_m: HNSW graph degree (see benchmark_retrieval.py for recall/latency trade-offs).
+        :param ef_construction: HNSW build-time candidate list size.
+        :param index_factory: FAISS index_factory string (e.g. "IVF4096,PQ64", "HNSW32,SQ8");
+                              empty builds HNSW{hnsw_m},Flat.
+        :param keep_vectors: Save exact float32 vectors for re-ranking; defaults to True for
+                             compressed (PQ/SQ/...) indexes.
         """
         try:
-            self.model = SentenceTransformer(model_name)
-            logger.info(f"Loaded embedding model: {model_name}")
+            self.model = get_embedding_model(model_name)
+            logger.info(f"Using shared embedding model: {model_name}")
         except Exception as e:
             logger.error(f"Error loading embedding model: {e}")
             raise e
 
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.index_factory = index_factory
+        self.keep_vectors = is_lossy_factory(index_factory) if keep_vectors is None else keep_vectors
+        self.vectors = []  # exact embeddings per embed_texts call, kept only if keep_vectors
         self.index = None
         # Document mapping: vector ID -> dictionary with keys "chunk_id", "text", "page", and "doc"
         self.doc_mapping = {}
@@ -183,10 +197,13 @@ class EmbedDocuments:
 
         dimension = embeddings.shape[1]
         if self.index is None:
-            self.index = faiss.IndexHNSWFlat(dimension, 32)
-            self.index.hnsw.efConstruction = 64
+            self.index = build_index(self.index_factory, dimension, self.hnsw_m, self.ef_construction)
+        # IVF/PQ/OPQ codebooks are trained on the first batch (main.py embeds the whole corpus at once)
+        train_index(self.index, embeddings)
 
         self.index.add(embeddings)
+        if self.keep_vectors:
+            self.vectors.append(embeddings)
 
         start_id = len(self.doc_mapping)
         for i, chunk_id in enumerate(ids):
@@ -200,24 +217,36 @@ class EmbedDocuments:
 
         logger.info("Chunk embeddings stored in FAISS index.")
 
-    def save_index(self, index_path="faiss_index.bin", mapping_path="doc_mapping.npy"):
+    def save_index(self, index_path="faiss_index.bin", chunk_store_path=DEFAULT_CHUNK_STORE_PATH,
+                   vectors_path=DEFAULT_VECTORS_PATH):
         """
-        Saves the FAISS index and document mapping to disk.
+        Saves the FAISS index (with any trained codebooks), the columnar chunk store (see chunk_store.py)
+        and, if keep_vectors is set, the exact vectors used for re-ranking.
         """
         if self.index is None:
             logger.error("No FAISS index found. Ensure documents are embedded first.")
             return
         faiss.write_index(self.index, index_path)
-        np.save(mapping_path, self.doc_mapping)
-        logger.info(f"FAISS index saved to {index_path} and mapping saved to {mapping_path}.")
+        ChunkStore.from_mapping(self.doc_mapping).save(chunk_store_path)
+        if self.keep_vectors and self.vectors:
+            np.save(vectors_path, np.vstack(self.vectors))
+            logger.info(f"Exact vectors saved to {vectors_path} for re-ranking.")
+        elif os.path.exists(vectors_path):
+            # Stale vectors from a previous build would no longer line up with the index
+            os.remove(vectors_path)
+        logger.info(f"FAISS index saved to {index_path} and chunk store saved to {chunk_store_path}.")
 
-    def load_index(self, index_path="faiss_index.bin", mapping_path="doc_mapping.npy"):
+    def load_index(self, index_path="faiss_index.bin", chunk_store_path=DEFAULT_CHUNK_STORE_PATH,
+                   mapping_path="doc_mapping.npy"):
         """
-        Loads a previously saved FAISS index and document mapping.
+        Loads a previously saved FAISS index and its chunk metadata into an editable doc_mapping.
+
+        :param mapping_path: Legacy pickled mapping, used only if the chunk store is missing.
         """
         try:
             self.index = faiss.read_index(index_path)
-            self.doc_mapping = np.load(mapping_path, allow_pickle=True).item()
+            store = load_chunk_store(chunk_store_path, legacy_mapping_path=mapping_path)
+            self.doc_mapping = dict(store.items()) if store is not None else {}
             logger.info("FAISS index and document mapping loaded successfully.")
         except Exception as e:
             logger.error(f"Error loading FAISS index: {e}")
@@ -0,0 +1,290 @@
+import os
+import re
+import time
+import logging
+import threading
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+# Share of the query's content words the rules must explain before the LLM is skipped
+FILTER_PARSER_MIN_CONFIDENCE = float(os.getenv("FILTER_PARSER_MIN_CONFIDENCE", "0.75"))
+
+US_STATES = {
+    "al": "Alabama", "ak": "Alaska", "az": "Arizona", "ar": "Arkansas", "ca": "California", "co": "Colorado",
+    "ct": "Connecticut", "de": "Delaware", "fl": "Florida", "ga": "Georgia", "hi": "Hawaii", "id": "Idaho",
+    "il": "Illinois", "in": "Indiana", "ia": "Iowa", "ks": "Kansas", "ky": "Kentucky", "la": "Louisiana",
+    "me": "Maine", "md": "Maryland", "ma": "Massachusetts", "mi": "Michigan", "mn": "Minnesota",
+    "ms": "Mississippi", "mo": "Missouri", "mt": "Montana", "ne": "Nebraska", "nv": "Nevada",
+    "nh": "New Hampshire", "nj": "New Jersey", "nm": "New Mexico", "ny": "New York", "nc": "North Carolina",
+    "nd": "North Dakota", "oh": "Ohio", "ok": "Oklahoma", "or": "Oregon", "pa": "Pennsylvania",
+    "ri": "Rhode Island", "sc": "South Carolina", "sd": "South Dakota", "tn": "Tennessee", "tx": "Texas",
+    "ut": "Utah", "vt": "Vermont", "va": "Virginia", "wa": "Washington", "wv": "West Virginia",
+    "wi": "Wisconsin", "wy": "Wyoming",
+}
+# Two-letter abbreviations that are also common English words only count in upper case ("IN", "OK")
+_AMBIGUOUS_ABBREVIATIONS = {"in", "me", "or", "ok", "hi", "id", "oh", "pa", "la", "ma", "de", "co"}
+
+MATERIAL_SYNONYMS = {
+    "nh3": "ammonia",
+    "h2s": "hydrogen sulfide",
+    "propane": "lpg",
+    "butane": "lpg",
+    "petroleum": "oil",
+    "methane": "natural gas",
+}
+SEVERITY_LEXICON = {
+    "critical": "critical", "severe": "critical", "serious": "critical", "major": "critical",
+    "catastrophic": "critical", "moderate": "moderate", "medium": "moderate",
+    "minor": "minor", "low": "minor", "small": "minor", "near miss": "near miss", "near-miss": "near miss",
+}
+_SEVERITY_RE = re.compile(
+    r"(?<![a-z0-9])(?:" + "|".join(re.escape(p) for p in sorted(SEVERITY_LEXICON, key=len, reverse=True)) + r")(?![a-z0-9])"
+)
+_NO_INJURIES = re.compile(
+    r"\b(without|no|zero|non)[\s-]+(injur\w*|casualt\w*|one hurt|harm)|\binjury[\s-]free\b|\buninjured\b"
+)
+_INJURIES = re.compile(r"\b(with\s+)?(injur\w*|casualt\w*|hurt|hospitali[sz]\w*|burns?|fatal\w*|deaths?|killed)\b")
+
+_YEAR = r"((?:19|20)\d{2})"
+_YEAR_PATTERNS = (
+    (re.compile(rf"\b(?:between|from)\s+{_YEAR}\s+(?:and|to|through|-)\s+{_YEAR}\b"), "range"),
+    (re.compile(rf"\b{_YEAR}\s*(?:-|–|to)\s*{_YEAR}\b"), "range"),
+    # "after"/"before" exclude the year; "since"/"until" include it (same rule as the LLM prompt)
+    (re.compile(rf"\b(?:after|post)\s+{_YEAR}\b"), "after"),
+    (re.compile(rf"\b(?:since|from|starting)\s+{_YEAR}\b"), "from"),
+    (re.compile(rf"\b(?:before|prior to|pre)\s+{_YEAR}\b"), "before"),
+    (re.compile(rf"\b(?:until|till|through|up to)\s+{_YEAR}\b"), "to"),
+    (re.compile(rf"\b(?:in|during|of|for)?\s*{_YEAR}\b"), "year"),
+)
+_RELATIVE_YEARS = {"this year": 0, "last year": 1, "past year": 1}
+
+# Words that describe what the user wants but never change the filters
+_GENERIC_WORDS = frozenset(
+    "a an the and or of in on at for with from to by any all show list find get give me display what which "
+    "were was are is there have has how many incidents incident events event cases case reports report "
+    "leak leaks leaking spill spills spilled release releases released accident accidents happened occurred "
+    "involving involved pipeline pipelines related please recent past data records record".split()
+)
+_WORD = re.compile(r"[a-z0-9][a-z0-9\-]*")
+
+
+class FilterParser:
+    """
+    Rule-based parser for natural-language incident filters, built from the incident data.
+
+    Gazetteers of materials, locations and operators come from incident_reports.csv, so
+    every value it emits matches the column it filters (filter_incidents uses substring
+    matching). Confidence is the share of the query's content words the rules explained.
+    """
+
+    def __init__(self, materials, locations, operators):
+        self.materials = materials  # phrase → filter value
+        self.locations = locations  # phrase → filter value
+        self.operators = operators  # phrases recognized (operator is not a supported filter)
+        self._material_re = self._phrase_pattern(materials)
+        self._location_re = self._phrase_pattern(locations)
+        self._operator_re = self._phrase_pattern(operators)
+
+    @classmethod
+    def from_dataframe(cls, df):
+        materials = {}
+        word_names = {}
+        for value in df.get("Material Released", []).dropna().unique():
+            value = str(value)
+            if value.lower().startswith("none"):
+                continue
+            name = re.sub(r"\s*\(UN\s*\d{4}\)", "", value).strip()
+            acronym = re.search(r"\(([A-Z0-9]{2,})\)", name)
+            base = re.sub(r"\s*\([^)]*\)", "", name).strip()
+            materials[base.lower()] = base
+            if acronym:
+                materials[acronym.group(1).lower()] = acronym.group(1)
+            un_number = re.search(r"UN\s*(\d{4})", value)
+            if un_number:
+                materials[f"un {un_number.group(1)}"] = base
+                materials[f"un{un_number.group(1)}"] = base
+            for word in _WORD.findall(base.lower()):
+                if word not in ("fuel", "liquefied"):
+                    word_names.setdefault(word, set()).add(base)
+        for word, names in word_names.items():
+            # A word unique to one material names it; a shared one ("gas", "oil") matches them all
+            materials.setdefault(word, next(iter(names)) if len(names) == 1 else word)
+        for synonym, target in MATERIAL_SYNONYMS.items():
+            if target in materials:
+                materials.setdefault(synonym, materials[target])
+
+        locations = {}
+        for value in df.get("Location", []).dropna().unique():
+            for part in str(value).split(","):
+                part = part.strip()
+                if part:
+                    locations[part.lower()] = part
+        for abbreviation, state in US_STATES.items():
+            locations.setdefault(state.lower(), state)
+
+        operators = set()
+        for value in df.get("Pipeline Operator", []).dropna().unique():
+            operators.add(str(value).lower())
+        return cls(materials, locations, operators)
+
+    @staticmethod
+    def _phrase_pattern(phrases):
+        """One alternation over the phrases as whole words, longest first so "natural gas" beats "gas"."""
+        if not phrases:
+            return None
+        alternatives = "|".join(re.escape(p) for p in sorted(phrases, key=len, reverse=True))
+        return re.compile(rf"(?<![a-z0-9])(?:{alternatives})(?![a-z0-9])")
+
+    @staticmethod
+    def _find_phrase(text, pattern):
+        """First gazetteer phrase found in text; returns (phrase, span) or (None, None)."""
+        match = pattern.search(text) if pattern is not None else None
+        return (match.group(), match.span()) if match else (None, None)
+
+    def parse(self, query):
+        """
+        :param query: Natural-language filter request, e.g. "gas leaks in Texas with injuries after 2022".
+        :return: (filters dict with the keys parse_filters returns, confidence between 0 and 1)
+        """
+        text = query.lower()
+        consumed = []
+        filters = {}
+
+        phrase, span = self._find_phrase(text, self._material_re)
+        if phrase:
+            filters["material"] = self.materials[phrase]
+            consumed.append(span)
+
+        phrase, span = self._find_phrase(text, self._location_re)
+        if phrase:
+            filters["location_contains"] = self.locations[phrase]
+            consumed.append(span)
+        else:
+            for abbreviation in re.findall(r"\b([A-Za-z]{2})\b", query):
+                key = abbreviation.lower()
+                if key in US_STATES and (abbreviation.isupper() or key not in _AMBIGUOUS_ABBREVIATIONS):
+                    filters["location_contains"] = US_STATES[key]
+                    consumed.append(re.search(rf"\b{abbreviation}\b", query).span())
+                    break
+
+        phrase, span = self._find_phrase(text, self._operator_re)
+        if phrase:
+            consumed.append(span)
+
+        for pattern, kind in _YEAR_PATTERNS:
+            match = pattern.search(text)
+            if not match:
+                continue
+            years = [int(y) for y in match.groups() if y]
+            if kind == "range":
+                filters["from_year"], filters["to_year"] = min(years), max(years)
+            elif kind == "after":
+                filters["from_year"] = years[0] + 1
+            elif kind == "from":
+                filters["from_year"] = years[0]
+            elif kind == "before":
+                filters["to_year"] = years[0] - 1
+            elif kind == "to":
+                filters["to_year"] = years[0]
+            else:
+                filters["from_year"] = filters["to_year"] = years[0]
+            consumed.append(match.span())
+            break
+        else:
+            for phrase, offset in _RELATIVE_YEARS.items():
+                if phrase in text:
+                    filters["from_year"] = filters["to_year"] = date.today().year - offset
+                    consumed.append((text.index(phrase), text.index(phrase) + len(phrase)))
+                    break
+
+        match = _NO_INJURIES.search(text)
+        if match:
+            filters["has_injuries"] = False
+            consumed.append(match.span())
+        else:
+            match = _INJURIES.search(text)
+            if match:
+                filters["has_injuries"] = True
+                consumed.append(match.span())
+
+        phrase, span = self._find_phrase(text, _SEVERITY_RE)
+        if phrase:
+            filters["severity"] = SEVERITY_LEXICON[phrase]
+            consumed.append(span)
+
+        if not filters:
+            return filters, 0.0
+        content = [
+            m for m in _WORD.finditer(text)
+            if m.group() not in _GENERIC_WORDS and not any(start <= m.start() < end for start, end in consumed)
+        ]
+        words = [m for m in _WORD.finditer(text) if m.group() not in _GENERIC_WORDS]
+        confidence = 1.0 - len(content) / len(words) if words else 1.0
+        return filters, round(confidence, 3)
+
+
+class FilterParsingService:
+    """Rule-based fast path with LLM fallback on low confidence, plus fast-path statistics."""
+
+    def __init__(self, parser, min_confidence=FILTER_PARSER_MIN_CONFIDENCE):
+        self.parser = parser
+        self.min_confidence = min_confidence
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.fast_path = 0
+        self.llm_fallback = 0
+        self.fast_path_us_total = 0.0
+
+    def parse(self, query, llm_handler):
+        """
+        :param query: Natural-language filter request.
+        :param llm_handler: LLMHandler used when the rules are not confident enough.
+        :return: (filters, source) where source is "rules" or "llm".
+        """
+        start = time.perf_counter()
+        filters, confidence = self.parser.parse(query)
+        elapsed_us = (time.perf_counter() - start) * 1e6
+        fast = confidence >= self.min_confidence
+        with self._lock:
+            self.queries += 1
+            self.fast_path_us_total += elapsed_us
+            if fast:
+                self.fast_path += 1
+            else:
+                self.llm_fallback += 1
+        if fast:
+            logger.info(f"Rule-based filters (confidence {confidence}, {elapsed_us:.0f} µs): {filters}")
+            return filters, "rules"
+        logger.info(f"Rule-based filter confidence {confidence} below {self.min_confidence}; asking the LLM.")
+        return llm_handler.parse_filters(query), "llm"
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queries": self.queries,
+                "fast_path": self.fast_path,
+                "llm_fallback": self.llm_fallback,
+                "fast_path_share": round(self.fast_path / self.queries, 4) if self.queries else 0.0,
+                "avg_rule_parse_us": round(self.fast_path_us_total / self.queries, 1) if self.queries else 0.0,
+                "min_confidence": self.min_confidence,
+            }
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_filter_parser():
+    """Returns the process-wide FilterParsingService, building the gazetteers on first use."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                from incident_filters import load_incident_data
+                _service = FilterParsingService(FilterParser.from_dataframe(load_incident_data()))
+    return _service
+
+
+def filter_parser_stats():
+    return _service.stats() if _service is not None else None
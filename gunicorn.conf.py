@@ -0,0 +1,13 @@
+# Loaded automatically by gunicorn when started from this directory.
+
+
+def post_fork(server, worker):
+    # A worker has a single thread right after the fork. With --preload, app.py ran in the
+    # master and its parser pool cannot be used by the worker, so each worker forks its own.
+    # Without --preload, app.py runs later in the worker and finds the pool already started.
+    from upload_jobs import start_parser_pool
+    start_parser_pool()
+    if server.cfg.preload_app:
+        # The master's warm-up thread did not survive the fork; finish it in this worker
+        from components import start_background_warm_up
+        start_background_warm_up()
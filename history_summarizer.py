@@ -0,0 +1,171 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from context_packer import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Tokens of conversation history (running summary + recent messages) sent with each chat turn
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "1200"))
+# Unsummarized history above this many tokens is folded into the summary after the response is sent
+CHAT_SUMMARY_TRIGGER_TOKENS = int(os.getenv("CHAT_SUMMARY_TRIGGER_TOKENS", str(CHAT_HISTORY_TOKEN_BUDGET)))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "300"))
+CHAT_SUMMARY_WORKERS = int(os.getenv("CHAT_SUMMARY_WORKERS", "1"))
+
+_active = None  # the process's HistorySummarizer, for /api/metrics
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You maintain a running summary of a conversation between a user and a chemical safety assistant. "
+    "Merge the new turns into the current summary. Keep the user's questions and constraints, the "
+    "facts and document references given in answers, and any open follow-ups. Be concise; write "
+    "plain sentences, no headings."
+)
+
+
+def _message_tokens(message):
+    return count_tokens(message.get("content") or "") + 4  # role and message framing
+
+
+def build_history(summary, messages, budget_tokens=CHAT_HISTORY_TOKEN_BUDGET):
+    """
+    History sent with a chat turn: the running summary plus the newest messages that fit.
+
+    :param summary: Running summary of older turns ("" if none).
+    :param messages: Stored messages, oldest first.
+    :return: List of chat messages within budget_tokens.
+    """
+    history = []
+    remaining = budget_tokens
+    if summary:
+        summary_message = {"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}
+        remaining -= _message_tokens(summary_message)
+        history.append(summary_message)
+
+    recent = []
+    for message in reversed(messages):
+        cost = _message_tokens(message)
+        if cost > remaining:
+            break
+        recent.append(message)
+        remaining -= cost
+    # A user message without its answer (or vice versa) reads as a dangling turn
+    if recent and recent[-1].get("role") == "assistant":
+        recent.pop()
+    return history + recent[::-1]
+
+
+class HistorySummarizer:
+    """
+    Folds older chat turns into a running summary stored with the session.
+
+    Scheduled after each turn is answered and run on a background thread, so the
+    summary call never adds to response latency. Together with build_history's token
+    budget this keeps the history part of every prompt at a fixed size.
+    """
+
+    def __init__(self, llm_handler, sessions, budget_tokens=CHAT_HISTORY_TOKEN_BUDGET,
+                 trigger_tokens=CHAT_SUMMARY_TRIGGER_TOKENS, summary_max_tokens=CHAT_SUMMARY_MAX_TOKENS,
+                 workers=CHAT_SUMMARY_WORKERS):
+        self.llm_handler = llm_handler
+        self.sessions = sessions
+        self.budget_tokens = budget_tokens
+        self.trigger_tokens = trigger_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self._executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="history-summary")
+        self._scheduled = set()  # sessions with a summarization queued or running
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.failures = 0
+        self.messages_folded = 0
+        self.summary_ms_total = 0.0
+        global _active
+        _active = self
+
+    def maybe_schedule(self, session_id, messages):
+        """
+        Queues a summarization if the session's unsummarized messages exceed the trigger.
+
+        :param messages: The session's stored messages (as just used for the turn).
+        :return: True if a summarization was queued.
+        """
+        if sum(_message_tokens(m) for m in messages) <= self.trigger_tokens:
+            return False
+        with self._lock:
+            if session_id in self._scheduled:
+                return False
+            self._scheduled.add(session_id)
+        self._executor.submit(self._run, session_id)
+        return True
+
+    def _run(self, session_id):
+        try:
+            self.summarize(session_id)
+        except Exception as e:
+            logger.error(f"History summarization failed for session {session_id}: {e}")
+            with self._lock:
+                self.failures += 1
+        finally:
+            with self._lock:
+                self._scheduled.discard(session_id)
+
+    def summarize(self, session_id):
+        """
+        Folds every message except the newest ones that fit the history budget into the summary.
+
+        :return: Number of messages folded.
+        """
+        stored = self.sessions.get_messages_with_seq(session_id)
+        keep_tokens = self.budget_tokens - self.summary_max_tokens
+        kept = 0
+        for seq, message in reversed(stored):
+            cost = _message_tokens(message)
+            if cost > keep_tokens:
+                break
+            keep_tokens -= cost
+            kept += 1
+        fold = stored[:len(stored) - kept]
+        # Fold whole turns: leave a trailing user question with its answer
+        if fold and fold[-1][1].get("role") == "user":
+            fold.pop()
+        if not fold:
+            return 0
+
+        start = time.perf_counter()
+        summary = self.sessions.get_summary(session_id)
+        turns = "\n\n".join(f"{m['role'].capitalize()}: {m['content']}" for _, m in fold)
+        messages = [
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+            {"role": "user", "content": f"Current summary:\n{summary or '(none)'}\n\nNew turns:\n{turns}"}
+        ]
+        new_summary = self.llm_handler.complete(
+            messages, max_tokens=self.summary_max_tokens, temperature=0.2, use_cache=False
+        ).strip()
+        if not new_summary:
+            raise ValueError("empty summary")
+        self.sessions.fold_messages(session_id, new_summary, fold[-1][0])
+
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.runs += 1
+            self.messages_folded += len(fold)
+            self.summary_ms_total += elapsed
+        logger.info(f"Folded {len(fold)} messages of session {session_id} into its summary in {elapsed:.0f} ms.")
+        return len(fold)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "runs": self.runs,
+                "failures": self.failures,
+                "scheduled": len(self._scheduled),
+                "messages_folded": self.messages_folded,
+                "avg_summary_ms": round(self.summary_ms_total / self.runs, 1) if self.runs else 0.0,
+                "history_budget_tokens": self.budget_tokens,
+                "trigger_tokens": self.trigger_tokens,
+            }
+
+
+def history_summarizer_stats():
+    return _active.stats() if _active is not None else None
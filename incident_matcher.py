@@ -1,7 +1,9 @@
 import os
 import json
+import threading
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from model_registry import get_embedding_model
+from singleflight import get_singleflight
 from sklearn.metrics.pairwise import cosine_similarity
 import logging
 
@@ -11,11 +13,12 @@ logger = logging.getLogger(__name__)
 INCIDENTS_PATH = "data/processed/incident_reports.json"
 MODEL_NAME = "all-mpnet-base-v2"
 
-# Load and embed incidents on import
+# Incidents are embedded lazily on first use (or during warm-up), not on import
 incident_embeddings = None
 incident_texts = []
 incident_data = []
-model = SentenceTransformer(MODEL_NAME)
+_load_lock = threading.Lock()
+_loaded = False
 
 def load_and_embed_incidents():
     global incident_embeddings, incident_texts, incident_data
@@ -24,6 +27,8 @@ def load_and_embed_incidents():
         logger.warning("Incident report file not found: %s", INCIDENTS_PATH)
         return
 
+    model = get_embedding_model(MODEL_NAME)
+
     with open(INCIDENTS_PATH, "r", encoding="utf-8") as f:
         incident_data = json.load(f)
 
@@ -33,21 +38,39 @@ def load_and_embed_incidents():
     ]
 
     logger.info("Embedding %d incidents...", len(incident_texts))
-    incident_embeddings = model.encode(incident_texts, convert_to_tensor=True, normalize_embeddings=True)
+    incident_embeddings = model.encode(incident_texts, convert_to_numpy=True, normalize_embeddings=True).astype(np.float32)
 
-# Call once at import
-load_and_embed_incidents()
+def ensure_incidents_loaded():
+    """Embeds the incident reports once per process; safe to call from several threads."""
+    global _loaded
+    if _loaded:
+        return
+    with _load_lock:
+        if not _loaded:
+            load_and_embed_incidents()
+            _loaded = True
 
 def find_similar_incidents(query, top_k=5, score_threshold=0.4, include_scores=False):
     """
     Returns top-k semantically similar incidents based on the query.
+
+    Concurrent identical calls share one in-flight result, so do not mutate the returned list.
     """
+    key = (query, top_k, score_threshold, include_scores)
+    return get_singleflight("incidents").do(
+        key, _find_similar_incidents, query, top_k, score_threshold, include_scores
+    )
+
+
+def _find_similar_incidents(query, top_k, score_threshold, include_scores):
+    ensure_incidents_loaded()
     if incident_embeddings is None or not incident_texts:
         logger.warning("Incident embeddings not initialized.")
         return []
 
-    query_embedding = model.encode([query], convert_to_tensor=True, normalize_embeddings=True)
-    scores = cosine_similarity(query_embedding.cpu().numpy(), incident_embeddings.cpu().numpy())[0]
+    model = get_embedding_model(MODEL_NAME)
+    query_embedding = model.encode_queries([query])
+    scores = cosine_similarity(query_embedding, incident_embeddings)[0]
 
     top_indices = np.argsort(scores)[::-1][:top_k]
     results = []
@@ -0,0 +1,222 @@
+import os
+import hashlib
+import logging
+import threading
+import numpy as np
+import faiss
+from chunk_store import DEFAULT_CHUNK_STORE_PATH, manifest_path
+
+logger = logging.getLogger(__name__)
+
+# "mmap": map the index file read-only so every worker shares the same page-cache pages.
+# "heap": read the whole index into process memory (one copy per process, shared between
+#         SearchEngine instances; combine with gunicorn --preload to share it copy-on-write).
+FAISS_INDEX_MODE = os.getenv("FAISS_INDEX_MODE", "mmap").lower()
+
+# FAISS index_factory string used when building the document index, e.g. "HNSW32,Flat",
+# "HNSW32,SQ8", "IVF4096,PQ64" or "OPQ64,IVF4096,PQ64". Unset keeps HNSW{M},Flat.
+INDEX_FACTORY = os.getenv("FAISS_INDEX_FACTORY", "")
+# Document index written by EmbedDocuments.save_index and served by SearchEngine
+DEFAULT_INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "faiss_index.bin")
+# Exact float32 chunk vectors kept next to compressed indexes for re-ranking
+DEFAULT_VECTORS_PATH = "doc_vectors.npy"
+MAX_TRAIN_POINTS = int(os.getenv("FAISS_MAX_TRAIN_POINTS", "200000"))
+
+_LOSSY_CODECS = ("PQ", "SQ", "LSH", "RQ", "LSQ")
+
+_indexes = {}  # (absolute path, mode) → faiss index
+_lock = threading.Lock()
+
+
+def _after_fork_in_child():
+    global _lock
+    _lock = threading.Lock()  # may have been held by a loading thread that did not survive the fork
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def _read_index(path, mode):
+    if mode == "mmap":
+        # IO_FLAG_MMAP_IFC maps flat vector storage in place; IO_FLAG_MMAP covers IVF lists.
+        for flag_name in ("IO_FLAG_MMAP_IFC", "IO_FLAG_MMAP"):
+            flag = getattr(faiss, flag_name, None)
+            if flag is None:
+                continue
+            try:
+                return faiss.read_index(path, flag | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError as e:
+                logger.warning(f"Memory-mapped load with {flag_name} failed for {path}: {e}")
+        logger.warning(f"Falling back to a heap copy of {path}.")
+    return faiss.read_index(path)
+
+
+def _ensure_direct_map(index):
+    """
+    Gives IVF indexes an id → list offset map so reconstruct()/reconstruct_batch() work.
+
+    The filtered-search exact fallback reconstructs the selected vectors. The map is
+    stored in the index file; index files written without one get it built on load.
+    """
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return  # not an IVF index
+    if ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+
+
+def load_index(path, mode=None):
+    """
+    Returns the read-only FAISS index stored at path, loading it once per process.
+
+    :param path: Path to the index written by faiss.write_index.
+    :param mode: "mmap" or "heap"; defaults to FAISS_INDEX_MODE.
+    :return: faiss.Index shared by every caller in this process. Do not add to it.
+    """
+    mode = (mode or FAISS_INDEX_MODE).lower()
+    key = (os.path.abspath(path), mode)
+    index = _indexes.get(key)
+    if index is not None:
+        return index
+    with _lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _read_index(path, mode)
+            _ensure_direct_map(index)
+            _indexes[key] = index
+            logger.info(f"Loaded FAISS index {path} ({mode}, {index.ntotal} vectors).")
+    return index
+
+
+def index_version(*paths):
+    """
+    Fingerprint of the files an index build produces (index file, chunk store manifest, ...).
+
+    Built from file sizes and modification times, so it changes whenever the index is
+    rebuilt without reading the files. Missing files contribute a fixed marker.
+
+    :return: Short hex digest.
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        try:
+            st = os.stat(path)
+            digest.update(f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns};".encode("utf-8"))
+        except OSError:
+            digest.update(f"{os.path.abspath(path)}:missing;".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def index_files(index_path=DEFAULT_INDEX_PATH, chunk_store_path=DEFAULT_CHUNK_STORE_PATH,
+                vectors_path=DEFAULT_VECTORS_PATH):
+    """
+    Files an index build writes and SearchEngine loads, as passed to index_version().
+
+    :return: Tuple of the index file, the chunk store manifest and the exact vectors file.
+    """
+    return index_path, manifest_path(chunk_store_path), vectors_path
+
+
+def is_lossy_factory(spec):
+    """True when the factory string compresses vectors, so exact re-ranking needs stored vectors."""
+    return any(codec in spec.upper() for codec in _LOSSY_CODECS)
+
+
+def build_index(spec, dimension, hnsw_m=32, ef_construction=64):
+    """
+    Creates an empty index from a FAISS index_factory string (L2 metric).
+
+    :param spec: Factory string; empty means HNSW{hnsw_m},Flat.
+    :return: Untrained faiss index; call train_index before adding vectors.
+    """
+    spec = spec or f"HNSW{hnsw_m},Flat"
+    index = faiss.index_factory(dimension, spec, faiss.METRIC_L2)
+    hnsw = getattr(faiss.downcast_index(index), "hnsw", None)
+    if hnsw is not None:
+        hnsw.efConstruction = ef_construction
+    _ensure_direct_map(index)
+    logger.info(f"Created FAISS index '{spec}' (dim {dimension}).")
+    return index
+
+
+def train_index(index, vectors, max_points=MAX_TRAIN_POINTS, seed=1234):
+    """
+    Trains quantizers/codebooks on a random sample of vectors if the index needs it.
+
+    The trained codebooks are stored inside the index file by faiss.write_index.
+    """
+    if index.is_trained:
+        return
+    sample = vectors
+    if len(vectors) > max_points:
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(len(vectors), size=max_points, replace=False)]
+    try:
+        nlist = faiss.extract_index_ivf(index).nlist
+        if len(sample) < 39 * nlist:
+            logger.warning(
+                f"Training IVF{nlist} on {len(sample)} points; FAISS recommends at least {39 * nlist}. "
+                f"Consider a smaller nlist (about 4*sqrt(N))."
+            )
+    except RuntimeError:
+        pass  # not an IVF index
+    logger.info(f"Training FAISS index on {len(sample)} vectors...")
+    index.train(np.ascontiguousarray(sample, dtype=np.float32))
+
+
+def _smaps_totals(path=None, smaps_file="/proc/self/smaps"):
+    """Sums Rss/Shared/Private kB from smaps, optionally only for mappings of the given file."""
+    totals = {"rss": 0, "shared": 0, "private": 0}
+    try:
+        with open(smaps_file, "r") as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+
+    in_target = path is None
+    for line in lines:
+        parts = line.split()
+        if not parts:
+            continue
+        if not parts[0].endswith(":"):
+            # Mapping header: "start-end perms offset dev inode [pathname]"
+            if path is not None:
+                in_target = len(parts) >= 6 and parts[5] == path
+            continue
+        if not in_target or len(parts) < 2:
+            continue
+        field = parts[0][:-1]
+        try:
+            kb = int(parts[1])
+        except ValueError:
+            continue
+        if field == "Rss":
+            totals["rss"] += kb * 1024
+        elif field in ("Shared_Clean", "Shared_Dirty"):
+            totals["shared"] += kb * 1024
+        elif field in ("Private_Clean", "Private_Dirty"):
+            totals["private"] += kb * 1024
+    return totals
+
+
+def index_memory_stats(path):
+    """
+    Reports how much of the index is resident in this process and how much of that is shared.
+
+    :param path: Path of the index file.
+    :return: Dictionary with the file size, load mode, mapped resident/shared/private bytes
+             (mmap mode only) and process-wide resident/shared/private bytes.
+    """
+    abs_path = os.path.abspath(path)
+    loaded_modes = [mode for (p, mode) in _indexes if p == abs_path]
+    stats = {
+        "path": path,
+        "mode": loaded_modes[0] if loaded_modes else None,
+        "file_bytes": os.path.getsize(path) if os.path.exists(path) else 0,
+        "mapped": None,
+        "process": _smaps_totals(smaps_file="/proc/self/smaps_rollup"),
+    }
+    if "mmap" in loaded_modes:
+        stats["mapped"] = _smaps_totals(abs_path)
+    return stats
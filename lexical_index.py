@@ -0,0 +1,158 @@
+import re
+import math
+import logging
+from collections import defaultdict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# "UN 1005" and "UN1005" (likewise NA numbers) should match each other
+_UN_NUMBER = re.compile(r"\b(un|na)\s*(\d{4})\b")
+# Regulation sections (192.616, 195.452(h)), UN ids (un1005), plain words and numbers
+_TOKEN = re.compile(r"\d+(?:\.\d+)+|[a-z]+\d+[a-z0-9]*|[a-z0-9]+")
+# Citation shapes: regulation sections (192.616), UN/NA ids (un1005) and part numbers (192).
+# Years and short formulas such as "h2s", "co2" or "n95" are ordinary words for retrieval.
+_IDENTIFIER = re.compile(r"^(\d+(?:\.\d+)+|(?:un|na)\d{4}|\d{3,})$")
+_YEAR = re.compile(r"^(?:19|20)\d{2}$")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how in is it of on or that the this to was were what "
+    "when where which who why will with do does i we you me my our your about under per cfr part section".split()
+)
+
+
+def tokenize(text):
+    """Lower-cases text and splits it into lexical tokens, keeping regulation and UN identifiers whole."""
+    text = _UN_NUMBER.sub(r"\1\2", text.lower())
+    return [t for t in _TOKEN.findall(text) if t not in STOPWORDS]
+
+
+def identifier_share(query):
+    """
+    Share of the query's tokens that are citation identifiers; "guide 125" counts as two.
+
+    >>> identifier_share("192.616 requirements"), identifier_share("49 CFR 195.452")
+    (0.5, 0.5)
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return 0.0
+    identifiers = 0
+    for i, token in enumerate(tokens):
+        if token.isdigit() and i and tokens[i - 1] == "guide":
+            identifiers += 2  # the ERG guide number and the word "guide"
+        elif _IDENTIFIER.match(token) and not _YEAR.match(token):
+            identifiers += 1
+    return identifiers / len(tokens)
+
+
+def is_identifier_query(query, min_share=0.5):
+    """
+    True when most (more than min_share) of the query's tokens are identifiers, e.g.
+    "192.616", "UN1005" or "guide 125", which dense embeddings handle poorly and an
+    exact token match answers directly.
+
+    >>> [is_identifier_query(q) for q in ("192.616", "UN 1005", "guide 125", "part 192 195.452")]
+    [True, True, True, True]
+    >>> [is_identifier_query(q) for q in ("incidents in 2019", "PPE for H2S", "CO2 leak",
+    ...                                   "N95 respirator", "what happened in 2021")]
+    [False, False, False, False, False]
+    """
+    return identifier_share(query) > min_share
+
+
+class BM25Index:
+    """
+    In-memory inverted index with Okapi BM25 scoring over the chunk store texts.
+
+    Postings are per-token numpy arrays of (vector id, term frequency), so a query
+    only touches the postings of its own tokens.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # token → (vector ids int32, term frequencies float32)
+        self.doc_lengths = np.zeros(0, dtype=np.float32)
+        self.avg_doc_length = 0.0
+
+    @classmethod
+    def from_chunk_store(cls, chunk_store, **kwargs):
+        """Builds the index over every chunk of a ChunkStore; vector ids are the store's row ids."""
+        index = cls(**kwargs)
+        index.build(chunk_store.text(i) for i in range(len(chunk_store)))
+        return index
+
+    def build(self, texts):
+        postings = defaultdict(lambda: ([], []))
+        lengths = []
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            counts = defaultdict(int)
+            for token in tokens:
+                counts[token] += 1
+            for token, tf in counts.items():
+                ids, tfs = postings[token]
+                ids.append(doc_id)
+                tfs.append(tf)
+
+        self.postings = {
+            token: (np.asarray(ids, dtype=np.int32), np.asarray(tfs, dtype=np.float32))
+            for token, (ids, tfs) in postings.items()
+        }
+        self.doc_lengths = np.asarray(lengths, dtype=np.float32)
+        self.avg_doc_length = float(self.doc_lengths.mean()) if len(lengths) else 0.0
+        logger.info(f"BM25 index built over {len(lengths)} chunks ({len(self.postings)} terms).")
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def search(self, query, top_n=5, allowed_ids=None):
+        """
+        Scores chunks against the query.
+
+        :param query: Query text.
+        :param top_n: Number of hits to return.
+        :param allowed_ids: Optional sorted array of vector ids to restrict the search to.
+        :return: List of (vector id, BM25 score), best first; only chunks sharing a token with the query.
+        """
+        n = len(self.doc_lengths)
+        if n == 0:
+            return []
+
+        scores = np.zeros(n, dtype=np.float32)
+        for token in set(tokenize(query)):
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            ids, tfs = posting
+            idf = math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[ids] / self.avg_doc_length)
+            scores[ids] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+
+        if allowed_ids is not None:
+            mask = np.zeros(n, dtype=bool)
+            mask[allowed_ids] = True
+            scores[~mask] = 0.0
+
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > top_n:
+            candidates = candidates[np.argpartition(-scores[candidates], top_n - 1)[:top_n]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(i), float(scores[i])) for i in candidates]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuses several ranked id lists with reciprocal rank fusion.
+
+    :param rankings: Iterable of id lists, each best first.
+    :param k: RRF damping constant.
+    :return: List of (id, fused score), best first.
+    """
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, idx in enumerate(ranking):
+            fused[idx] += 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
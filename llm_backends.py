@@ -0,0 +1,179 @@
+"""
+Local stand-ins for the LLM gateway, selected with LLM_BACKEND (see llm_client.get_llm_client).
+
+"offline" is an in-process, OpenAI-compatible client that returns deterministic,
+templated completions: JSON for filter parsing, sentiment and risk assessment, a
+condensed running summary for chat history compaction, and a numbered, cited summary
+of the provided context for everything else. Latency is
+configurable so load tests see realistic timing without network access or a token.
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+from itertools import count
+
+logger = logging.getLogger(__name__)
+
+# Delay before the first token, and per generated token (streaming and non-streaming alike)
+LLM_OFFLINE_LATENCY_MS = float(os.getenv("LLM_OFFLINE_LATENCY_MS", "0"))
+LLM_OFFLINE_TOKEN_MS = float(os.getenv("LLM_OFFLINE_TOKEN_MS", "0"))
+
+_CITATION = re.compile(r"^\((Document: [^)]*?)\)\s*$", re.MULTILINE)
+_YEAR = re.compile(r"\b(19\d{2}|20\d{2})\b")
+_SEVERITY_KEYWORDS = (
+    ("explosion", "Critical"),
+    ("fatal", "Critical"),
+    ("fire", "High"),
+    ("gas leak", "High"),
+    ("leak", "Moderate"),
+    ("spill", "Moderate"),
+    ("injur", "Moderate"),
+    ("equipment failure", "Low"),
+)
+_MATERIALS = ("natural gas", "crude oil", "ammonia", "chlorine", "propane", "gasoline", "diesel", "hydrogen", "gas", "oil")
+_ids = count(1)
+
+
+class _Obj:
+    """Attribute bag shaped like the OpenAI SDK response objects."""
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+def _digest(text):
+    return int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def _filters_json(query):
+    text = query.lower()
+    filters = {}
+    for material in _MATERIALS:
+        if material in text:
+            filters["material"] = material
+            break
+    years = sorted(int(y) for y in _YEAR.findall(text))
+    if years:
+        if "before" in text or "until" in text:
+            filters["to_year"] = years[-1] - ("before" in text)
+        else:
+            filters["from_year"] = years[0] + ("after" in text)
+            if len(years) > 1:
+                filters["to_year"] = years[-1]
+    if "without injur" in text or "no injur" in text:
+        filters["has_injuries"] = False
+    elif "injur" in text:
+        filters["has_injuries"] = True
+    match = re.search(r"\bin ([A-Z][a-zA-Z]+(?: [A-Z][a-zA-Z]+)?)", query)
+    if match:
+        filters["location_contains"] = match.group(1)
+    return json.dumps(filters)
+
+
+def _sentiment_json(text):
+    value = _digest(text)
+    return json.dumps({"rating": 1 + value % 5, "confidence": round(0.5 + (value % 50) / 100, 2)})
+
+
+def _risk_json(prompt):
+    text = prompt.lower()
+    for keyword, severity in _SEVERITY_KEYWORDS:
+        if keyword in text:
+            return json.dumps({"severity": severity, "rationale": f"Offline assessment: '{keyword}' mentioned."})
+    return json.dumps({"severity": "Low", "rationale": "Offline assessment: no major hazard keywords."})
+
+
+def _summary(messages):
+    context = "\n\n".join(m["content"] for m in messages if m.get("role") == "system")
+    question = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+    points = []
+    for passage in re.split(r"\n\s*\n", context):
+        lines = [line for line in passage.strip().splitlines() if line.strip()]
+        if not lines:
+            continue
+        label = _CITATION.match(lines[0])
+        body = " ".join(lines[1:] if label else lines)
+        if not body or body.startswith("You are ") or body.endswith(":"):
+            continue
+        sentence = re.split(r"(?<=[.!?])\s", body, maxsplit=1)[0][:200]
+        points.append(f"{len(points) + 1}. {sentence}" + (f" ({label.group(1)})" if label else ""))
+        if len(points) == 3:
+            break
+    if not points:
+        return f"No context was available to answer: {question[:200]}"
+    return "\n".join(points)
+
+
+def _conversation_summary(prompt):
+    current, _, turns = prompt.partition("New turns:")
+    current = current.replace("Current summary:", "").strip()
+    points = [] if current in ("", "(none)") else [current]
+    for turn in re.split(r"\n\s*\n", turns.strip()):
+        role, _, text = turn.partition(":")
+        text = re.sub(r"^\s*\d+\.\s*", "", text.strip())  # numbered answers: start at the first point
+        sentence = re.split(r"(?<=[.!?])\s", text, maxsplit=1)[0][:120]
+        if sentence:
+            points.append(f"{role.strip()} said: {sentence}")
+    return " ".join(points)[-1200:]
+
+
+def offline_completion_text(messages):
+    """Deterministic completion for the given chat messages."""
+    system = " ".join(m["content"] for m in messages if m.get("role") == "system")
+    user = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+    if "filter extraction engine" in system:
+        return _filters_json(user)
+    if "running summary of a conversation" in system:
+        return _conversation_summary(user)
+    if "Analyze sentiment" in system:
+        return _sentiment_json(user)
+    if '"severity" and "rationale"' in user:
+        return _risk_json(user)
+    return _summary(messages)
+
+
+class _OfflineCompletions:
+    def create(self, model=None, messages=None, stream=False, max_tokens=None, **params):
+        text = offline_completion_text(messages or [])
+        tokens = re.findall(r"\S+\s*", text)
+        if max_tokens:
+            tokens = tokens[:max_tokens]
+        completion_id = f"offline-{next(_ids)}"
+        if stream:
+            return self._stream(completion_id, model, tokens)
+
+        time.sleep((LLM_OFFLINE_LATENCY_MS + LLM_OFFLINE_TOKEN_MS * len(tokens)) / 1000)
+        message = _Obj(role="assistant", content="".join(tokens))
+        return _Obj(
+            id=completion_id,
+            model=model,
+            choices=[_Obj(index=0, message=message, finish_reason="stop")],
+            usage=_Obj(prompt_tokens=0, completion_tokens=len(tokens), total_tokens=len(tokens))
+        )
+
+    @staticmethod
+    def _stream(completion_id, model, tokens):
+        time.sleep(LLM_OFFLINE_LATENCY_MS / 1000)
+        for token in tokens:
+            time.sleep(LLM_OFFLINE_TOKEN_MS / 1000)
+            delta = _Obj(role="assistant", content=token)
+            yield _Obj(id=completion_id, model=model, choices=[_Obj(index=0, delta=delta, finish_reason=None)])
+
+
+class OfflineLLMClient:
+    """Drop-in for openai.OpenAI covering chat.completions.create (blocking and stream=True)."""
+
+    def __init__(self):
+        self.chat = _Obj(completions=_OfflineCompletions())
+        logger.info(
+            f"Using the offline LLM backend (latency {LLM_OFFLINE_LATENCY_MS:.0f} ms + "
+            f"{LLM_OFFLINE_TOKEN_MS:.0f} ms/token)."
+        )
+
+
+BACKENDS = {
+    "offline": OfflineLLMClient,
+}
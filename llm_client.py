@@ -0,0 +1,158 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+import httpx
+from openai import OpenAI
+
+logger = logging.getLogger(__name__)
+
+# "openai": the LLM gateway below; "offline": deterministic local stand-in (llm_backends.py)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai").lower()
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://llmfoundry.straive.com/openai/v1/")
+LLM_PROJECT = os.getenv("LLM_PROJECT", "my-test-project")
+LLM_POOL_MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "32"))
+LLM_POOL_MAX_KEEPALIVE = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "16"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))  # seconds an idle connection is kept
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "off").lower() in ("1", "true", "on")
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+# Completions in flight at once across the whole process (streams hold a slot until they finish)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+
+_client = None
+_http_client = None
+_client_lock = threading.Lock()
+
+_slots = threading.BoundedSemaphore(max(LLM_MAX_CONCURRENCY, 1))
+_stats_lock = threading.Lock()
+_stats = {
+    "requests": 0,
+    "in_flight": 0,
+    "peak_in_flight": 0,
+    "waiting": 0,
+    "wait_ms_total": 0.0,
+    "http_requests": 0,
+}
+
+
+def _http2_available():
+    if not LLM_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401  (httpx[http2] extra)
+        return True
+    except ImportError:
+        logger.warning("LLM_HTTP2 is on but the 'h2' package is not installed; using HTTP/1.1.")
+        return False
+
+
+def _count_http_request(request):
+    with _stats_lock:
+        _stats["http_requests"] += 1
+
+
+def get_llm_client():
+    """
+    Returns the process-wide OpenAI client, creating it on first use.
+
+    All components share its httpx connection pool, so TLS handshakes and keep-alive
+    connections are reused across LLMHandler instances.
+
+    :return: OpenAI client (or the LLM_BACKEND stand-in), or None if LLMFOUNDRY_TOKEN is missing
+             or the client cannot be created.
+    """
+    global _client, _http_client
+    if _client is not None:
+        return _client
+
+    with _client_lock:
+        if _client is not None:
+            return _client
+        if LLM_BACKEND != "openai":
+            from llm_backends import BACKENDS
+            backend = BACKENDS.get(LLM_BACKEND)
+            if backend is None:
+                logger.error(f"Unknown LLM_BACKEND '{LLM_BACKEND}'; expected openai or {', '.join(BACKENDS)}.")
+                return None
+            _client = backend()
+            return _client
+        token = os.getenv("LLMFOUNDRY_TOKEN", "").strip()
+        if not token:
+            logger.warning("LLMFOUNDRY_TOKEN is missing. LLM calls will not work.")
+            return None
+        try:
+            _http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=LLM_POOL_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE,
+                    keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+                ),
+                timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+                http2=_http2_available(),
+                event_hooks={"request": [_count_http_request]}
+            )
+            _client = OpenAI(
+                api_key=f"{token}:{LLM_PROJECT}",
+                base_url=LLM_BASE_URL,
+                http_client=_http_client,
+                max_retries=LLM_MAX_RETRIES
+            )
+            logger.info(
+                f"LLM client initialized (pool {LLM_POOL_MAX_CONNECTIONS}, keep-alive {LLM_POOL_MAX_KEEPALIVE}, "
+                f"concurrency {LLM_MAX_CONCURRENCY})."
+            )
+        except Exception as e:
+            logger.error(f"Error initializing LLM Foundry client: {e}")
+            _client = None
+        return _client
+
+
+@contextmanager
+def llm_slot():
+    """Holds one of the LLM_MAX_CONCURRENCY completion slots for the duration of the block."""
+    start = time.perf_counter()
+    with _stats_lock:
+        _stats["waiting"] += 1
+    _slots.acquire()
+    waited = (time.perf_counter() - start) * 1000
+    with _stats_lock:
+        _stats["waiting"] -= 1
+        _stats["requests"] += 1
+        _stats["in_flight"] += 1
+        _stats["peak_in_flight"] = max(_stats["peak_in_flight"], _stats["in_flight"])
+        _stats["wait_ms_total"] += waited
+    try:
+        yield
+    finally:
+        with _stats_lock:
+            _stats["in_flight"] -= 1
+        _slots.release()
+
+
+def _pool_connections():
+    # httpcore does not expose pool state publicly; read it defensively
+    pool = getattr(getattr(_http_client, "_transport", None), "_pool", None)
+    connections = getattr(pool, "connections", None)
+    if connections is None:
+        return None
+    return {
+        "open": len(connections),
+        "idle": sum(1 for c in connections if c.is_idle()),
+        "max": LLM_POOL_MAX_CONNECTIONS,
+    }
+
+
+def llm_client_stats():
+    """Connection pool and concurrency-limit utilisation for /api/metrics."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["avg_wait_ms"] = round(stats["wait_ms_total"] / stats["requests"], 3) if stats["requests"] else 0.0
+    stats["wait_ms_total"] = round(stats["wait_ms_total"], 2)
+    stats["max_concurrency"] = LLM_MAX_CONCURRENCY
+    stats["backend"] = LLM_BACKEND
+    stats["initialized"] = _client is not None
+    stats["connections"] = _pool_connections() if _http_client is not None else None
+    return stats
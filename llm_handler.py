@@ -1,48 +1,107 @@
-import os
 import logging
-import time
 import json
-from openai import OpenAI
+from response_cache import llm_response_cache, cache_key
+from llm_client import get_llm_client, llm_slot
+from context_packer import pack_context, format_context, context_budget
+from singleflight import get_singleflight
 
 logger = logging.getLogger(__name__)
 
+
+def iter_completion_text(client, **params):
+    """
+    Streams a chat completion and yields its text deltas as they arrive.
+
+    :param client: OpenAI-compatible client.
+    :param params: chat.completions.create arguments (model, messages, max_tokens, ...).
+    :return: Generator of non-empty text fragments.
+    """
+    stream = client.chat.completions.create(stream=True, **params)
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
+
+
 class LLMHandler:
-    def __init__(self):
-        self.token = os.getenv("LLMFOUNDRY_TOKEN", "").strip()
-        self.project = "my-test-project"
-        self.base_url = "https://llmfoundry.straive.com/openai/v1/"
+    def __init__(self, cache=None, client=None):
         self.model = "gpt-4o-mini"
-        self.cache = {}
-        self.cache_ttl = 3600  # Cache expiry time in seconds
+        self.cache = cache if cache is not None else llm_response_cache
+        # One pooled client per process, shared by every handler (see llm_client.py)
+        self.client = client if client is not None else get_llm_client()
 
-        if not self.token:
-            logger.warning("LLMFOUNDRY_TOKEN is missing. LLM calls will not work.")
-            self.client = None
-        else:
-            try:
-                self.client = OpenAI(
-                    api_key=f"{self.token}:{self.project}",
-                    base_url=self.base_url
-                )
-                logger.info("LLM Foundry client initialized successfully.")
-            except Exception as e:
-                logger.error(f"Error initializing LLM Foundry client: {e}")
-                self.client = None
+    def complete(self, messages, max_tokens=None, temperature=None, use_cache=True):
+        """
+        Runs a chat completion through the shared response cache. Every LLM call goes through here.
 
-    def _clean_cache(self):
-        current_time = time.time()
-        self.cache = {
-            k: v for k, v in self.cache.items() if current_time - v["timestamp"] <= self.cache_ttl
-        }
+        :param messages: Chat messages.
+        :param max_tokens: Optional completion token limit.
+        :param temperature: Optional sampling temperature.
+        :param use_cache: Set False to always call the model.
+        :return: The completion text.
+        :raises RuntimeError: If the LLM client is not initialized (other client errors propagate).
+        """
+        if not self.client:
+            raise RuntimeError("LLM client not initialized.")
 
-    def generate_response(self, prompt, context=None, max_length=250):
-        self._clean_cache()
-        context_str = str(context) if context else ""
-        cache_key = f"{prompt}_{context_str}"
+        params = {k: v for k, v in (("max_tokens", max_tokens), ("temperature", temperature)) if v is not None}
+        key = cache_key(self.model, messages, params)
+        if not use_cache:
+            return self._call_model(messages, params)
 
-        if cache_key in self.cache:
+        cached = self.cache.get(key)
+        if cached is not None:
             logger.info("Returning cached response.")
-            return self.cache[cache_key]["response"]
+            return cached
+        # Identical requests arriving while this one is in flight wait for it instead of calling the model
+        return get_singleflight("llm").do(key, self._call_model, messages, params, key)
+
+    def _call_model(self, messages, params, cache_key=None):
+        with llm_slot():
+            response = self.client.chat.completions.create(model=self.model, messages=messages, **params)
+        text = response.choices[0].message.content
+        if cache_key is not None:
+            self.cache.put(cache_key, text)
+        return text
+
+    def stream_complete(self, messages, max_tokens=None, temperature=None, use_cache=True):
+        """
+        Streaming variant of complete. A cache hit is yielded as a single fragment; a
+        completed stream is stored in the cache.
+
+        Identical requests arriving while a stream is in flight attach to it: they get the
+        fragments produced so far, then the rest as it arrives, from a single model call.
+
+        :return: Generator of text fragments.
+        """
+        if not self.client:
+            raise RuntimeError("LLM client not initialized.")
+
+        params = {k: v for k, v in (("max_tokens", max_tokens), ("temperature", temperature)) if v is not None}
+        key = cache_key(self.model, messages, params)
+        if not use_cache:
+            yield from self._stream_model(messages, params)
+            return
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+        yield from get_singleflight("llm_stream").stream(key, self._stream_model, messages, params, key)
+
+    def _stream_model(self, messages, params, cache_key=None):
+        parts = []
+        with llm_slot():
+            for delta in iter_completion_text(self.client, model=self.model, messages=messages, **params):
+                parts.append(delta)
+                yield delta
+        if cache_key is not None:
+            self.cache.put(cache_key, "".join(parts))
+
+    def generate_response(self, prompt, context=None, max_length=250):
+        context_str = str(context) if context else ""
 
         if not self.client:
             logger.error("LLM client not initialized.")
@@ -60,16 +119,7 @@ class LLMHandler:
                 messages.append({"role": "system", "content": context_str})
             messages.append({"role": "user", "content": prompt})
 
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=max_length,
-                temperature=0.5
-            )
-
-            generated_text = response.choices[0].message.content
-            self.cache[cache_key] = {"response": generated_text, "timestamp": time.time()}
-            return generated_text
+            return self.complete(messages, max_tokens=max_length, temperature=0.5)
         except Exception as e:
             logger.error(f"Error generating response: {e}")
             return "Error generating response."
@@ -80,15 +130,12 @@ class LLMHandler:
             return {"rating": 3, "confidence": 0.5}
 
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "Analyze sentiment and return JSON with keys 'rating' (1-5) and 'confidence' (0-1)."},
-                    {"role": "user", "content": text}
-                ]
-            )
+            content = self.complete([
+                {"role": "system", "content": "Analyze sentiment and return JSON with keys 'rating' (1-5) and 'confidence' (0-1)."},
+                {"role": "user", "content": text}
+            ])
 
-            result = json.loads(response.choices[0].message.content)
+            result = json.loads(content)
             return {
                 "rating": result.get("rating", 3),
                 "confidence": result.get("confidence", 0.5)
@@ -114,6 +161,8 @@ class LLMHandler:
                         "You are a filter extraction engine. Extract and return a JSON object "
                         "from the user's query with keys such as 'material', 'location_contains', "
                         "'from_year', 'to_year', 'has_injuries', and 'severity'. "
+                        "Years are inclusive: 'after 2022' means from_year 2023 and 'before 2022' means "
+                        "to_year 2021, while 'since 2022' and 'until 2022' include 2022. "
                         "Respond with JSON only. Do not include explanations or extra text.\n\n"
                         "Example:\n"
                         "Input: gas leaks in Texas with injuries after 2022\n"
@@ -122,7 +171,7 @@ class LLMHandler:
                         "  \"material\": \"gas\",\n"
                         "  \"location_contains\": \"Texas\",\n"
                         "  \"has_injuries\": true,\n"
-                        "  \"from_year\": 2022\n"
+                        "  \"from_year\": 2023\n"
                         "}"
                     )
                 },
@@ -132,37 +181,21 @@ class LLMHandler:
                 }
             ]
 
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=300,
-                temperature=0.3
-            )
-
-            raw = response.choices[0].message.content.strip()
+            raw = self.complete(messages, max_tokens=300, temperature=0.3).strip()
             parsed = json.loads(raw)
             return parsed
         except Exception as e:
             logger.error(f"Filter parsing error: {e}")
             return {}
         
-    def generate_summary_from_chunks(self, query, chunks, context_type="incident"):
-        """
-        Summarizes relevant info from provided chunks based on the query.
-
-        :param query: User query.
-        :param chunks: List of dictionaries with a "text" key and optional "page".
-        :param context_type: "incident" (default) or "document"
-        :return: The LLM-generated summary.
-        """
-        if not self.client:
-            return "LLM client unavailable."
-
-        # Format context with page numbers
-        context = "\n\n".join([
-        f"(Document: {chunk.get('doc', 'Unknown')}, Page: {chunk.get('page', 'Unknown')})\n{chunk['text']}" 
-        for chunk in chunks if 'text' in chunk
-    ])
+    def _summary_messages(self, query, chunks, context_type="incident", max_context_tokens=None):
+        """Builds the chat messages for generate_summary_from_chunks / stream_summary_from_chunks."""
+        # Deduplicated, token-budgeted context; each passage keeps its document/page citation
+        packed, _ = pack_context(
+            [chunk for chunk in chunks if 'text' in chunk],
+            max_context_tokens or context_budget("search")
+        )
+        context = format_context(packed)
         if context_type == "incident":
             prompt = (
                 f"Based on the following safety incident context, provide a short and clear summary "
@@ -174,25 +207,50 @@ class LLMHandler:
                 f"to the user's query: '{query}'"
             )
 
+        return [
+            {"role": "system", "content": (
+                "You are a chemical safety assistant. Use the provided context to answer questions in a numbered format.\n"
+                "For each point you mention, include the reference to its document source as: '... (Document: doc_name, Page: X)' if available.\n"
+                "You can assume some technical terms such as PPE, but do not fabricate any information."
+            )},
+            {"role": "system", "content": context},  # Full formatted context with page numbers
+            {"role": "user", "content": prompt}
+        ]
+
+    def generate_summary_from_chunks(self, query, chunks, context_type="incident", max_context_tokens=None):
+        """
+        Summarizes relevant info from provided chunks based on the query.
+
+        :param query: User query.
+        :param chunks: List of dictionaries with a "text" key and optional "page", best first.
+        :param context_type: "incident" (default) or "document"
+        :param max_context_tokens: Token budget for the context; defaults to the "search" budget.
+        :return: The LLM-generated summary.
+        """
+        if not self.client:
+            return "LLM client unavailable."
+
         try:
-            #print(context)
-            messages = [
-                {"role": "system", "content": (
-                    "You are a chemical safety assistant. Use the provided context to answer questions in a numbered format.\n"
-                    "For each point you mention, include the reference to its document source as: '... (Document: doc_name, Page: X)' if available.\n"
-                    "You can assume some technical terms such as PPE, but do not fabricate any information."
-                )},
-                {"role": "system", "content": context},  # Full formatted context with page numbers
-                {"role": "user", "content": prompt}
-            ]
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
+            return self.complete(
+                self._summary_messages(query, chunks, context_type, max_context_tokens),
                 max_tokens=300,
                 temperature=0.5
             )
-            return response.choices[0].message.content
         except Exception as e:
             logger.error(f"generate_summary_from_chunks failed: {e}")
             return "Failed to generate summary from provided context."
 
+    def stream_summary_from_chunks(self, query, chunks, context_type="incident", max_context_tokens=None):
+        """
+        Streaming variant of generate_summary_from_chunks.
+
+        Errors are raised, not turned into a fragment: a failure after some fragments were
+        sent must not look like a complete answer to the caller.
+
+        :return: Generator of text fragments.
+        """
+        yield from self.stream_complete(
+            self._summary_messages(query, chunks, context_type, max_context_tokens),
+            max_tokens=300,
+            temperature=0.5
+        )
@@ -1,11 +1,13 @@
 import os
 import logging
+# Fork the PDF parser processes before the imports below start model and tokenizer threads
+from upload_jobs import start_parser_pool
+start_parser_pool()
 from flask import Flask
 from embed_documents import EmbedDocuments
-from search_engine import SearchEngine
-from llm_handler import LLMHandler
-from chatbot import Chatbot
-from risk_assessor import RiskAssessor
+from components import timed_phase
+from chunk_store import convert_legacy_mapping
+from index_store import DEFAULT_INDEX_PATH
 from preprocess_incidents import extract_incident_data_from_txt, save_incident_data
 import pandas as pd
 import json
@@ -21,8 +23,9 @@ logger = logging.getLogger(__name__)
 # Define paths
 DOCUMENTS_FOLDER = "data/pdfs"
 PROCESSED_DOCS_FOLDER = "processed_docs"
-FAISS_INDEX_PATH = "faiss_index.bin"
-MAPPING_PATH = "doc_mapping.npy"
+FAISS_INDEX_PATH = DEFAULT_INDEX_PATH  # FAISS_INDEX_PATH environment variable
+MAPPING_PATH = "doc_mapping.npy"  # legacy pickled mapping, converted to CHUNK_STORE_PATH
+CHUNK_STORE_PATH = "doc_chunks"
 
 # Incident data preprocessing paths
 INCIDENT_DOCX_PATH = "processed_docs/Incident_report_modified_without regulatory clause_200 cases.docx.txt"
@@ -34,19 +37,15 @@ INCIDENT_JSON_PATH = os.path.join(INCIDENT_OUTPUT_FOLDER, "incident_reports.json
 os.makedirs(PROCESSED_DOCS_FOLDER, exist_ok=True)
 os.makedirs(INCIDENT_OUTPUT_FOLDER, exist_ok=True)
 
-# Initialize components
-# We no longer use doc_processor for PDF extraction since we want page numbers.
-embedder = EmbedDocuments()  # This module now has process_file integrated.
-search_engine = SearchEngine(index_path=FAISS_INDEX_PATH, mapping_path=MAPPING_PATH)
-llm_handler = LLMHandler()
-chatbot = Chatbot()
-risk_assessor = RiskAssessor()
+# Search, chat and risk components are built lazily by components.py (shared with routes).
 
 def process_and_embed_documents():
     """Processes documents from DOCUMENTS_FOLDER using the integrated extraction/chunking,
        then embeds and indexes them.
     """
     logger.info("Processing documents...")
+    # We no longer use doc_processor for PDF extraction since we want page numbers.
+    embedder = EmbedDocuments()  # This module now has process_file integrated.
     # List only supported files (PDF and DOCX)
     files = [f for f in os.listdir(DOCUMENTS_FOLDER) if f.lower().endswith((".pdf", ".docx"))]
     
@@ -70,7 +69,7 @@ def process_and_embed_documents():
 
     logger.info(f"Total chunks created: {len(all_chunks)}")
     embedder.embed_texts(all_chunks)
-    embedder.save_index(index_path=FAISS_INDEX_PATH, mapping_path=MAPPING_PATH)
+    embedder.save_index(index_path=FAISS_INDEX_PATH, chunk_store_path=CHUNK_STORE_PATH)
     logger.info("Documents processed, chunked, and indexed successfully.")
 
 def preprocess_incident_data():
@@ -91,14 +90,19 @@ def preprocess_incident_data():
         logger.error(f"Failed to preprocess incident data: {e}")
 
 # Run preprocessors before app launch
-if not os.path.exists(FAISS_INDEX_PATH):
-    process_and_embed_documents()
-else:
-    logger.info("FAISS index already exists. Skipping document processing.")
-
-preprocess_incident_data()
-
-# Import routes after initialization
+with timed_phase("preprocess:documents"):
+    if not os.path.exists(FAISS_INDEX_PATH):
+        process_and_embed_documents()
+    else:
+        logger.info("FAISS index already exists. Skipping document processing.")
+        if not os.path.exists(CHUNK_STORE_PATH) and os.path.exists(MAPPING_PATH):
+            logger.info(f"Converting legacy {MAPPING_PATH} to chunk store {CHUNK_STORE_PATH}.")
+            convert_legacy_mapping(MAPPING_PATH, CHUNK_STORE_PATH)
+
+with timed_phase("preprocess:incidents"):
+    preprocess_incident_data()
+
+# Import routes after initialization (app.py starts the warm-up)
 from routes import *
 
 if __name__ == "__main__":
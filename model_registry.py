@@ -0,0 +1,189 @@
+import os
+import logging
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+from sentence_transformers import SentenceTransformer
+from embedding_cache import query_embedding_cache, normalize_query
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBED_MODEL = "all-mpnet-base-v2"
+
+_models = {}  # model name → EmbeddingModel
+_registry_lock = threading.Lock()
+
+
+def _after_fork_in_child():
+    # Locks held by a thread that did not survive the fork (e.g. a warm-up loading or
+    # encoding under gunicorn --preload) would never be released in the child
+    global _registry_lock
+    _registry_lock = threading.Lock()
+    for handle in _models.values():
+        handle._lock = threading.Lock()
+        handle._pending_lock = threading.Lock()
+        handle._pending = {}
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def current_rss_bytes():
+    """Returns the resident set size of this process in bytes (0 if it cannot be read)."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        # ru_maxrss is the peak RSS in KB on Linux; the best we can do without /proc.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except Exception:
+        return 0
+
+
+class EmbeddingModel:
+    """
+    Thread-safe handle around a shared SentenceTransformer.
+
+    Fast tokenizers are not safe to call from several threads at once, so every
+    encode goes through a per-model lock. Handles are cheap; the model is not.
+    """
+
+    def __init__(self, name, model, load_seconds=0.0, rss_bytes=0):
+        self.name = name
+        self.model = model
+        self.load_seconds = load_seconds
+        self.rss_bytes = rss_bytes
+        self._lock = threading.Lock()
+        self._pending = {}  # normalized query → Future of the encode in flight
+        self._pending_lock = threading.Lock()
+        self.coalesced = 0
+
+    def encode(self, sentences, **kwargs):
+        with self._lock:
+            return self.model.encode(sentences, **kwargs)
+
+    def encode_queries(self, queries):
+        """
+        Encodes queries to normalized float32 vectors through the shared query embedding cache.
+
+        Cache misses are encoded together in a single forward pass. A miss that another
+        thread is already encoding waits for that result instead of encoding it again.
+
+        :param queries: List of query strings.
+        :return: numpy array of shape (len(queries), dim).
+        """
+        vectors = [query_embedding_cache.get(self.name, q) for q in queries]
+        missing = {}  # normalized query → indices of the misses with that text
+        for i, v in enumerate(vectors):
+            if v is None:
+                missing.setdefault(normalize_query(queries[i]), []).append(i)
+        if missing:
+            owned, waiting = [], []
+            with self._pending_lock:
+                for key in missing:
+                    future = self._pending.get(key)
+                    if future is None:
+                        self._pending[key] = Future()
+                        owned.append(key)
+                    else:
+                        waiting.append((key, future))
+                self.coalesced += len(waiting)
+
+            results = {}
+            if owned:
+                try:
+                    encoded = self.encode(
+                        [queries[missing[key][0]] for key in owned],
+                        normalize_embeddings=True,
+                        convert_to_numpy=True
+                    ).astype(np.float32)
+                except BaseException as e:
+                    with self._pending_lock:
+                        for key in owned:
+                            self._pending.pop(key).set_exception(e)
+                    raise
+                for row, key in enumerate(owned):
+                    results[key] = encoded[row]
+                    query_embedding_cache.put(self.name, key, encoded[row])
+                with self._pending_lock:
+                    for key in owned:
+                        self._pending.pop(key).set_result(results[key])
+            for key, future in waiting:
+                results[key] = future.result()
+            for key, indices in missing.items():
+                for i in indices:
+                    vectors[i] = results[key]
+        return np.vstack(vectors)
+
+    def get_sentence_embedding_dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+
+def get_embedding_model(name=DEFAULT_EMBED_MODEL):
+    """
+    Returns the process-wide handle for the given model, loading it on first use.
+
+    :param name: SentenceTransformer model name.
+    :return: EmbeddingModel shared by every caller in this process.
+    """
+    handle = _models.get(name)
+    if handle is not None:
+        return handle
+
+    with _registry_lock:
+        handle = _models.get(name)
+        if handle is None:
+            rss_before = current_rss_bytes()
+            start = time.perf_counter()
+            model = SentenceTransformer(name)
+            elapsed = time.perf_counter() - start
+            rss_delta = max(current_rss_bytes() - rss_before, 0)
+            handle = EmbeddingModel(name, model, load_seconds=elapsed, rss_bytes=rss_delta)
+            _models[name] = handle
+            logger.info(
+                f"Loaded embedding model {name} in {elapsed:.2f}s "
+                f"(+{rss_delta / (1024 * 1024):.1f} MB RSS, pid {os.getpid()})."
+            )
+    return handle
+
+
+def model_report():
+    """
+    Summarizes the models loaded in this process.
+
+    :return: Dictionary with the model count, per-model load time and RSS, and total process RSS.
+    """
+    models = [
+        {
+            "name": handle.name,
+            "load_seconds": round(handle.load_seconds, 3),
+            "rss_bytes": handle.rss_bytes,
+            "coalesced_encodes": handle.coalesced,
+        }
+        for handle in list(_models.values())
+    ]
+    return {
+        "pid": os.getpid(),
+        "models_loaded": len(models),
+        "models": models,
+        "models_rss_bytes": sum(m["rss_bytes"] for m in models),
+        "process_rss_bytes": current_rss_bytes(),
+    }
+
+
+def log_model_report():
+    """Logs the model_report() summary."""
+    report = model_report()
+    names = ", ".join(m["name"] for m in report["models"]) or "none"
+    logger.info(
+        f"Embedding models loaded: {report['models_loaded']} ({names}); "
+        f"models RSS {report['models_rss_bytes'] / (1024 * 1024):.1f} MB, "
+        f"process RSS {report['process_rss_bytes'] / (1024 * 1024):.1f} MB."
+    )
+    return report
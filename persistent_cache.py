@@ -0,0 +1,192 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from index_store import index_version, index_files
+
+logger = logging.getLogger(__name__)
+
+# Enabled with LLM_PERSISTENT_CACHE=1 (default path) or LLM_PERSISTENT_CACHE=<path>; see response_cache.py
+DEFAULT_PERSISTENT_CACHE_PATH = "data/llm_cache.sqlite3"
+LLM_PERSISTENT_CACHE_MAX_BYTES = int(os.getenv("LLM_PERSISTENT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+LLM_PERSISTENT_CACHE_COMPACT_SECONDS = int(os.getenv("LLM_PERSISTENT_CACHE_COMPACT_SECONDS", "300"))
+
+# Files whose change means cached answers may cite chunks that no longer exist
+INDEX_VERSION_PATHS = index_files()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    index_version TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_expires ON responses (expires_at);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at);
+"""
+
+
+class SQLiteResponseCache:
+    """
+    LLM response cache in a local SQLite database, shared by every worker on the node.
+
+    The database runs in WAL mode so readers in other processes never block on a writer.
+    Each row records the index version it was produced under; rows from another version
+    are never returned, so answers cannot cite chunks from a previous index build.
+    A daemon thread periodically deletes expired and stale rows and trims the database
+    to max_bytes by least recent access.
+    """
+
+    def __init__(self, path=DEFAULT_PERSISTENT_CACHE_PATH, ttl=3600, max_bytes=LLM_PERSISTENT_CACHE_MAX_BYTES,
+                 compact_seconds=LLM_PERSISTENT_CACHE_COMPACT_SECONDS, version_paths=INDEX_VERSION_PATHS):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.compact_seconds = compact_seconds
+        self.version_paths = version_paths
+        self._version = None
+        self._local = threading.local()  # per-thread connection, with the pid that opened it
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.compactions = 0
+        self._stats_lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Built at import, possibly in a gunicorn --preload master: nothing may stay open across the fork
+        conn = sqlite3.connect(path, timeout=5.0, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+        # Started on first use in the process that serves requests (threads do not survive fork)
+        self._compactor_pid = None
+        self._compactor_lock = threading.Lock()
+        logger.info(f"Persistent LLM response cache at {path} (index version {self.index_version}).")
+
+    @property
+    def index_version(self):
+        # Taken on first use, i.e. for the index this process serves (indexes are loaded once per process)
+        if self._version is None:
+            self._version = index_version(*self.version_paths)
+        return self._version
+
+    def _connect(self):
+        pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        # A connection inherited through fork must not be used (or closed) by the child
+        if conn is None or self._local.pid != pid:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, pid
+            self._start_compactor()
+        return conn
+
+    def _start_compactor(self):
+        if self.compact_seconds <= 0 or self._compactor_pid == os.getpid():
+            return
+        with self._compactor_lock:
+            if self._compactor_pid != os.getpid():
+                self._compactor_pid = os.getpid()
+                threading.Thread(target=self._compact_loop, name="llm-cache-compactor", daemon=True).start()
+
+    def _count(self, field):
+        with self._stats_lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def get(self, key):
+        now = time.time()
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value FROM responses WHERE key = ? AND index_version = ? AND expires_at > ?",
+                (key, self.index_version, now)
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            logger.warning(f"Persistent cache read failed: {e}")
+            self._count("errors")
+            return None
+        self._count("hits" if row is not None else "misses")
+        return row[0] if row is not None else None
+
+    def put(self, key, text):
+        if not text:
+            return
+        now = time.time()
+        try:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, index_version, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, text, len(text.encode("utf-8")), self.index_version, now + self.ttl, now)
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Persistent cache write failed: {e}")
+            self._count("errors")
+
+    def compact(self):
+        """Deletes expired and stale-version rows, trims to max_bytes and checkpoints the WAL."""
+        conn = self._connect()
+        removed = conn.execute(
+            "DELETE FROM responses WHERE expires_at <= ? OR index_version != ?",
+            (time.time(), self.index_version)
+        ).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > self.max_bytes:
+            # Drop the least recently accessed rows until the budget fits
+            cutoff = conn.execute(
+                "SELECT accessed_at FROM (SELECT accessed_at, SUM(size) OVER (ORDER BY accessed_at DESC) AS kept "
+                "FROM responses) WHERE kept > ? ORDER BY accessed_at DESC LIMIT 1",
+                (self.max_bytes,)
+            ).fetchone()
+            if cutoff is not None:
+                removed += conn.execute("DELETE FROM responses WHERE accessed_at <= ?", (cutoff[0],)).rowcount
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._count("compactions")
+        if removed:
+            logger.info(f"Persistent LLM cache compaction removed {removed} rows.")
+        return removed
+
+    def _compact_loop(self):
+        while True:
+            time.sleep(self.compact_seconds)
+            try:
+                self.compact()
+            except sqlite3.Error as e:
+                logger.warning(f"Persistent cache compaction failed: {e}")
+
+    def clear(self):
+        self._connect().execute("DELETE FROM responses")
+
+    def stats(self):
+        try:
+            entries, size = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses WHERE index_version = ?",
+                (self.index_version,)
+            ).fetchone()
+        except sqlite3.Error:
+            entries, size = None, None
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                "path": self.path,
+                "index_version": self.index_version,
+                "entries": entries,
+                "bytes": size,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "compactions": self.compactions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
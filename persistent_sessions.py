@@ -0,0 +1,440 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+from upload_index import UploadIndex
+from session_store import (
+    SessionQuotaExceeded, UploadCancelled, MESSAGE_OVERHEAD_BYTES, SESSION_TTL, SESSION_MAX_BYTES,
+    SESSION_MAX_MESSAGES, SESSION_MAX_UPLOAD_CHUNKS
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SESSION_DB_PATH = "data/sessions.sqlite3"
+SESSION_DB_MAX_BYTES = int(os.getenv("SESSION_DB_MAX_BYTES", str(1024 * 1024 * 1024)))
+SESSION_DB_COMPACT_SECONDS = int(os.getenv("SESSION_DB_COMPACT_SECONDS", "300"))
+# Sessions whose uploads stay loaded in this worker, and the memory they may take (UploadIndex.nbytes);
+# least recently used sessions past either limit are dropped and read back from the database on use
+SESSION_UPLOAD_CACHE_SESSIONS = int(os.getenv("SESSION_UPLOAD_CACHE_SESSIONS", "64"))
+SESSION_UPLOAD_CACHE_BYTES = int(os.getenv("SESSION_UPLOAD_CACHE_BYTES", str(256 * 1024 * 1024)))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id);
+CREATE TABLE IF NOT EXISTS upload_chunks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    chunk_id TEXT NOT NULL,
+    doc TEXT,
+    page INTEGER,
+    text TEXT NOT NULL,
+    vector BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS upload_chunks_session ON upload_chunks (session_id, id);
+CREATE TABLE IF NOT EXISTS summaries (
+    session_id TEXT PRIMARY KEY,
+    summary TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS upload_jobs (
+    job_id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS upload_jobs_session ON upload_jobs (session_id);
+"""
+
+
+class _LoadedUploads:
+    """A session's UploadIndex as loaded by this worker, with the range of upload rows it holds."""
+    __slots__ = ("index", "first_id", "last_id", "nbytes")
+
+    def __init__(self, index, first_id):
+        self.index = index
+        self.first_id = first_id
+        self.last_id = 0
+        self.nbytes = 0
+
+
+class SQLiteSessionStore:
+    """
+    Chat sessions in a local SQLite database, shared by every worker on the node.
+
+    Same interface as session_store.SessionStore, so a follow-up can land on any worker
+    and still see the conversation and the uploaded documents. Messages are plain rows;
+    upload vectors are stored as float16 blobs (half the size of float32, no measurable
+    effect on cosine ranking). Uploads are loaded lazily: each worker keeps the
+    UploadIndex of recently used sessions and reads only rows added since it last looked,
+    so an upload embedded by another worker becomes visible on the next turn. Upload rows
+    are only ever appended or deleted with their whole session, so a changed first row id
+    means another worker cleared or evicted the session and the cached index is dropped.
+
+    A daemon thread deletes sessions idle for longer than the TTL and trims the
+    database to max_bytes by least recent use.
+    """
+
+    def __init__(self, path=DEFAULT_SESSION_DB_PATH, ttl=SESSION_TTL, max_bytes=SESSION_DB_MAX_BYTES,
+                 session_max_bytes=SESSION_MAX_BYTES, max_messages=SESSION_MAX_MESSAGES,
+                 max_upload_chunks=SESSION_MAX_UPLOAD_CHUNKS, compact_seconds=SESSION_DB_COMPACT_SECONDS,
+                 upload_cache_sessions=SESSION_UPLOAD_CACHE_SESSIONS, upload_cache_bytes=SESSION_UPLOAD_CACHE_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.session_max_bytes = session_max_bytes
+        self.max_messages = max_messages
+        self.max_upload_chunks = max_upload_chunks
+        self.compact_seconds = compact_seconds
+        self.upload_cache_sessions = upload_cache_sessions
+        self.upload_cache_bytes = upload_cache_bytes
+        self._local = threading.local()
+        # session_id → _LoadedUploads, least recently used first
+        self._uploads = OrderedDict()
+        self._uploads_bytes = 0
+        self._uploads_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+        self.rejected_uploads = 0
+        self.upload_loads = 0
+        self.upload_cache_hits = 0
+        self.upload_invalidations = 0
+        self.compactions = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connect().executescript(_SCHEMA)
+
+        self._compactor = None
+        if compact_seconds > 0:
+            self._compactor = threading.Thread(target=self._compact_loop, name="session-compactor", daemon=True)
+            self._compactor.start()
+        logger.info(f"Chat sessions stored in {path}.")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _count(self, field, n=1):
+        with self._stats_lock:
+            setattr(self, field, getattr(self, field) + n)
+
+    def _delete_sessions(self, conn, session_ids):
+        for session_id in session_ids:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM upload_chunks WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM upload_jobs WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM summaries WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        with self._uploads_lock:
+            for session_id in session_ids:
+                self._drop_loaded(session_id)
+
+    def _drop_loaded(self, session_id):
+        loaded = self._uploads.pop(session_id, None)
+        if loaded is not None:
+            self._uploads_bytes -= loaded.nbytes
+
+    def _touch(self, conn, session_id, create=False):
+        """Refreshes last_access; returns the session's byte count, or None if it does not exist (or expired)."""
+        now = time.time()
+        row = conn.execute("SELECT bytes, last_access FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is not None and now - row[1] > self.ttl:
+            self._delete_sessions(conn, [session_id])
+            self._count("expirations")
+            row = None
+        if row is None:
+            if not create:
+                return None
+            conn.execute("INSERT INTO sessions (session_id, bytes, last_access) VALUES (?, 0, ?)", (session_id, now))
+            return 0
+        conn.execute("UPDATE sessions SET last_access = ? WHERE session_id = ?", (now, session_id))
+        return row[0]
+
+    def get_messages(self, session_id):
+        """:return: The session's stored messages, oldest first."""
+        return [message for _, message in self.get_messages_with_seq(session_id)]
+
+    def get_messages_with_seq(self, session_id):
+        """:return: List of (sequence number, message), oldest first; row ids serve as sequence numbers."""
+        with self._transaction() as conn:
+            if self._touch(conn, session_id) is None:
+                return []
+            rows = conn.execute(
+                "SELECT id, role, content FROM messages WHERE session_id = ? ORDER BY id", (session_id,)
+            ).fetchall()
+        return [(seq, {"role": role, "content": content}) for seq, role, content in rows]
+
+    def get_summary(self, session_id):
+        """:return: The running summary of the session's folded messages ("" if none)."""
+        row = self._connect().execute("SELECT summary FROM summaries WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row is not None else ""
+
+    def fold_messages(self, session_id, summary, through_seq):
+        """Replaces the running summary and drops the messages up to through_seq it now covers."""
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone() is None:
+                return
+            conn.execute(
+                "INSERT OR REPLACE INTO summaries (session_id, summary) VALUES (?, ?)", (session_id, summary)
+            )
+            conn.execute("DELETE FROM messages WHERE session_id = ? AND id <= ?", (session_id, through_seq))
+            self._update_bytes(conn, session_id)
+
+    def append_messages(self, session_id, *messages):
+        """Stores messages, keeping at most max_messages per session."""
+        with self._transaction() as conn:
+            self._touch(conn, session_id, create=True)
+            conn.executemany(
+                "INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)",
+                [(session_id, m["role"], m.get("content") or "") for m in messages]
+            )
+            conn.execute(
+                "DELETE FROM messages WHERE session_id = ? AND id NOT IN "
+                "(SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?)",
+                (session_id, session_id, self.max_messages)
+            )
+            self._update_bytes(conn, session_id)
+
+    def _update_bytes(self, conn, session_id):
+        conn.execute(
+            "UPDATE sessions SET bytes = "
+            "(SELECT COALESCE(SUM(LENGTH(content) + ?), 0) FROM messages WHERE session_id = ?) + "
+            "(SELECT COALESCE(SUM(LENGTH(text) + LENGTH(vector)), 0) FROM upload_chunks WHERE session_id = ?) + "
+            "(SELECT COALESCE(SUM(LENGTH(summary)), 0) FROM summaries WHERE session_id = ?) "
+            "WHERE session_id = ?",
+            (MESSAGE_OVERHEAD_BYTES, session_id, session_id, session_id, session_id)
+        )
+
+    def get_uploads(self, session_id):
+        """
+        :return: The session's UploadIndex, or None if it has no uploads. Only rows added
+                 since this worker last loaded the session are read.
+        """
+        with self._transaction() as conn:
+            if self._touch(conn, session_id) is None:
+                return None
+
+        # Held while reading and extending so concurrent turns never add the same rows twice;
+        # WAL reads never wait on writers, so this cannot deadlock with _delete_sessions
+        with self._uploads_lock:
+            conn = self._connect()
+            loaded = self._uploads.get(session_id)
+            if loaded is not None:
+                first_id, = conn.execute(
+                    "SELECT MIN(id) FROM upload_chunks WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                if first_id != loaded.first_id:
+                    # Cleared or evicted by another worker (and possibly uploaded to again)
+                    self._drop_loaded(session_id)
+                    self._count("upload_invalidations")
+                    loaded = None
+            rows = conn.execute(
+                "SELECT id, chunk_id, doc, page, text, vector FROM upload_chunks "
+                "WHERE session_id = ? AND id > ? ORDER BY id",
+                (session_id, loaded.last_id if loaded is not None else 0)
+            ).fetchall()
+            if not rows:
+                if loaded is None:
+                    return None
+                self._uploads.move_to_end(session_id)
+                self._count("upload_cache_hits")
+                return loaded.index
+
+            chunks = [{"chunk_id": r[1], "doc": r[2], "page": r[3], "text": r[4]} for r in rows]
+            vectors = np.vstack([np.frombuffer(r[5], dtype=np.float16) for r in rows]).astype(np.float32)
+            if loaded is None:
+                loaded = self._uploads[session_id] = _LoadedUploads(UploadIndex(), rows[0][0])
+            loaded.index.add(chunks, vectors)
+            loaded.last_id = rows[-1][0]
+            self._uploads_bytes -= loaded.nbytes
+            loaded.nbytes = loaded.index.nbytes
+            self._uploads_bytes += loaded.nbytes
+            self._count("upload_loads")
+            self._uploads.move_to_end(session_id)
+            while len(self._uploads) > 1 and (len(self._uploads) > self.upload_cache_sessions
+                                              or self._uploads_bytes > self.upload_cache_bytes):
+                self._drop_loaded(next(iter(self._uploads)))
+            return loaded.index
+
+    def add_upload(self, session_id, chunks, vectors, job_id=None):
+        """
+        Stores embedded upload chunks with float16 vectors.
+
+        :param job_id: Upload job the chunks belong to; they are only added while the job exists.
+        :raises SessionQuotaExceeded: if the chunks would exceed the session's chunk or byte quota.
+        :raises UploadCancelled: if the job was removed (the session was cleared, evicted or expired).
+        """
+        blobs = [np.asarray(v, dtype=np.float16).tobytes() for v in vectors]
+        added_bytes = sum(len(b) for b in blobs) + sum(len(c["text"]) for c in chunks)
+        with self._transaction() as conn:
+            if job_id is not None and conn.execute(
+                    "SELECT 1 FROM upload_jobs WHERE job_id = ?", (job_id,)).fetchone() is None:
+                raise UploadCancelled(f"upload job {job_id} no longer exists")
+            session_bytes = self._touch(conn, session_id, create=True)
+            chunk_count = conn.execute(
+                "SELECT COUNT(*) FROM upload_chunks WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+            if chunk_count + len(chunks) > self.max_upload_chunks:
+                self._count("rejected_uploads")
+                raise SessionQuotaExceeded(
+                    f"{chunk_count + len(chunks)} uploaded chunks exceed the {self.max_upload_chunks} chunk quota"
+                )
+            if session_bytes + added_bytes > self.session_max_bytes:
+                self._count("rejected_uploads")
+                raise SessionQuotaExceeded(
+                    f"{session_bytes + added_bytes} bytes exceed the {self.session_max_bytes} byte session quota"
+                )
+            conn.executemany(
+                "INSERT INTO upload_chunks (session_id, chunk_id, doc, page, text, vector) VALUES (?, ?, ?, ?, ?, ?)",
+                [(session_id, c["chunk_id"], c.get("doc"), c.get("page"), c["text"], blob)
+                 for c, blob in zip(chunks, blobs)]
+            )
+            self._update_bytes(conn, session_id)
+
+    def clear(self, session_id):
+        with self._transaction() as conn:
+            existed = conn.execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            self._delete_sessions(conn, [session_id])
+        return existed is not None
+
+    def put_job(self, job, create=True):
+        """
+        Saves an upload job status dictionary (keyed by its "job_id"), visible to every worker.
+
+        :param create: False only updates a job that still exists.
+        :return: False if create is False and the job no longer exists.
+        """
+        if not create:
+            cursor = self._connect().execute(
+                "UPDATE upload_jobs SET status = ?, updated_at = ? WHERE job_id = ?",
+                (json.dumps(job), time.time(), job["job_id"])
+            )
+            return cursor.rowcount > 0
+        self._connect().execute(
+            "INSERT OR REPLACE INTO upload_jobs (job_id, session_id, status, updated_at) VALUES (?, ?, ?, ?)",
+            (job["job_id"], job["session_id"], json.dumps(job), time.time())
+        )
+        return True
+
+    def get_job(self, job_id):
+        row = self._connect().execute("SELECT status FROM upload_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def compact(self):
+        """Deletes expired sessions, trims to max_bytes by least recent use and checkpoints the WAL."""
+        with self._transaction() as conn:
+            expired = [r[0] for r in conn.execute(
+                "SELECT session_id FROM sessions WHERE last_access < ?", (time.time() - self.ttl,)
+            )]
+            self._delete_sessions(conn, expired)
+            evicted = [r[0] for r in conn.execute(
+                "SELECT session_id FROM (SELECT session_id, SUM(bytes) OVER (ORDER BY last_access DESC) AS kept "
+                "FROM sessions) WHERE kept > ?",
+                (self.max_bytes,)
+            )]
+            self._delete_sessions(conn, evicted)
+            conn.execute("DELETE FROM upload_jobs WHERE updated_at < ?", (time.time() - self.ttl,))
+        self._connect().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._count("expirations", len(expired))
+        self._count("evictions", len(evicted))
+        self._count("compactions")
+        if expired or evicted:
+            logger.info(f"Session compaction removed {len(expired)} expired and {len(evicted)} evicted sessions.")
+        return len(expired) + len(evicted)
+
+    def _compact_loop(self):
+        while True:
+            time.sleep(self.compact_seconds)
+            try:
+                self.compact()
+            except sqlite3.Error as e:
+                logger.warning(f"Session compaction failed: {e}")
+
+    def _describe(self, conn, session_id, session_bytes, last_access, now):
+        messages, = conn.execute("SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)).fetchone()
+        chunks, = conn.execute("SELECT COUNT(*) FROM upload_chunks WHERE session_id = ?", (session_id,)).fetchone()
+        return {
+            "session_id": session_id,
+            "bytes": session_bytes,
+            "messages": messages,
+            "upload_chunks": chunks,
+            "idle_seconds": round(now - last_access, 1),
+        }
+
+    def session_stats(self, session_id):
+        conn = self._connect()
+        row = conn.execute("SELECT bytes, last_access FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        return self._describe(conn, session_id, row[0], row[1], time.time())
+
+    def stats(self, largest=10):
+        """Totals plus the largest sessions by stored bytes."""
+        now = time.time()
+        try:
+            conn = self._connect()
+            sessions, total = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM sessions WHERE last_access >= ?", (now - self.ttl,)
+            ).fetchone()
+            top = [
+                self._describe(conn, *row, now)
+                for row in conn.execute(
+                    "SELECT session_id, bytes, last_access FROM sessions ORDER BY bytes DESC LIMIT ?", (largest,)
+                )
+            ]
+        except sqlite3.Error:
+            sessions, total, top = None, None, []
+        with self._uploads_lock:
+            loaded = len(self._uploads)
+            loaded_bytes = self._uploads_bytes
+        with self._stats_lock:
+            return {
+                "backend": "sqlite",
+                "path": self.path,
+                "sessions": sessions,
+                "bytes": total,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "rejected_uploads": self.rejected_uploads,
+                "compactions": self.compactions,
+                "uploads_loaded_sessions": loaded,
+                "uploads_loaded_bytes": loaded_bytes,
+                "upload_loads": self.upload_loads,
+                "upload_cache_hits": self.upload_cache_hits,
+                "upload_invalidations": self.upload_invalidations,
+                "largest_sessions": top,
+            }
@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2048"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "3600"))  # seconds
+
+
+def cache_key(model, messages, params):
+    """
+    Stable digest of a completion request.
+
+    :param model: Model name.
+    :param messages: Chat messages sent to the model.
+    :param params: Sampling parameters (max_tokens, temperature, ...).
+    :return: Hex SHA-256 of the canonical JSON form; a few dozen bytes instead of the full prompt.
+    """
+    payload = json.dumps(
+        {"model": model, "messages": messages, "params": params},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Bounded, thread-safe LRU of LLM completions with a time-to-live.
+
+    Every operation is O(1) amortized: expired entries are dropped when they are read
+    or when they reach the LRU end during eviction, never by scanning the whole cache.
+    Size is bounded both in entries and in bytes of cached text.
+    """
+
+    def __init__(self, max_entries=LLM_CACHE_MAX_ENTRIES, max_bytes=LLM_CACHE_MAX_BYTES, ttl=LLM_CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key → (expires_at, text, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _drop(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] <= now:
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, text):
+        if self.max_entries <= 0 or not text:
+            return
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (now + self.ttl, text, size)
+            self._bytes += size
+            while self._entries and (
+                len(self._entries) > self.max_entries
+                or self._bytes > self.max_bytes
+                or next(iter(self._entries.values()))[0] <= now
+            ):
+                oldest_key, (expires_at, _, _) = next(iter(self._entries.items()))
+                self._drop(oldest_key)
+                if expires_at <= now:
+                    self.expirations += 1
+                else:
+                    self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class TieredResponseCache:
+    """
+    In-process ResponseCache in front of a persistent cache shared between workers.
+
+    Persistent hits are promoted into the memory tier; writes go to both tiers.
+    """
+
+    def __init__(self, memory, persistent):
+        self.memory = memory
+        self.persistent = persistent
+
+    def get(self, key):
+        text = self.memory.get(key)
+        if text is not None:
+            return text
+        text = self.persistent.get(key)
+        if text is not None:
+            self.memory.put(key, text)
+        return text
+
+    def put(self, key, text):
+        self.memory.put(key, text)
+        self.persistent.put(key, text)
+
+    def clear(self):
+        self.memory.clear()
+        self.persistent.clear()
+
+    def stats(self):
+        return {"memory": self.memory.stats(), "persistent": self.persistent.stats()}
+
+
+def _build_llm_response_cache():
+    memory = ResponseCache()
+    setting = os.getenv("LLM_PERSISTENT_CACHE", "").strip()
+    if not setting or setting.lower() in ("0", "false", "off"):
+        return memory
+
+    from persistent_cache import SQLiteResponseCache, DEFAULT_PERSISTENT_CACHE_PATH
+    path = DEFAULT_PERSISTENT_CACHE_PATH if setting.lower() in ("1", "true", "on", "sqlite") else setting
+    try:
+        return TieredResponseCache(memory, SQLiteResponseCache(path, ttl=LLM_CACHE_TTL))
+    except Exception as e:
+        logger.error(f"Could not open persistent LLM cache {path}; using the in-memory cache only: {e}")
+        return memory
+
+
+# Shared by every LLMHandler in the process; LLM_PERSISTENT_CACHE=1 (or a path) adds the on-disk tier
+llm_response_cache = _build_llm_response_cache()
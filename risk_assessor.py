@@ -7,10 +7,10 @@ from search_engine import SearchEngine
 logger = logging.getLogger(__name__)
 
 class RiskAssessor:
-    def __init__(self):
-        """Initializes the Risk Assessor with LLM API and Vector Search."""
-        self.llm_handler = LLMHandler()
-        self.search_engine = SearchEngine()  # Retrieve past similar incidents
+    def __init__(self, search_engine=None, llm_handler=None):
+        """Initializes the Risk Assessor with LLM API and Vector Search (shared instances if given)."""
+        self.llm_handler = llm_handler or LLMHandler()
+        self.search_engine = search_engine or SearchEngine()  # Retrieve past similar incidents
 
     def assess_severity(self, incident_description):
         """
@@ -1,22 +1,85 @@
-from flask import render_template, request, jsonify, session
+from flask import render_template, request, jsonify, session, Response, stream_with_context
 import uuid
 import logging
 import os
 from app import app
-from search_engine import SearchEngine
-from llm_handler import LLMHandler
-from chatbot import Chatbot
-from risk_assessor import RiskAssessor
+from components import (
+    get_search_engine,
+    get_llm_handler,
+    get_chatbot,
+    get_risk_assessor,
+    readiness
+)
+from model_registry import model_report
+from embedding_cache import query_embedding_cache
+from response_cache import llm_response_cache
+from semantic_cache import semantic_cache_stats
+from llm_client import llm_client_stats
+from context_packer import context_budget
+from singleflight import singleflight_stats
+from filter_parser import get_filter_parser, filter_parser_stats
+from session_store import session_store_stats
+from history_summarizer import history_summarizer_stats
+from upload_jobs import get_upload_ingestor, upload_jobs_stats, UploadQueueFull, UPLOADS_FOLDER, UPLOAD_EXTENSIONS
+from werkzeug.utils import secure_filename
 import pandas as pd 
 import json 
 
 logger = logging.getLogger(__name__)
 
-# Initialize components
-search_engine = SearchEngine()
-llm_handler = LLMHandler()
-chatbot = Chatbot()
-risk_assessor = RiskAssessor()
+# Components are built lazily on first use (or by the warm-up started in app.py)
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: the process is up and serving requests."""
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: index, models and incident embeddings are loaded and the model is warmed up."""
+    state = readiness()
+    return jsonify(state), (200 if state["ready"] else 503)
+
+@app.route('/api/metrics')
+def api_metrics():
+    """Per-worker metrics: loaded models, resident vs shared index bytes and cache counters."""
+    return jsonify({
+        "models": model_report(),
+        "index": get_search_engine().index_stats(),
+        "embedding_cache": query_embedding_cache.stats(),
+        "llm_cache": llm_response_cache.stats(),
+        "semantic_cache": semantic_cache_stats(),
+        "llm_client": llm_client_stats(),
+        "singleflight": singleflight_stats(),
+        "filter_parser": filter_parser_stats(),
+        "sessions": session_store_stats(),
+        "uploads": upload_jobs_stats(),
+        "history_summarizer": history_summarizer_stats()
+    })
+
+def _format_sources(sources):
+    """Formats each source to include document name and page number."""
+    formatted_sources = []
+    for src in sources:
+        if isinstance(src, str):
+            formatted_sources.append(src)
+            continue
+        doc_name = (src.get("doc") or "").strip() or "Unknown Document"
+        page = src.get("page")
+        page_str = str(page) if page is not None else "N/A"
+        formatted_sources.append(f"Document: {doc_name}, Page: {page_str}")
+    return formatted_sources
+
+def _sse(event, data):
+    """Encodes one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def _sse_response(events):
+    """Streams a generator of SSE strings, with proxy buffering disabled."""
+    response = Response(stream_with_context(events), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
 
 @app.route('/')
 def index():
@@ -58,21 +121,18 @@ def api_search():
     if not query:
         return jsonify({"error": "Query required"}), 400
 
+    if data.get("stream"):
+        return _sse_response(_search_events(query))
+
     try:
-        results = search_engine.nlp_incident_query(query)
-        # Format each source to include document name and page number.
-        formatted_sources = []
-        for src in results.get("sources", []):
-            doc_name = src.get("doc", "").strip() or "Unknown Document"
-            page = src.get("page")
-            page_str = str(page) if page is not None else "N/A"
-            formatted_sources.append(f"Document: {doc_name}, Page: {page_str}")
-            
+        results = get_search_engine().nlp_incident_query(query)
         return jsonify({
             "query": query,
             "answers": results.get("summary", "No summary available."),
-            "sources": formatted_sources,
-            "incidents": results.get("incidents", [])
+            "sources": _format_sources(results.get("sources", [])),
+            "incidents": results.get("incidents", []),
+            "cached": results.get("cached", False),
+            "timings": results.get("timings", {})
         })
     except Exception as e:
         logger.error(f"NLP search failed: {e}")
@@ -83,6 +143,66 @@ def api_search():
             "incidents": []
         }), 500
 
+MAX_BATCH_QUERIES = 1000
+MAX_TOP_N = 50
+MAX_EF_SEARCH = 1024
+
+def _search_events(query):
+    """SSE stream for /api/search: sources, incidents, answer tokens, then the full answer."""
+    try:
+        for event, payload in get_search_engine().nlp_incident_query_stream(query):
+            if event == "sources":
+                payload = _format_sources(payload)
+            elif event == "token":
+                payload = {"text": payload}
+            elif event == "done":
+                payload = {
+                    "query": query,
+                    "answers": payload["summary"],
+                    "cached": payload["cached"],
+                    "timings": payload["timings"]
+                }
+            yield _sse(event, payload)
+    except Exception as e:
+        logger.error(f"Streaming NLP search failed: {e}")
+        yield _sse("error", {"error": "Search failed. Please try again."})
+
+@app.route('/api/search/batch', methods=['POST'])
+def api_search_batch():
+    """Bulk retrieval (no LLM summary) for compliance sweeps: one encode pass and one FAISS search."""
+    data = request.json or {}
+    queries = data.get("queries", [])
+    filter_files = data.get("filter_files", None)
+    try:
+        top_n = int(data.get("top_n", 5))
+        ef_search = int(data["ef_search"]) if data.get("ef_search") else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "top_n and ef_search must be integers"}), 400
+    if top_n < 1 or (ef_search is not None and ef_search < 1):
+        return jsonify({"error": "top_n and ef_search must be positive"}), 400
+    top_n = min(top_n, MAX_TOP_N)
+    if ef_search is not None:
+        ef_search = min(max(ef_search, top_n), MAX_EF_SEARCH)
+
+    if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q for q in queries):
+        return jsonify({"error": "A non-empty list of query strings is required"}), 400
+    if len(queries) > MAX_BATCH_QUERIES:
+        return jsonify({"error": f"At most {MAX_BATCH_QUERIES} queries per batch"}), 400
+
+    try:
+        batch = get_search_engine().search_documents_batch(
+            queries, top_n=top_n, filter_files=filter_files, ef_search=ef_search
+        )
+        return jsonify({
+            "results": [
+                {"query": query, "sources": sources}
+                for query, sources in zip(queries, batch)
+            ]
+        })
+    except Exception as e:
+        logger.error(f"Batch search failed: {e}")
+        return jsonify({"error": "Batch search failed. Please try again."}), 500
+
 from incident_filters import load_incident_data, filter_incidents
 from incident_graphs import (
     generate_material_bar_chart,
@@ -98,10 +218,10 @@ def api_filter_incidents():
     df = load_incident_data()
 
     if "query" in data:
-        # Parse filters from natural language using LLM
+        # Parse filters from natural language: rules first, LLM when they are not confident
         try:
-            parsed = llm_handler.parse_filters(data["query"])
-            logger.info("Parsed filters from query: %s", parsed)
+            parsed, parsed_by = get_filter_parser().parse(data["query"], get_llm_handler())
+            logger.info("Parsed filters from query (%s): %s", parsed_by, parsed)
             # Remove unsupported keys like 'operator'
             parsed.pop("operator", None)
         except Exception as e:
@@ -141,7 +261,9 @@ def api_filter_incidents():
 
     if incident_texts:
         chunks = [{"text": text} for text in incident_texts]
-        ai_summary = llm_handler.generate_summary_from_chunks(data.get("query", ""), chunks)
+        ai_summary = get_llm_handler().generate_summary_from_chunks(
+            data.get("query", ""), chunks, max_context_tokens=context_budget("incident_filter")
+        )
     else:
         ai_summary = "No incident details available for summarization."
 
@@ -195,37 +317,55 @@ def api_chat():
     if not message or not session_id:
         return jsonify({"error": "Message and session_id required"}), 400
 
-    result = chatbot.chat(session_id, message, filter_files=filter_files)
+    if data.get("stream"):
+        return _sse_response(_chat_events(session_id, message, filter_files))
 
-    # Format sources for display, if they exist
-    formatted_sources = []
-    for src in result.get("sources", []):
-        if isinstance(src, str):
-            formatted_sources.append(src)
-        else:
-            doc_name = src.get("doc", "").strip() or "Unknown Document"
-            page = src.get("page")
-            page_str = str(page) if page is not None else "N/A"
-            formatted_sources.append(f"Document: {doc_name}, Page: {page_str}")
+    result = get_chatbot().chat(session_id, message, filter_files=filter_files)
 
     return jsonify({
         "response": result.get("answer", "No response."),
-        "sources": formatted_sources,
+        "sources": _format_sources(result.get("sources", [])),
         "incidents": result.get("incidents", []),
         "referenced_chunks": result.get("referenced_chunks", []),
+        "cached": result.get("cached", False),
+        "timings": result.get("timings", {}),
         "session_id": session_id
     })
 
 
+def _chat_events(session_id, message, filter_files):
+    """SSE stream for /api/chat: sources, incidents, answer tokens, then the full answer."""
+    try:
+        for event, payload in get_chatbot().chat_stream(session_id, message, filter_files=filter_files):
+            if event == "sources":
+                payload = {
+                    "sources": _format_sources(payload["sources"]),
+                    "referenced_chunks": payload["referenced_chunks"]
+                }
+            elif event == "token":
+                payload = {"text": payload}
+            elif event == "done":
+                payload = {
+                    "response": payload["answer"],
+                    "cached": payload["cached"],
+                    "timings": payload["timings"],
+                    "session_id": session_id
+                }
+            yield _sse(event, payload)
+    except Exception as e:
+        logger.error(f"Streaming chat failed: {e}")
+        yield _sse("error", {"error": "Sorry, there was an error. Please try again."})
+
 @app.route('/api/chat/clear', methods=['POST'])
 def clear_chat_memory():
     session_id = session.get("chat_session_id")
-    if chatbot.clear_memory(session_id):
+    if get_chatbot().clear_memory(session_id):
         return jsonify({"message": "Chat history cleared", "session_id": session_id})
     return jsonify({"error": "No active chat session"}), 400
 
 @app.route('/api/chat/upload', methods=['POST'])
 def upload_chat_document():
+    """Saves the file and queues it for background ingestion; poll the returned status_url for progress."""
     session_id = session.get("chat_session_id")
     if not session_id:
         return jsonify({"error": "Session not initialized"}), 400
@@ -234,16 +374,35 @@ def upload_chat_document():
     if not uploaded_file:
         return jsonify({"error": "No file provided"}), 400
 
-    filename = uploaded_file.filename
-    os.makedirs("data/uploads", exist_ok=True)
-    save_path = os.path.join("data/uploads", filename)
+    filename = secure_filename(uploaded_file.filename or "") or "upload"
+    if filename.lower().rsplit(".", 1)[-1] not in UPLOAD_EXTENSIONS:
+        return jsonify({"success": False, "error": f"Unsupported file type: {filename}"}), 400
+    os.makedirs(UPLOADS_FOLDER, exist_ok=True)
+    # Unique on disk so concurrent uploads with the same name never overwrite each other
+    save_path = os.path.join(UPLOADS_FOLDER, f"{uuid.uuid4().hex}_{filename}")
     uploaded_file.save(save_path)
 
-    success = chatbot.process_uploaded_file(session_id, save_path)
-    if success:
-        return jsonify({"success": True, "message": f"{filename} processed and ready for chat."})
-    else:
-        return jsonify({"success": False, "error": f"Could not process {filename}"}), 500
+    try:
+        job = get_upload_ingestor().submit(session_id, save_path, filename)
+    except UploadQueueFull as e:
+        logger.warning(f"Upload of {filename} refused: {e}")
+        os.remove(save_path)
+        return jsonify({"success": False, "error": "Too many uploads are being processed. Please retry shortly."}), 429
+
+    return jsonify({
+        "success": True,
+        "job_id": job["job_id"],
+        "status_url": f"/api/chat/upload/{job['job_id']}",
+        "message": f"{filename} is being processed; its pages become available to chat as they are indexed."
+    }), 202
+
+@app.route('/api/chat/upload/<job_id>', methods=['GET'])
+def chat_upload_status(job_id):
+    job = get_upload_ingestor().get_job(job_id)
+    if job is None or job.get("session_id") != session.get("chat_session_id"):
+        return jsonify({"error": "Unknown upload job"}), 404
+    job.pop("session_id", None)
+    return jsonify(job)
 
 @app.route('/api/risk-assessment', methods=['POST'])
 def api_risk_assessment():
@@ -254,7 +413,7 @@ def api_risk_assessment():
         return jsonify({"error": "Incident details required"}), 400
 
     try:
-        severity, rationale = risk_assessor.assess_severity(incident_description)
+        severity, rationale = get_risk_assessor().assess_severity(incident_description)
         return jsonify({"severity": severity, "rationale": rationale})
     except Exception as e:
         logger.error(f"Risk assessment error: {e}")
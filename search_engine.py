@@ -1,87 +1,390 @@
 import os
+import threading
+import time
 import numpy as np
 import faiss
 import logging
-from sentence_transformers import SentenceTransformer
+from model_registry import get_embedding_model
+from index_store import load_index, index_memory_stats, DEFAULT_INDEX_PATH, DEFAULT_VECTORS_PATH
+from chunk_store import load_chunk_store, DEFAULT_CHUNK_STORE_PATH
+from lexical_index import BM25Index, identifier_share, reciprocal_rank_fusion
 from llm_handler import LLMHandler
 from incident_matcher import find_similar_incidents
+from stage_executor import StagedExecution
+from semantic_cache import get_semantic_cache
+from context_packer import context_budget
+from singleflight import get_singleflight
 
 logger = logging.getLogger(__name__)
 
+MAX_CACHED_SELECTORS = 64
+MAX_FILTERED_EF_SEARCH = 1024
+
+# "dense": embeddings only; "lexical": BM25 only (no encode); "hybrid": both fused with RRF;
+# "auto": lexical fast path for identifier queries ("192.616", "UN1005"), hybrid when identifiers
+# are half the query or less ("192.616 requirements"), dense otherwise.
+SEARCH_MODES = ("auto", "dense", "lexical", "hybrid")
+DEFAULT_SEARCH_MODE = os.getenv("SEARCH_MODE", "auto").lower()
+HYBRID_CANDIDATES = 50  # per-retriever depth fed into reciprocal rank fusion
+# Global HNSW efSearch (recall vs latency); unset keeps the value stored in the index
+DEFAULT_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "0")) or None
+# IVF inverted lists probed per query; unset keeps the value stored in the index
+DEFAULT_NPROBE = int(os.getenv("FAISS_NPROBE", "0")) or None
+# Candidates re-scored exactly from stored vectors (compressed indexes only; 0 disables)
+DEFAULT_RERANK_K = int(os.getenv("FAISS_RERANK_K", "50"))
+# Fallback answers that must not be served from the semantic cache
+FAILED_ANSWERS = frozenset({
+    "LLM client unavailable.",
+    "Failed to generate summary from provided context.",
+    "Unable to generate response at this time.",
+})
+
 class SearchEngine:
-    def __init__(self, embed_model="all-mpnet-base-v2", index_path="faiss_index.bin", mapping_path="doc_mapping.npy"):
+    def __init__(self, embed_model="all-mpnet-base-v2", index_path=DEFAULT_INDEX_PATH, mapping_path="doc_mapping.npy",
+                 llm_handler=None, chunk_store_path=DEFAULT_CHUNK_STORE_PATH, ef_search=DEFAULT_EF_SEARCH,
+                 nprobe=DEFAULT_NPROBE, vectors_path=DEFAULT_VECTORS_PATH, rerank_k=DEFAULT_RERANK_K):
         """
-        Initializes the search engine by loading FAISS index, mappings, and embedding model.
+        Initializes the search engine by loading FAISS index, chunk store, and embedding model.
+
+        :param mapping_path: Legacy pickled doc_mapping, only used if the chunk store is missing.
+        :param llm_handler: Optional shared LLMHandler; a new one is created if omitted.
+        :param chunk_store_path: Columnar chunk metadata written by EmbedDocuments.save_index.
+        :param ef_search: HNSW efSearch for every query of this engine (None keeps the index's value).
+        :param nprobe: IVF lists probed per query (None keeps the index's value).
+        :param vectors_path: Exact vectors saved next to compressed indexes, memory-mapped for re-ranking.
+        :param rerank_k: Number of candidates re-scored exactly when stored vectors exist (0 disables).
         """
-        self.embedder = SentenceTransformer(embed_model)
-        self.llm_handler = LLMHandler()
+        self.embedder = get_embedding_model(embed_model)
+        self.llm_handler = llm_handler or LLMHandler()
+        self.index_path = index_path
+        self.ef_search = ef_search
+        self.nprobe = nprobe
+        self.rerank_k = rerank_k
         self.index = None
-        self.doc_mapping = {}
+        self.chunk_store = None
+        self.vectors = None  # exact float32 vectors (memory-mapped) for re-ranking, if saved
+        self._selectors = {}  # frozenset of document names → (selected vector ids, faiss.IDSelector)
+        self._lexical_index = None
+        self._lexical_lock = threading.Lock()
 
-        if os.path.exists(index_path) and os.path.exists(mapping_path):
+        if os.path.exists(index_path):
             try:
-                self.index = faiss.read_index(index_path)
-                self.doc_mapping = np.load(mapping_path, allow_pickle=True).item()
-                logger.info("FAISS index and doc mapping loaded successfully.")
+                # Read-only and shared per process; memory-mapped unless FAISS_INDEX_MODE=heap
+                self.index = load_index(index_path)
+                self.chunk_store = load_chunk_store(chunk_store_path, legacy_mapping_path=mapping_path)
+                if self.chunk_store is None:
+                    logger.error("Chunk store or doc mapping file not found.")
+                else:
+                    logger.info("FAISS index and chunk store loaded successfully.")
+                if os.path.exists(vectors_path):
+                    vectors = np.load(vectors_path, mmap_mode="r")
+                    if len(vectors) == self.index.ntotal:
+                        self.vectors = vectors
+                        logger.info(f"Exact vectors loaded from {vectors_path} for re-ranking.")
+                    else:
+                        logger.warning(f"Ignoring {vectors_path}: it does not match the index size.")
             except Exception as e:
-                logger.error(f"Failed to load FAISS index or mapping: {e}")
+                logger.error(f"Failed to load FAISS index or chunk store: {e}")
         else:
-            logger.error("FAISS index or mapping file not found.")
+            logger.error("FAISS index file not found.")
+
+    def index_stats(self):
+        """Returns resident vs shared memory for the loaded index (see index_store.index_memory_stats)."""
+        stats = index_memory_stats(self.index_path)
+        stats["ntotal"] = self.index.ntotal if self.index is not None else 0
+        return stats
+
+    @property
+    def lexical_index(self):
+        """BM25 index over the chunk store, built on first use (or during warm-up)."""
+        if self._lexical_index is None and self.chunk_store is not None:
+            with self._lexical_lock:
+                if self._lexical_index is None:
+                    self._lexical_index = BM25Index.from_chunk_store(self.chunk_store)
+        return self._lexical_index
 
-    def search_documents(self, query, top_n=5, filter_files=None):
+    def set_ef_search(self, ef_search):
+        """Sets the engine-wide HNSW efSearch (None restores the index's own value)."""
+        self.ef_search = int(ef_search) if ef_search else None
+
+    def search_documents(self, query, top_n=5, filter_files=None, mode=None, ef_search=None):
         """
-        Searches the FAISS index for the top_n semantically relevant text chunks.
+        Searches the indexed chunks for the top_n relevant text chunks.
 
         :param query: User query
         :param top_n: Number of chunks to retrieve
         :param filter_files: Optional list of document names to filter results from
-        :return: List of dictionaries with keys: "chunk_id", "score", "text", "doc", and "page"
+        :param mode: "auto", "dense", "lexical" or "hybrid" (defaults to SEARCH_MODE)
+        :param ef_search: Optional HNSW efSearch for this request only (overrides the engine setting)
+        :return: List of dictionaries with keys: "chunk_id", "score", "text", "doc", "page" and "retriever".
+                 "score" is the L2 distance for dense hits (lower is better), the BM25 score for
+                 lexical hits and the RRF score for hybrid hits (higher is better).
+                 Callers sharing an in-flight search get the same list, so do not mutate it.
         """
-        if not self.index or not self.doc_mapping:
-            logger.error("Search attempted without a loaded FAISS index or mapping.")
+        # Concurrent identical searches share one in-flight result
+        key = (self.index_path, query, top_n, frozenset(filter_files) if filter_files else None, mode, ef_search)
+        return get_singleflight("search").do(key, self._search_one, query, top_n, filter_files, mode, ef_search)
+
+    def _search_one(self, query, top_n, filter_files, mode, ef_search):
+        return self.search_documents_batch(
+            [query], top_n=top_n, filter_files=filter_files, mode=mode, ef_search=ef_search
+        )[0]
+
+    def search_documents_batch(self, queries, top_n=5, filter_files=None, mode=None, ef_search=None):
+        """
+        Searches for several queries with one encoder pass and one FAISS search per retrieval mode.
+
+        :param queries: List of user queries
+        :param top_n: Number of chunks to retrieve per query
+        :param filter_files: Optional list of document names to filter results from (applies to all queries)
+        :param mode: "auto", "dense", "lexical" or "hybrid" (defaults to SEARCH_MODE)
+        :param ef_search: Optional HNSW efSearch for this request only (overrides the engine setting)
+        :return: One result list per query, each identical to what search_documents returns for it
+        """
+        if not queries:
             return []
+        if not self.index or not self.chunk_store:
+            logger.error("Search attempted without a loaded FAISS index or chunk store.")
+            return [[] for _ in queries]
+
+        mode = (mode or DEFAULT_SEARCH_MODE).lower()
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode}")
 
         try:
-            # Compute the query embedding
-            query_embedding = self.embedder.encode(
-                [query],
-                normalize_embeddings=True,
-                convert_to_numpy=True
-            ).astype(np.float32)
-            # Search the FAISS index (search wider range for filtering)
-            distances, indices = self.index.search(query_embedding, top_n * 3)
-
-            results = []
-            for i, idx in enumerate(indices[0]):
-                if idx not in self.doc_mapping:
-                    continue
+            selected_ids, selector = None, None
+            if filter_files:
+                selected_ids, selector = self._doc_selector(filter_files)
+                if len(selected_ids) == 0:
+                    return [[] for _ in queries]
 
-                entry = self.doc_mapping[idx]
-                # Retrieve the fields from the mapping; default to empty string if missing
-                chunk_id = entry.get("chunk_id", f"chunk_{idx}")
-                chunk_text = entry.get("text", "")
-                doc_name = entry.get("doc", "")  # Document name if provided
-                page = entry.get("page", None)
+            results = [None] * len(queries)
+            dense_rows, hybrid_rows = [], []
+            for row, query in enumerate(queries):
+                route = mode
+                if mode == "auto":
+                    share = identifier_share(query)
+                    route = "lexical" if share > 0.5 else "hybrid" if share > 0 else "dense"
+                if route == "hybrid":
+                    hybrid_rows.append(row)
+                elif route == "lexical":
+                    # Lexical fast path: no transformer encode at all
+                    hits = self.lexical_index.search(query, top_n, allowed_ids=selected_ids)
+                    if hits or mode == "lexical":
+                        results[row] = [self._hit(idx, score, "lexical") for idx, score in hits]
+                    else:
+                        dense_rows.append(row)
+                else:
+                    dense_rows.append(row)
 
-                # If a file filter is provided, skip chunks whose document name is not in the filter list
-                if filter_files and doc_name not in filter_files:
-                    continue
+            if dense_rows or hybrid_rows:
+                # Compute the query embeddings (shared cache across search, incidents and chat)
+                embeddings = self.embedder.encode_queries([queries[row] for row in dense_rows + hybrid_rows])
 
-                results.append({
-                    "chunk_id": chunk_id,
-                    "score": float(distances[0][i]),
-                    "text": chunk_text,
-                    "doc": doc_name,
-                    "page": page
-                })
+                if dense_rows:
+                    distances, indices = self._dense_search(
+                        embeddings[:len(dense_rows)], top_n, selected_ids, selector, ef_search
+                    )
+                    for i, row in enumerate(dense_rows):
+                        results[row] = self._collect_hits(distances[i], indices[i], top_n)
 
-                if len(results) >= top_n:
-                    break
+                if hybrid_rows:
+                    depth = max(top_n, HYBRID_CANDIDATES)
+                    _, indices = self._dense_search(
+                        embeddings[len(dense_rows):], depth, selected_ids, selector, ef_search
+                    )
+                    for i, row in enumerate(hybrid_rows):
+                        dense_ranking = [int(idx) for idx in indices[i] if idx >= 0]
+                        lexical_ranking = [
+                            idx for idx, _ in self.lexical_index.search(queries[row], depth, allowed_ids=selected_ids)
+                        ]
+                        fused = reciprocal_rank_fusion([dense_ranking, lexical_ranking])[:top_n]
+                        results[row] = [self._hit(idx, score, "hybrid") for idx, score in fused]
 
             return results
         except Exception as e:
             logger.error(f"Search failed: {e}")
-            return []
+            return [[] for _ in queries]
+
+    def _dense_search(self, query_embeddings, k, selected_ids=None, selector=None, ef_search=None):
+        """
+        Runs the FAISS search, restricted to the selected vector ids when a document filter is active.
+
+        With stored exact vectors (compressed indexes), max(k, rerank_k) candidates are fetched and
+        re-scored with exact L2 distances before the top k are returned.
+        """
+        rerank = self.vectors is not None and self.rerank_k > 0
+        fetch_k = max(k, self.rerank_k) if rerank else k
+        if rerank and selected_ids is not None:
+            fetch_k = max(k, min(fetch_k, len(selected_ids)))
+
+        if selector is not None:
+            # Most graph neighbours fall outside a narrow filter; widen the walk in proportion
+            selectivity = self.index.ntotal / max(len(selected_ids), 1)
+            base_ef = ef_search or self.ef_search or fetch_k
+            ef_search = min(max(base_ef, int(fetch_k * selectivity)), MAX_FILTERED_EF_SEARCH)
+
+        params = self._search_params(fetch_k, ef_search, selector)
+        if selector is not None:
+            distances, indices = self._filtered_search(query_embeddings, fetch_k, selected_ids, params)
+        else:
+            distances, indices = self.index.search(query_embeddings, fetch_k, params=params)
+
+        if rerank:
+            distances, indices = self._rerank(query_embeddings, indices, k)
+        return distances, indices
+
+    def _rerank(self, query_embeddings, candidates, k):
+        """Re-scores candidate ids with exact squared L2 distances from the stored vectors."""
+        distances = np.full((len(candidates), k), np.inf, dtype=np.float32)
+        indices = np.full((len(candidates), k), -1, dtype=np.int64)
+        for row, ids in enumerate(candidates):
+            ids = np.sort(ids[ids >= 0])
+            if not len(ids):
+                continue
+            diffs = np.asarray(self.vectors[ids], dtype=np.float32) - query_embeddings[row]
+            exact = np.einsum("ij,ij->i", diffs, diffs)
+            order = np.argsort(exact, kind="stable")[:k]
+            distances[row, :len(order)] = exact[order]
+            indices[row, :len(order)] = ids[order]
+        return distances, indices
+
+    def _search_params(self, k, ef_search=None, selector=None):
+        """
+        Builds per-call FAISS search parameters (the shared index itself is never modified).
+
+        :return: SearchParameters, or None when the index defaults apply unchanged.
+        """
+        ef_search = ef_search or self.ef_search
+        index = self.index
+        if isinstance(index, faiss.IndexPreTransform):
+            # OPQ/PCA wrappers: tune the wrapped index, filter at the outer level
+            index = faiss.downcast_index(index.index)
+
+        if hasattr(index, "hnsw"):
+            if ef_search is None and selector is None:
+                return None
+            params = faiss.SearchParametersHNSW()
+            params.efSearch = max(ef_search or index.hnsw.efSearch, k)
+        elif hasattr(index, "nprobe"):
+            if self.nprobe is None and selector is None:
+                return None
+            params = faiss.SearchParametersIVF()
+            params.nprobe = self.nprobe or index.nprobe
+        elif selector is not None:
+            params = faiss.SearchParameters()
+        else:
+            return None
+
+        if selector is not None:
+            params.sel = selector
+        if index is not self.index:
+            # IndexPreTransform hands index_params (and their selector) to the wrapped index
+            outer = faiss.SearchParametersPreTransform()
+            outer.index_params = params
+            outer.inner_params = params  # keep the Python object alive with the wrapper
+            params = outer
+        return params
+
+    def _doc_selector(self, filter_files):
+        """
+        Returns the vector ids belonging to the given documents and a FAISS selector over them.
+
+        Chunks of one document are added contiguously, so a single document becomes an
+        IDSelectorRange; anything else falls back to an IDSelectorBatch of the ids.
+        """
+        key = frozenset(filter_files)
+        cached = self._selectors.get(key)
+        if cached is not None:
+            return cached
+
+        wanted = [i for i, name in enumerate(self.chunk_store.doc_names) if name in key]
+        selected_ids = np.flatnonzero(np.isin(self.chunk_store.doc_ids, wanted)).astype(np.int64)
+        if len(selected_ids) and selected_ids[-1] - selected_ids[0] + 1 == len(selected_ids):
+            selector = faiss.IDSelectorRange(int(selected_ids[0]), int(selected_ids[-1]) + 1)
+        else:
+            selector = faiss.IDSelectorBatch(selected_ids)
+
+        if len(self._selectors) >= MAX_CACHED_SELECTORS:
+            self._selectors.clear()
+        self._selectors[key] = (selected_ids, selector)
+        return selected_ids, selector
+
+    def _filtered_search(self, query_embeddings, top_n, selected_ids, params):
+        """
+        Searches only the selected vector ids and returns exactly min(top_n, len(selected_ids)) hits per query.
+
+        The filter is applied inside the graph search via the selector. Narrow filters can leave the
+        HNSW candidate list short, in which case those queries are answered with an exact scan of
+        the selected vectors.
+        """
+        distances, indices = self.index.search(query_embeddings, top_n, params=params)
+
+        expected = min(top_n, len(selected_ids))
+        short_rows = np.flatnonzero((indices >= 0).sum(axis=1) < expected)
+        if len(short_rows):
+            if self.vectors is not None:
+                vectors = np.asarray(self.vectors[selected_ids], dtype=np.float32)
+            else:
+                vectors = self.index.reconstruct_batch(selected_ids)
+            exact_d, exact_i = faiss.knn(query_embeddings[short_rows], vectors, expected)
+            distances[short_rows, :expected] = exact_d
+            indices[short_rows, :expected] = selected_ids[exact_i]
+        return distances, indices
+
+    def _collect_hits(self, distances, indices, top_n):
+        """Turns one row of FAISS output into result dictionaries."""
+        results = []
+        for i, idx in enumerate(indices):
+            if idx not in self.chunk_store:
+                continue
+
+            results.append(self._hit(idx, distances[i], "dense"))
+
+            if len(results) >= top_n:
+                break
+
+        return results
+
+    def _hit(self, idx, score, retriever):
+        # Strings are only decoded for the hits we return
+        return {
+            "chunk_id": self.chunk_store.chunk_id(idx),
+            "score": float(score),
+            "text": self.chunk_store.text(idx),
+            "doc": self.chunk_store.doc(idx),
+            "page": self.chunk_store.page(idx),
+            "retriever": retriever
+        }
+
+    @staticmethod
+    def _normalize_context(context):
+        """Turns a context string or list of chunks into dicts with 'text', 'page' and 'doc'."""
+        if not isinstance(context, list):
+            context = [context]
+
+        normalized_context = []
+        for c in context:
+            if isinstance(c, str):
+                normalized_context.append({
+                    "text": c,
+                    "page": None,
+                    "doc": None
+                })
+            elif isinstance(c, dict):
+                normalized_context.append({
+                    "text": c.get("text", ""),
+                    "page": c.get("page") or c.get("page_number") or None,
+                    "doc": c.get("doc") or c.get("document") or None
+                })
+            else:
+                logger.warning(f"Unexpected context item type: {type(c)}")
+                normalized_context.append({
+                    "text": str(c),
+                    "page": None,
+                    "doc": None
+                })
+        return normalized_context
 
     def generate_llm_response(self, query, context):
         """
@@ -93,63 +396,43 @@ class SearchEngine:
         :return: LLM-generated response
         """
         try:
-            if not isinstance(context, list):
-                context = [context]
-
-            # Ensure each item has 'text', 'page', and 'doc'
-            normalized_context = []
-            for c in context:
-                if isinstance(c, str):
-                    normalized_context.append({
-                        "text": c,
-                        "page": None,
-                        "doc": None
-                    })
-                elif isinstance(c, dict):
-                    normalized_context.append({
-                        "text": c.get("text", ""),
-                        "page": c.get("page") or c.get("page_number") or None,
-                        "doc": c.get("doc") or c.get("document") or None
-                    })
-                else:
-                    logger.warning(f"Unexpected context item type: {type(c)}")
-                    normalized_context.append({
-                        "text": str(c),
-                        "page": None,
-                        "doc": None
-                    })
-
-            return self.llm_handler.generate_summary_from_chunks(query, normalized_context)
-
+            return self.llm_handler.generate_summary_from_chunks(
+                query, self._normalize_context(context), max_context_tokens=context_budget("search")
+            )
         except Exception as e:
             logger.error(f"LLM generation error: {e}")
             return "Unable to generate response at this time."
 
-            if not isinstance(context, list):
-                context = [context]
-
-            # Ensure each item is a dict with 'text' and 'page'
-            #print(context)
-            normalized_context = []
-            for c in context:
-                if isinstance(c, str):
-                    normalized_context.append({"text": c, "page": None})
-                elif isinstance(c, dict):
-                    normalized_context.append({
-                        "text": c.get("text", ""),
-                        "page": c.get("page") or c.get("page_number") or None
-                    })
-                else:
-                    logger.warning(f"Unexpected context item type: {type(c)}")
-                    normalized_context.append({"text": str(c), "page": None})
+    def stream_llm_response(self, query, context):
+        """
+        Streaming variant of generate_llm_response.
 
-            return self.llm_handler.generate_summary_from_chunks(query, normalized_context)
+        :return: Generator of text fragments; raises if the LLM call fails, even mid-stream.
+        """
+        yield from self.llm_handler.stream_summary_from_chunks(
+            query, self._normalize_context(context), max_context_tokens=context_budget("search")
+        )
 
-        except Exception as e:
-            logger.error(f"LLM generation error: {e}")
-            return "Unable to generate response at this time."
+    def _semantic_lookup(self, query, sources):
+        """
+        Looks for a cached answer to a near-duplicate question with the same retrieved chunks.
 
+        :return: (cache key, cached answer or None); the key is None when the cache is off.
+        """
+        cache = get_semantic_cache("search")
+        if cache is None:
+            return None, None
+        # Usually an embedding cache hit: retrieval just encoded the same query
+        query_vector = self.embedder.encode_queries([query])[0]
+        chunk_ids = [s.get("chunk_id") for s in sources]
+        return (cache, query, query_vector, chunk_ids), cache.lookup(query_vector, chunk_ids)
 
+    @staticmethod
+    def _semantic_store(key, answer, llm_ms):
+        if key is None or answer in FAILED_ANSWERS:
+            return
+        cache, query, query_vector, chunk_ids = key
+        cache.store(query, query_vector, chunk_ids, answer, llm_ms=llm_ms)
 
     def nlp_incident_query(self, query, top_n=5):
         """
@@ -160,9 +443,14 @@ class SearchEngine:
             - "summary": LLM-generated summary,
             - "sources": List of retrieved chunk metadata,
             - "incidents": List of matched incidents (from incident_matcher)
+            - "cached": True if the summary came from the semantic answer cache
+            - "timings": Per-stage wall time in milliseconds (retrieval, llm, incidents, total)
         """
-        sources = self.search_documents(query, top_n=top_n)
-        
+        stages = StagedExecution()
+        # Incident matching does not depend on retrieval or the LLM, so it runs alongside them
+        stages.submit("incidents", find_similar_incidents, query)
+        sources = stages.run("retrieval", self.search_documents, query, top_n=top_n)
+
         # Wrap each chunk with doc and page for generate_llm_response
         context = [
             {
@@ -174,12 +462,70 @@ class SearchEngine:
             for s in sources
         ]
         
-        summary = self.generate_llm_response(query, context)
-        incidents = find_similar_incidents(query)
+        cache_key, summary = stages.run("semantic_cache", self._semantic_lookup, query, sources)
+        cached = summary is not None
+        if not cached:
+            summary = stages.run("llm", self.generate_llm_response, query, context)
+            self._semantic_store(cache_key, summary, stages.timings["llm"])
+        incidents = stages.result("incidents", default=[])
 
         return {
             "summary": summary,
             "sources": sources,
-            "incidents": incidents
+            "incidents": incidents,
+            "cached": cached,
+            "timings": stages.timings
         }
 
+    def nlp_incident_query_stream(self, query, top_n=5):
+        """
+        Streaming variant of nlp_incident_query.
+
+        Sources are sent as soon as retrieval finishes and incidents as soon as matching
+        finishes, even while the LLM is still working on its next token.
+
+        :param query: User natural language query
+        :return: Generator of (event, data) pairs:
+            - ("sources", list of retrieved chunk metadata)
+            - ("incidents", list of matched incidents)
+            - ("token", text fragment), repeated
+            - ("done", {"summary": full LLM answer, "cached": bool, "timings": per-stage milliseconds})
+        """
+        stages = StagedExecution()
+        stages.submit("incidents", find_similar_incidents, query)
+        sources = stages.run("retrieval", self.search_documents, query, top_n=top_n)
+        yield "sources", sources
+
+        cache_key, cached_summary = stages.run("semantic_cache", self._semantic_lookup, query, sources)
+        tokens = [cached_summary] if cached_summary is not None else self.stream_llm_response(query, sources)
+
+        incidents_sent = False
+        completed = False
+        parts = []
+        llm_start = time.perf_counter()
+        try:
+            for event, payload in stages.interleave(tokens, "incidents", default=[]):
+                if event == "incidents":
+                    incidents_sent = True
+                    yield event, payload
+                    continue
+                if not parts:
+                    stages.timings["llm_first_token"] = round((time.perf_counter() - llm_start) * 1000, 2)
+                parts.append(payload)
+                yield "token", payload
+            completed = True
+        except Exception as e:
+            logger.error(f"LLM streaming error: {e}")
+            parts = ["Unable to generate response at this time."]
+            yield "token", parts[0]
+        summary = "".join(parts)
+        if cached_summary is None:
+            stages.timings["llm"] = round((time.perf_counter() - llm_start) * 1000, 2)
+            # A stream cut short by an error is never a reusable answer
+            if completed:
+                self._semantic_store(cache_key, summary, stages.timings["llm"])
+
+        if not incidents_sent:
+            yield "incidents", stages.result("incidents", default=[])
+        yield "done", {"summary": summary, "cached": cached_summary is not None, "timings": stages.timings}
+
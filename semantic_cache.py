@@ -0,0 +1,137 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+import faiss
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "on").lower() not in ("0", "false", "off")
+# Cosine similarity a new question needs with a cached one to reuse its answer
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1024"))
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", "3600"))  # seconds
+SEMANTIC_CACHE_CANDIDATES = 4  # nearest cached questions checked for a chunk-set match
+
+
+class SemanticCache:
+    """
+    Answer cache for near-duplicate questions ("ammonia leak PPE" vs "what PPE for an NH3 release").
+
+    Normalized query embeddings live in a FAISS IndexIDMap2(IndexFlatIP), so inner
+    product is cosine similarity. A cached answer is reused only when the question is
+    similar enough AND retrieval returned exactly the same chunks, so the answer is
+    grounded in the same context it would be generated from.
+    """
+
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, max_entries=SEMANTIC_CACHE_SIZE, ttl=SEMANTIC_CACHE_TTL):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.index = None  # created on the first insert, once the dimension is known
+        self._entries = OrderedDict()  # id → (expires_at, chunk set, answer, llm_ms, query); insertion order
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.llm_ms_saved = 0.0
+
+    def _remove(self, ids):
+        for i in ids:
+            self._entries.pop(i, None)
+        self.index.remove_ids(np.asarray(ids, dtype=np.int64))
+
+    def lookup(self, query_vector, chunk_ids):
+        """
+        :param query_vector: Normalized query embedding, shape (d,) or (1, d).
+        :param chunk_ids: Chunk ids retrieval returned for this question.
+        :return: The cached answer, or None.
+        """
+        query_vector = np.asarray(query_vector, dtype=np.float32).reshape(1, -1)
+        chunk_set = frozenset(chunk_ids)
+        now = time.monotonic()
+        with self._lock:
+            self.lookups += 1
+            if self.index is None or self.index.ntotal == 0:
+                return None
+            scores, ids = self.index.search(query_vector, min(SEMANTIC_CACHE_CANDIDATES, self.index.ntotal))
+            expired = []
+            answer = None
+            for score, i in zip(scores[0], ids[0]):
+                entry = self._entries.get(int(i))
+                if i < 0 or score < self.threshold or entry is None:
+                    continue
+                if entry[0] <= now:
+                    expired.append(int(i))
+                    continue
+                if entry[1] == chunk_set:
+                    answer = entry[2]
+                    self.hits += 1
+                    self.llm_ms_saved += entry[3]
+                    break
+            if expired:
+                self._remove(expired)
+            return answer
+
+    def store(self, query, query_vector, chunk_ids, answer, llm_ms=0.0):
+        """Caches an answer generated from the given chunks; llm_ms is what a later hit saves."""
+        if self.max_entries <= 0 or not answer:
+            return
+        query_vector = np.asarray(query_vector, dtype=np.float32).reshape(1, -1)
+        with self._lock:
+            if self.index is None:
+                self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(query_vector.shape[1]))
+            entry_id = self._next_id
+            self._next_id += 1
+            self.index.add_with_ids(query_vector, np.asarray([entry_id], dtype=np.int64))
+            self._entries[entry_id] = (time.monotonic() + self.ttl, frozenset(chunk_ids), answer, llm_ms, query)
+            if len(self._entries) > self.max_entries:
+                # Oldest entries first; one batched remove_ids keeps the flat index compact
+                overflow = len(self._entries) - self.max_entries
+                self._remove(list(self._entries)[:max(overflow, self.max_entries // 10)])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self.index is not None:
+                self.index.reset()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "threshold": self.threshold,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+                "llm_calls_saved": self.hits,
+                "llm_latency_saved_ms": round(self.llm_ms_saved, 2),
+            }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_semantic_cache(namespace):
+    """
+    Returns the process-wide semantic cache for one kind of answer ("search", "chat").
+
+    Answers from different prompts must not be mixed, so each caller uses its own namespace.
+    Returns None when SEMANTIC_CACHE=off.
+    """
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    with _caches_lock:
+        cache = _caches.get(namespace)
+        if cache is None:
+            cache = _caches[namespace] = SemanticCache()
+        return cache
+
+
+def semantic_cache_stats():
+    with _caches_lock:
+        caches = dict(_caches)
+    return {namespace: cache.stats() for namespace, cache in caches.items()}
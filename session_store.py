@@ -0,0 +1,303 @@
+import os
+import time
+import heapq
+import logging
+import threading
+from collections import OrderedDict
+from upload_index import UploadIndex
+
+logger = logging.getLogger(__name__)
+
+# "sqlite": shared by every worker on the node (persistent_sessions.py); "memory": this worker only
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite").lower()
+SESSION_TTL = int(os.getenv("SESSION_TTL", "3600"))  # seconds since last use
+# Byte budget for all sessions of this worker; least recently used sessions are evicted past it
+SESSION_STORE_MAX_BYTES = int(os.getenv("SESSION_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Per-session quotas
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(32 * 1024 * 1024)))
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", "50"))
+SESSION_MAX_UPLOAD_CHUNKS = int(os.getenv("SESSION_MAX_UPLOAD_CHUNKS", "5000"))
+MESSAGE_OVERHEAD_BYTES = 64  # dict and string headers per stored message
+MAX_UPLOAD_JOBS = 1024  # most recent upload job statuses kept by the in-memory store
+
+
+class SessionQuotaExceeded(Exception):
+    pass
+
+
+class UploadCancelled(Exception):
+    """The upload job was removed, with its session, while it was running."""
+    pass
+
+
+def _message_bytes(message):
+    return len(message.get("content") or "") + MESSAGE_OVERHEAD_BYTES
+
+
+class _Session:
+    __slots__ = ("messages", "first_seq", "summary", "uploads", "message_bytes", "last_access")
+
+    def __init__(self, now):
+        self.messages = []
+        self.first_seq = 0  # sequence number of messages[0]; numbers grow by one per stored message
+        self.summary = ""  # running summary of messages folded out of the history
+        self.uploads = None  # UploadIndex, created on the first upload
+        self.message_bytes = 0
+        self.last_access = now
+
+    @property
+    def nbytes(self):
+        return self.message_bytes + len(self.summary) + (self.uploads.nbytes if self.uploads is not None else 0)
+
+
+class SessionStore:
+    """
+    Chat memory and uploaded chunks of every session, under a global byte budget.
+
+    Sessions are kept in an OrderedDict in last-access order. That order is both the
+    LRU order and, since every session has the same TTL, the expiry order: expired
+    sessions are popped from the front in O(1) each, instead of scanning every session
+    on every request. Over the byte budget, least recently used sessions are evicted.
+    """
+
+    def __init__(self, max_bytes=SESSION_STORE_MAX_BYTES, ttl=SESSION_TTL, session_max_bytes=SESSION_MAX_BYTES,
+                 max_messages=SESSION_MAX_MESSAGES, max_upload_chunks=SESSION_MAX_UPLOAD_CHUNKS):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.session_max_bytes = session_max_bytes
+        self.max_messages = max_messages
+        self.max_upload_chunks = max_upload_chunks
+        self._sessions = OrderedDict()  # session_id → _Session, least recently used first
+        self._bytes = 0
+        self._jobs = OrderedDict()  # job_id → upload job status, oldest first
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+        self.rejected_uploads = 0
+
+    def _expire(self, now):
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_access <= self.ttl:
+                break
+            self._drop(session_id)
+            self.expirations += 1
+
+    def _drop(self, session_id):
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._bytes -= session.nbytes
+        # Running jobs of the session see their job gone and stop
+        for job_id in [j for j, job in self._jobs.items() if job["session_id"] == session_id]:
+            del self._jobs[job_id]
+        return session
+
+    def _evict_to_budget(self, keep):
+        while self._bytes > self.max_bytes and len(self._sessions) > 1:
+            session_id = next(iter(self._sessions))
+            if session_id == keep:
+                self._sessions.move_to_end(keep)
+                session_id = next(iter(self._sessions))
+            self._drop(session_id)
+            self.evictions += 1
+            logger.info(f"Evicted chat session {session_id} to stay within the {self.max_bytes} byte budget.")
+
+    def _touch(self, session_id, create=False):
+        now = time.monotonic()
+        self._expire(now)
+        session = self._sessions.get(session_id)
+        if session is None:
+            if not create:
+                return None
+            session = self._sessions[session_id] = _Session(now)
+        else:
+            self._sessions.move_to_end(session_id)
+            session.last_access = now
+        return session
+
+    def get_messages(self, session_id):
+        """:return: Copy of the session's stored messages, oldest first."""
+        with self._lock:
+            session = self._touch(session_id)
+            return list(session.messages) if session is not None else []
+
+    def append_messages(self, session_id, *messages):
+        """Stores messages, keeping at most max_messages per session."""
+        with self._lock:
+            session = self._touch(session_id, create=True)
+            before = session.nbytes
+            session.messages.extend(messages)
+            session.message_bytes += sum(_message_bytes(m) for m in messages)
+            self._drop_messages(session, len(session.messages) - self.max_messages)
+            self._bytes += session.nbytes - before
+            self._evict_to_budget(keep=session_id)
+
+    @staticmethod
+    def _drop_messages(session, count):
+        if count > 0:
+            session.message_bytes -= sum(_message_bytes(m) for m in session.messages[:count])
+            del session.messages[:count]
+            session.first_seq += count
+
+    def get_messages_with_seq(self, session_id):
+        """:return: List of (sequence number, message), oldest first."""
+        with self._lock:
+            session = self._touch(session_id)
+            if session is None:
+                return []
+            return [(session.first_seq + i, m) for i, m in enumerate(session.messages)]
+
+    def get_summary(self, session_id):
+        """:return: The running summary of the session's folded messages ("" if none)."""
+        with self._lock:
+            session = self._touch(session_id)
+            return session.summary if session is not None else ""
+
+    def fold_messages(self, session_id, summary, through_seq):
+        """Replaces the running summary and drops the messages up to through_seq it now covers."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return
+            before = session.nbytes
+            session.summary = summary
+            self._drop_messages(session, through_seq - session.first_seq + 1)
+            self._bytes += session.nbytes - before
+
+    def get_uploads(self, session_id):
+        """:return: The session's UploadIndex, or None if it has no uploads."""
+        with self._lock:
+            session = self._touch(session_id)
+            return session.uploads if session is not None else None
+
+    def add_upload(self, session_id, chunks, vectors, job_id=None):
+        """
+        Adds embedded upload chunks to the session's UploadIndex.
+
+        :param job_id: Upload job the chunks belong to; they are only added while the job exists.
+        :raises SessionQuotaExceeded: if the chunks would exceed the session's chunk or byte quota.
+        :raises UploadCancelled: if the job was removed (the session was cleared, evicted or expired).
+        """
+        added_bytes = vectors.nbytes + sum(len(c["text"]) for c in chunks)
+        with self._lock:
+            if job_id is not None and job_id not in self._jobs:
+                raise UploadCancelled(f"upload job {job_id} no longer exists")
+            session = self._touch(session_id, create=True)
+            chunk_count = len(session.uploads) if session.uploads is not None else 0
+            if chunk_count + len(chunks) > self.max_upload_chunks:
+                self.rejected_uploads += 1
+                raise SessionQuotaExceeded(
+                    f"{chunk_count + len(chunks)} uploaded chunks exceed the {self.max_upload_chunks} chunk quota"
+                )
+            if session.nbytes + added_bytes > self.session_max_bytes:
+                self.rejected_uploads += 1
+                raise SessionQuotaExceeded(
+                    f"{session.nbytes + added_bytes} bytes exceed the {self.session_max_bytes} byte session quota"
+                )
+            before = session.nbytes
+            if session.uploads is None:
+                session.uploads = UploadIndex()
+            session.uploads.add(chunks, vectors)
+            self._bytes += session.nbytes - before
+            self._evict_to_budget(keep=session_id)
+
+    def clear(self, session_id):
+        with self._lock:
+            return self._drop(session_id) is not None
+
+    def put_job(self, job, create=True):
+        """
+        Saves an upload job status dictionary (keyed by its "job_id").
+
+        :param create: False only updates a job that still exists.
+        :return: False if create is False and the job no longer exists.
+        """
+        with self._lock:
+            if not create and job["job_id"] not in self._jobs:
+                return False
+            self._jobs[job["job_id"]] = dict(job)
+            self._jobs.move_to_end(job["job_id"])
+            while len(self._jobs) > MAX_UPLOAD_JOBS:
+                self._jobs.popitem(last=False)
+            return True
+
+    def get_job(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def session_stats(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            return self._describe(session_id, session, time.monotonic())
+
+    @staticmethod
+    def _describe(session_id, session, now):
+        return {
+            "session_id": session_id,
+            "bytes": session.nbytes,
+            "messages": len(session.messages),
+            "upload_chunks": len(session.uploads) if session.uploads is not None else 0,
+            "idle_seconds": round(now - session.last_access, 1),
+        }
+
+    def stats(self, largest=10):
+        """Totals plus the largest sessions by memory."""
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            top = heapq.nlargest(largest, self._sessions.items(), key=lambda item: item[1].nbytes)
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "utilization": round(self._bytes / self.max_bytes, 4) if self.max_bytes else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "rejected_uploads": self.rejected_uploads,
+                "largest_sessions": [self._describe(s, session, now) for s, session in top],
+            }
+
+
+def _build_session_store():
+    backend = SESSION_BACKEND
+    if backend == "memory":
+        return SessionStore()
+    if backend != "sqlite":
+        logger.error(f"Unknown SESSION_BACKEND '{backend}'; expected sqlite or memory.")
+        return SessionStore()
+
+    from persistent_sessions import SQLiteSessionStore, DEFAULT_SESSION_DB_PATH
+    path = os.getenv("SESSION_DB_PATH", DEFAULT_SESSION_DB_PATH)
+    try:
+        return SQLiteSessionStore(path)
+    except Exception as e:
+        logger.error(f"Could not open session database {path}; sessions stay in this worker's memory: {e}")
+        return SessionStore()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """
+    Returns the process-wide session store selected by SESSION_BACKEND.
+
+    Backends share one interface: get_messages, get_messages_with_seq, append_messages,
+    get_summary, fold_messages, get_uploads, add_upload, clear, put_job, get_job,
+    session_stats and stats.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = _build_session_store()
+    return _store
+
+
+def session_store_stats():
+    return _store.stats() if _store is not None else None
@@ -0,0 +1,152 @@
+import logging
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: the first caller for a key runs the function,
+    callers arriving while it is in flight wait for and share its result (or exception).
+
+    Nothing is cached after the call finishes; the next call for the key runs again.
+    Shared results are the same objects for every waiter, so callers must not mutate them.
+
+    stream() does the same for generators: one producer, every caller replays its output.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}  # key → Future of the in-flight call
+        self._streams = {}  # key → _Broadcast of the in-flight stream
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.executed = 0
+        self.deduplicated = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            self.calls += 1
+            future = self._calls.get(key)
+            if future is not None:
+                self.deduplicated += 1
+                leader = False
+            else:
+                future = self._calls[key] = Future()
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def stream(self, key, fn, *args, **kwargs):
+        """
+        Streaming variant of do(): fn returns an iterable of items (e.g. LLM text fragments).
+
+        The first caller for a key starts a producer thread that consumes fn's iterable
+        once into a shared buffer. Every caller, the first included, gets a generator that
+        replays the buffered items and then follows the live tail; a caller that stops
+        reading does not stop the producer, so the others still get the whole stream.
+        An exception raised by fn is raised in every caller after the items before it.
+        """
+        with self._lock:
+            self.calls += 1
+            broadcast = self._streams.get(key)
+            if broadcast is not None:
+                self.deduplicated += 1
+            else:
+                broadcast = self._streams[key] = _Broadcast()
+                self.executed += 1
+                threading.Thread(
+                    target=self._produce, args=(key, broadcast, fn, args, kwargs),
+                    name=f"singleflight-{self.name}", daemon=True
+                ).start()
+        return broadcast.replay()
+
+    def _produce(self, key, broadcast, fn, args, kwargs):
+        try:
+            for item in fn(*args, **kwargs):
+                broadcast.publish(item)
+            broadcast.finish()
+        except BaseException as e:
+            broadcast.finish(e)
+        finally:
+            with self._lock:
+                self._streams.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "executed": self.executed,
+                "deduplicated": self.deduplicated,
+                "in_flight": len(self._calls) + len(self._streams),
+                "dedup_rate": round(self.deduplicated / self.calls, 4) if self.calls else 0.0,
+            }
+
+
+class _Broadcast:
+    """Items of one in-flight stream, appended by the producer and replayed by any number of readers."""
+
+    def __init__(self):
+        self.items = []
+        self.finished = False
+        self.error = None
+        self._cond = threading.Condition()
+
+    def publish(self, item):
+        with self._cond:
+            self.items.append(item)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.finished = True
+            self.error = error
+            self._cond.notify_all()
+
+    def replay(self):
+        sent = 0
+        while True:
+            with self._cond:
+                while sent == len(self.items) and not self.finished:
+                    self._cond.wait()
+                batch = self.items[sent:]
+                finished, error = self.finished, self.error
+            sent += len(batch)
+            yield from batch
+            if finished:
+                if error is not None:
+                    raise error
+                return
+
+
+_groups = {}
+_groups_lock = threading.Lock()
+
+
+def get_singleflight(name):
+    """Returns the process-wide SingleFlight group for one kind of call ("llm", "search", ...)."""
+    with _groups_lock:
+        group = _groups.get(name)
+        if group is None:
+            group = _groups[name] = SingleFlight(name)
+        return group
+
+
+def singleflight_stats():
+    with _groups_lock:
+        groups = dict(_groups)
+    return {name: group.stats() for name, group in groups.items()}
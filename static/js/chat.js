@@ -49,6 +49,10 @@ document.addEventListener("DOMContentLoaded", function () {
             formData.append("file", file);
             formData.append("session_id", sessionId);
 
+            const buttonLabel = uploadButton.innerHTML;
+            uploadButton.disabled = true;
+            uploadButton.textContent = "Uploading...";
+
             fetch("/api/chat/upload", {
                 method: "POST",
                 body: formData
@@ -56,18 +60,49 @@ document.addEventListener("DOMContentLoaded", function () {
                 .then(res => res.json())
                 .then(data => {
                     if (data.success) {
-                        alert("File uploaded and embedded successfully!");
+                        pollUploadStatus(data.status_url, buttonLabel);
                     } else {
+                        resetUploadButton(buttonLabel);
                         alert("Upload failed: " + (data.error || "Unknown error"));
                     }
                 })
                 .catch(err => {
                     console.error("Upload error:", err);
+                    resetUploadButton(buttonLabel);
                     alert("Error uploading file.");
                 });
         });
     }
 
+    function resetUploadButton(label) {
+        uploadButton.disabled = false;
+        uploadButton.innerHTML = label;
+    }
+
+    // Uploads are ingested in the background; pages can be used in chat as soon as they are indexed
+    function pollUploadStatus(statusUrl, buttonLabel) {
+        fetch(statusUrl)
+            .then(res => res.json())
+            .then(job => {
+                if (job.status === "done") {
+                    resetUploadButton(buttonLabel);
+                    alert(`${job.file} processed: ${job.chunks_embedded} passages ready for chat.`);
+                } else if (job.status === "failed" || job.error) {
+                    resetUploadButton(buttonLabel);
+                    alert("Upload failed: " + (job.error || "Unknown error"));
+                } else {
+                    const pages = job.pages_total ? ` ${job.pages_parsed}/${job.pages_total} pages` : "";
+                    uploadButton.textContent = job.status === "queued" ? "Queued..." : `Indexing${pages}...`;
+                    setTimeout(() => pollUploadStatus(statusUrl, buttonLabel), 1000);
+                }
+            })
+            .catch(err => {
+                console.error("Upload status error:", err);
+                resetUploadButton(buttonLabel);
+                alert("Error checking upload status.");
+            });
+    }
+
     function scrollToBottom() {
         chatMessages.scrollTop = chatMessages.scrollHeight;
     }
@@ -92,6 +127,7 @@ document.addEventListener("DOMContentLoaded", function () {
         messageElement.appendChild(messageTime);
         chatMessages.appendChild(messageElement);
         scrollToBottom();
+        return messageContent;
     }
 
     function formatTime(date) {
@@ -110,54 +146,58 @@ document.addEventListener("DOMContentLoaded", function () {
         }
         scrollToBottom();
 
-        fetch("/api/chat", {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({
-                message,
-                session_id: sessionId,
-                filter_files: selectedDocs
-            })
-        })
-            .then(response => {
-                if (!response.ok) throw new Error("Request failed.");
-                return response.json();
-            })
-            .then(data => {
-                if (loadingIndicator) {
-                    loadingIndicator.style.display = "none";
+        // Sources and incidents arrive first, then answer tokens, then the full answer
+        let answerElement = null;
+        let answerText = "";
+
+        function hideLoading() {
+            if (loadingIndicator) {
+                loadingIndicator.style.display = "none";
+            }
+        }
+
+        postEventStream("/api/chat", {
+            message,
+            session_id: sessionId,
+            filter_files: selectedDocs
+        }, {
+            sources: data => {
+                allReferencedChunks = data.referenced_chunks || [];
+                renderReferencedChunks();
+            },
+            incidents: incidents => {
+                allIncidents = incidents || [];
+                currentPage = 1;
+                renderIncidents();
+            },
+            token: data => {
+                hideLoading();
+                answerText += data.text;
+                if (!answerElement) {
+                    answerElement = addMessage("", false, true);
                 }
-                console.log(data);
-                const respData = data.response;
                 // Use marked.parse to convert Markdown to HTML
-                if (typeof respData === "string") {
-                    const htmlAnswer = marked.parse(respData);
-                    addMessage(htmlAnswer, false, true);
+                answerElement.innerHTML = marked.parse(answerText);
+                scrollToBottom();
+            },
+            done: data => {
+                hideLoading();
+                console.log(data);
+                const answer = data.response || "No answer found.";
+                if (answerElement) {
+                    answerElement.innerHTML = marked.parse(answer);
                 } else {
-                    const answer = respData.answer || "No answer found.";
-                    const renderedHTML = marked.parse(answer);
-                    addMessage(renderedHTML, false, true);
+                    addMessage(marked.parse(answer), false, true);
                 }
-        
-                allIncidents = data.incidents || [];
-                currentPage = 1;
-                renderIncidents();
-        
-                // Process referenced chunks: assume data.referenced_chunks is an array of objects
-                // with keys: chunk_id, text, doc, and page.
-                allReferencedChunks = data.referenced_chunks || [];
-                renderReferencedChunks();
-        
-                generateContextualSuggestions(
-                    message,
-                    typeof respData === "string" ? respData : respData.answer || ""
-                );
-            })
+                generateContextualSuggestions(message, answer);
+            },
+            error: data => {
+                throw new Error(data.error);
+            }
+        })
             .catch(error => {
                 console.error("Chat error:", error);
-                if (loadingIndicator) {
-                    loadingIndicator.style.display = "none";
-                }
+                hideLoading();
                 addMessage("Sorry, there was an error. Please try again.");
             });
     }
@@ -117,28 +117,33 @@ document.addEventListener("DOMContentLoaded", function () {
                 currentFilters = data.filters || { query };
                 await loadChart(currentFilters);
             } else {
-                const res = await fetch("/api/search", {
-                    method: "POST",
-                    headers: { "Content-Type": "application/json" },
-                    body: JSON.stringify({ query })
+                // Incidents are shown as soon as they arrive; the answer fills in token by token
+                let streamedAnswer = "";
+                data = {};
+                await postEventStream("/api/search", { query }, {
+                    incidents: incidents => {
+                        if (incidents && incidents.length > 0) {
+                            incidents.forEach((incident) => {
+                                resultDocuments.appendChild(createResultCard(incident));
+                            });
+                        } else {
+                            resultDocuments.innerHTML = '<div class="alert alert-info">No matching incidents or documents found.</div>';
+                        }
+                        searchResults.style.display = "block";
+                    },
+                    token: token => {
+                        streamedAnswer += token.text;
+                        aiText.innerText = streamedAnswer;
+                    },
+                    done: result => {
+                        data = result;
+                        aiText.innerText = (data.answers && !data.answers.includes("Unable to generate response"))
+                            ? data.answers : "No answer found.";
+                    },
+                    error: result => {
+                        throw new Error(result.error);
+                    }
                 });
-                data = await res.json();
-
-                aiText.innerText = (data.answers && !data.answers.includes("Unable to generate response"))
-                    ? data.answers : "No answer found.";
-
-                let foundResults = false;
-
-                if (data.incidents && data.incidents.length > 0) {
-                    data.incidents.forEach((incident) => {
-                        resultDocuments.appendChild(createResultCard(incident));
-                    });
-                    foundResults = true;
-                }
-
-                if (!foundResults) {
-                    resultDocuments.innerHTML = '<div class="alert alert-info">No matching incidents or documents found.</div>';
-                }
 
                 currentFilters = { query };
                 await loadChart(currentFilters);
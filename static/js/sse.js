@@ -0,0 +1,37 @@
+// Reads a Server-Sent Events response from a POST request (EventSource only supports GET).
+// handlers maps event names ("sources", "incidents", "token", "done", "error") to callbacks
+// receiving the parsed JSON data.
+
+async function postEventStream(url, body, handlers) {
+    const response = await fetch(url, {
+        method: "POST",
+        headers: { "Content-Type": "application/json", "Accept": "text/event-stream" },
+        body: JSON.stringify({ ...body, stream: true })
+    });
+    if (!response.ok || !response.body) throw new Error("Request failed.");
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let eventName = "message";
+            const dataLines = [];
+            rawEvent.split("\n").forEach(line => {
+                if (line.startsWith("event:")) eventName = line.slice(6).trim();
+                else if (line.startsWith("data:")) dataLines.push(line.slice(5).trim());
+            });
+            if (!dataLines.length || !handlers[eventName]) continue;
+            handlers[eventName](JSON.parse(dataLines.join("\n")));
+        }
+    }
+}
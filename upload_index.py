@@ -0,0 +1,58 @@
+import logging
+import threading
+import numpy as np
+import faiss
+
+logger = logging.getLogger(__name__)
+
+
+class UploadIndex:
+    """
+    Vector store for the documents one chat session uploaded.
+
+    Chunks are embedded once when the file is uploaded; chat turns only encode the
+    question and search this index. Each session has its own index, so uploads never
+    leak into other sessions or grow a shared index. Uploads are small, so an exact
+    IndexFlatIP over normalized vectors (cosine similarity) is used.
+    """
+
+    def __init__(self):
+        self.index = None  # created on the first add, once the dimension is known
+        self.chunks = []  # row → {"chunk_id", "text", "doc", "page"}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.chunks)
+
+    @property
+    def nbytes(self):
+        """Approximate memory held: vectors plus chunk text."""
+        vectors = self.index.ntotal * self.index.d * 4 if self.index is not None else 0
+        return vectors + sum(len(c["text"]) for c in self.chunks)
+
+    def add(self, chunks, vectors):
+        """
+        :param chunks: Chunk dictionaries with "chunk_id", "text", "doc" and "page".
+        :param vectors: Normalized float32 embeddings, one row per chunk.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self.index is None:
+                self.index = faiss.IndexFlatIP(vectors.shape[1])
+            self.index.add(vectors)
+            self.chunks.extend(chunks)
+
+    def search(self, query_vector, top_k=3):
+        """
+        :param query_vector: Normalized query embedding, shape (d,) or (1, d).
+        :return: Up to top_k chunk dictionaries, best first, each with a "score".
+        """
+        query_vector = np.asarray(query_vector, dtype=np.float32).reshape(1, -1)
+        with self._lock:
+            if self.index is None or self.index.ntotal == 0:
+                return []
+            scores, rows = self.index.search(query_vector, min(top_k, self.index.ntotal))
+            return [
+                {**self.chunks[row], "score": float(score)}
+                for score, row in zip(scores[0], rows[0]) if row >= 0
+            ]
@@ -0,0 +1,266 @@
+import os
+import time
+import uuid
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from session_store import UploadCancelled
+
+logger = logging.getLogger(__name__)
+
+UPLOADS_FOLDER = "data/uploads"
+UPLOAD_EXTENSIONS = ("pdf", "docx", "txt")
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "2"))  # files ingested at once per worker process
+UPLOAD_QUEUE_MAX = int(os.getenv("UPLOAD_QUEUE_MAX", "16"))  # queued + running jobs before uploads are refused
+UPLOAD_PARSE_PROCESSES = int(os.getenv("UPLOAD_PARSE_PROCESSES", "2"))  # 0 parses PDFs in the job thread
+UPLOAD_PAGE_BATCH = int(os.getenv("UPLOAD_PAGE_BATCH", "16"))  # PDF pages parsed, chunked and embedded together
+UPLOAD_CHUNK_BATCH = 256  # chunks embedded together for DOCX/TXT uploads
+
+
+class UploadQueueFull(Exception):
+    pass
+
+
+_parser_pool = None
+_parser_pool_pid = None  # process that forked the parsers; a pool inherited through fork is unusable
+_parser_pool_lock = threading.Lock()
+
+
+def start_parser_pool(processes=UPLOAD_PARSE_PROCESSES):
+    """
+    Forks this process's PDF parser processes. Call it before any thread is started:
+    early in app.py, or from gunicorn's post_fork hook (see gunicorn.conf.py).
+
+    Parsers are forked, not spawned: spawn and forkserver children re-import __main__,
+    and main.py runs preprocessing and starts the warm-up at import. Forking once from
+    a single-threaded process means no lock held by another thread is copied into them.
+    Does nothing if the pool is already running in this process or processes is 0.
+    """
+    global _parser_pool, _parser_pool_pid
+    if processes <= 0 or "fork" not in multiprocessing.get_all_start_methods():
+        return None
+    with _parser_pool_lock:
+        if _parser_pool is None or _parser_pool_pid != os.getpid():
+            _parser_pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("fork"))
+            # With fork, the first submit starts every worker process up front
+            _parser_pool.submit(os.getpid).result()
+            _parser_pool_pid = os.getpid()
+            logger.info(f"Started {processes} PDF parser processes (pid {os.getpid()}).")
+    return _parser_pool
+
+
+def get_parser_pool():
+    """:return: The parser pool started in this process, or None if start_parser_pool() was not called here."""
+    return _parser_pool if _parser_pool_pid == os.getpid() else None
+
+
+def parse_pdf_pages(path, start, stop):
+    """Text of pages [start, stop) as (page_number, text) pairs; runs in a parser process."""
+    import fitz
+    with fitz.open(path) as doc:
+        return [(n + 1, doc[n].get_text("text")) for n in range(start, min(stop, doc.page_count))]
+
+
+def pdf_page_count(path):
+    import fitz
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+
+class UploadIngestor:
+    """
+    Background ingestion of chat uploads.
+
+    Jobs run on a bounded thread pool; PDF pages are parsed in batches by a small
+    process pool (see start_parser_pool), so PyMuPDF does not hold the GIL of the
+    serving process. Each batch is chunked, embedded and added to the session's uploads
+    as soon as it is parsed, so chat turns can use the first pages while the rest of the
+    file is processed. Job status lives in the session store, so any worker can report it.
+    Clearing (or evicting) the session removes its jobs; a running job notices before its
+    next batch and stops without re-creating the session.
+    """
+
+    def __init__(self, chatbot, workers=UPLOAD_WORKERS, queue_max=UPLOAD_QUEUE_MAX,
+                 parse_processes=UPLOAD_PARSE_PROCESSES, page_batch=UPLOAD_PAGE_BATCH):
+        self.chatbot = chatbot
+        self.sessions = chatbot.sessions
+        self.queue_max = queue_max
+        self.parse_processes = parse_processes
+        self.page_batch = max(page_batch, 1)
+        self._executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="upload")
+        self._warned_no_pool = False
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self.pages_parsed = 0
+        self.chunks_embedded = 0
+
+    @property
+    def parser_pool(self):
+        if self.parse_processes <= 0:
+            return None
+        pool = get_parser_pool()
+        if pool is None and not self._warned_no_pool:
+            # Forking now, from a process serving requests on several threads, is not safe
+            self._warned_no_pool = True
+            logger.warning("PDF parser processes were not started in this worker; parsing PDFs in the job thread.")
+        return pool
+
+    def submit(self, session_id, file_path, doc_name):
+        """
+        Queues an uploaded file for ingestion.
+
+        :param doc_name: Name shown in citations (the original file name).
+        :return: The job status dictionary (see get_job).
+        :raises UploadQueueFull: if queue_max jobs are already queued or running.
+        """
+        with self._lock:
+            if self.pending >= self.queue_max:
+                self.rejected += 1
+                raise UploadQueueFull(f"{self.pending} uploads are already being processed")
+            self.pending += 1
+            self.submitted += 1
+        now = time.time()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "session_id": session_id,
+            "file": doc_name,
+            "status": "queued",
+            "pages_total": None,
+            "pages_parsed": 0,
+            "chunks_embedded": 0,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        self.sessions.put_job(job)
+        self._executor.submit(self._run, job, file_path)
+        logger.info(f"Queued upload job {job['job_id']} for {doc_name} (session {session_id}).")
+        return job
+
+    def get_job(self, job_id):
+        """
+        :return: Dictionary with "job_id", "session_id", "file", "status" (queued, running,
+                 done or failed), "pages_total", "pages_parsed", "chunks_embedded" and "error",
+                 or None for an unknown job.
+        """
+        return self.sessions.get_job(job_id)
+
+    def _save(self, job, **changes):
+        job.update(changes, updated_at=time.time())
+        if not self.sessions.put_job(job, create=False):
+            raise UploadCancelled(f"upload job {job['job_id']} no longer exists")
+
+    def _run(self, job, file_path):
+        start = time.perf_counter()
+        try:
+            self._save(job, status="running")
+            if file_path.lower().endswith(".pdf"):
+                self._ingest_pdf(job, file_path)
+            else:
+                chunks = self.chatbot.extract_upload_chunks(file_path)
+                for i in range(0, len(chunks), UPLOAD_CHUNK_BATCH):
+                    self._ingest_chunks(job, chunks[i:i + UPLOAD_CHUNK_BATCH])
+            if not job["chunks_embedded"]:
+                raise ValueError("no text could be extracted")
+            self._save(job, status="done")
+            outcome = "completed"
+            logger.info(
+                f"Upload job {job['job_id']} indexed {job['chunks_embedded']} chunks from {job['file']} "
+                f"in {time.perf_counter() - start:.2f}s."
+            )
+        except UploadCancelled:
+            logger.info(f"Upload job {job['job_id']} for {job['file']} stopped: its session was cleared.")
+            outcome = "cancelled"
+        except Exception as e:
+            logger.error(f"Upload job {job['job_id']} for {job['file']} failed: {e}")
+            try:
+                self._save(job, status="failed", error=str(e))
+            except UploadCancelled:
+                pass
+            outcome = "failed"
+        with self._lock:
+            self.pending -= 1
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def _parsed_batches(self, file_path, batches):
+        """Parsed page batches in page order, keeping up to two batches per parser in flight."""
+        pool = self.parser_pool
+        if pool is None:
+            for start, stop in batches:
+                yield parse_pdf_pages(file_path, start, stop)
+            return
+        in_flight = deque()
+        pending = iter(batches)
+        for start, stop in pending:
+            in_flight.append(pool.submit(parse_pdf_pages, file_path, start, stop))
+            if len(in_flight) >= 2 * self.parse_processes:
+                break
+        while in_flight:
+            pages = in_flight.popleft().result()
+            next_batch = next(pending, None)
+            if next_batch is not None:
+                in_flight.append(pool.submit(parse_pdf_pages, file_path, *next_batch))
+            yield pages
+
+    def _ingest_pdf(self, job, file_path):
+        total = pdf_page_count(file_path)
+        self._save(job, pages_total=total)
+        batches = [(start, min(start + self.page_batch, total)) for start in range(0, total, self.page_batch)]
+        for pages in self._parsed_batches(file_path, batches):
+            chunks = []
+            for page_number, page_text in pages:
+                chunks.extend(self.chatbot.embedder.split_page_into_chunks(page_number, page_text))
+            self._ingest_chunks(job, chunks, pages=len(pages))
+
+    def _ingest_chunks(self, job, chunks, pages=0):
+        # Checked before embedding to skip the work; add_upload checks again atomically
+        if self.sessions.get_job(job["job_id"]) is None:
+            raise UploadCancelled(f"upload job {job['job_id']} no longer exists")
+        indexed = 0
+        if chunks:
+            indexed = self.chatbot.index_upload_chunks(job["session_id"], job["file"], chunks, job_id=job["job_id"])
+        with self._lock:
+            self.pages_parsed += pages
+            self.chunks_embedded += indexed
+        self._save(job, pages_parsed=job["pages_parsed"] + pages, chunks_embedded=job["chunks_embedded"] + indexed)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": self.pending,
+                "queue_max": self.queue_max,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "cancelled": self.cancelled,
+                "rejected": self.rejected,
+                "pages_parsed": self.pages_parsed,
+                "chunks_embedded": self.chunks_embedded,
+                "parse_processes": self.parse_processes,
+            }
+
+
+_ingestor = None
+_ingestor_lock = threading.Lock()
+
+
+def get_upload_ingestor():
+    """Returns the process-wide UploadIngestor, built around the shared Chatbot."""
+    global _ingestor
+    if _ingestor is None:
+        with _ingestor_lock:
+            if _ingestor is None:
+                from components import get_chatbot
+                _ingestor = UploadIngestor(get_chatbot())
+    return _ingestor
+
+
+def upload_jobs_stats():
+    return _ingestor.stats() if _ingestor is not None else None
@@ -3,7 +3,7 @@ import json
 import os
 import numpy as np
 import faiss
-from sentence_transformers import SentenceTransformer
+from model_registry import get_embedding_model
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -16,7 +16,7 @@ METADATA_FILE = os.path.join(VECTOR_STORE_DIR, "document_metadata.json")
 os.makedirs(VECTOR_STORE_DIR, exist_ok=True)
 
 # Load embedding model
-embedding_model = SentenceTransformer("all-mpnet-base-v2")
+embedding_model = get_embedding_model("all-mpnet-base-v2")
 
 class VectorStore:
     def __init__(self):
@@ -60,7 +60,7 @@ class VectorStore:
             logger.warning("No documents in vector store.")
             return []
 
-        query_embedding = embedding_model.encode([query], normalize_embeddings=True, convert_to_numpy=True).astype("float")
+        query_embedding = embedding_model.encode_queries([query])
         distances, indices = self.index.search(query_embedding, top_k)
 
         results = []